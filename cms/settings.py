@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -33,7 +34,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.CatalogFeedMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -41,14 +44,15 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'core.middleware.StaticFilesMiddleware',
 ]
 
 ROOT_URLCONF = 'cms.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Django's backend, timing renders for core.middleware.RequestMetricsMiddleware
+        'BACKEND': 'core.metrics.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -74,6 +78,70 @@ DATABASES = {
     }
 }
 
+# Production SQLite mode: WAL with pragmas set on every new connection, connections
+# kept across requests, and reads outside transactions sent to a read-only
+# connection (see core.routers). Compare with `manage.py sqlite_concurrency_bench`.
+SQLITE_PRODUCTION = not DEBUG
+SQLITE_PRAGMAS = [
+    'journal_mode=WAL',
+    'synchronous=NORMAL',
+    'busy_timeout=5000',
+    'cache_size=-20000',  # KiB, about 20 MB per connection
+    'mmap_size=134217728',
+    'temp_store=MEMORY',
+]
+SQLITE_READ_PRAGMAS = [pragma for pragma in SQLITE_PRAGMAS if not pragma.startswith('journal_mode')] + ['query_only=1']
+
+if SQLITE_PRODUCTION:
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': ';'.join(f'PRAGMA {pragma}' for pragma in SQLITE_PRAGMAS),
+            # Take the write lock at BEGIN so a transaction that reads first never
+            # fails to upgrade its lock with "database is locked"
+            'transaction_mode': 'IMMEDIATE',
+        },
+    })
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f"file:{DATABASES['default']['NAME']}?mode=ro",
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'uri': True,
+            'init_command': ';'.join(f'PRAGMA {pragma}' for pragma in SQLITE_READ_PRAGMAS),
+        },
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS = ['core.routers.ReadReplicaRouter']
+
+# Run cart and order writes on one writer thread per process, several per commit
+# (see core.writer); off, they run in the request thread. Off by default: in
+# sqlite_concurrency_bench (32 threads, 90% writes) the queue did 267 writes/s
+# at 138 ms p95, request-thread writes 355 writes/s at 540 ms p95. Set
+# WRITE_QUEUE=1 where the slowest checkouts matter more than write throughput,
+# after running the benchmark against that deployment.
+WRITE_QUEUE = os.environ.get('WRITE_QUEUE') == '1'
+WRITE_QUEUE_MAX_BATCH = 50
+WRITE_QUEUE_TIMEOUT = 10
+
+# Per-request timing (see core.middleware.RequestMetricsMiddleware): a Server-Timing
+# header on every response and per-route histograms at /metrics.
+# The histograms live in each server process: with several workers a scrape
+# only sees the one that answered it, so scrape every worker on its own
+# address (or run a single worker) and let Prometheus sum the series.
+REQUEST_METRICS = True
+# /metrics answers staff users and requests sending "Authorization: Bearer <METRICS_TOKEN>"
+# (set it in Prometheus' scrape config); empty turns token access off
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Put the slowest query's SQL (without parameters) in the Server-Timing header
+SERVER_TIMING_SQL = DEBUG
+SLOW_QUERY_MS = 200
+
+# Route the cart and catalog JSON endpoints to core.async_views (for ASGI servers)
+ASYNC_VIEWS = False
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -119,6 +187,44 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 
+# Catalog snapshot feed (see core.catalog and the export_catalog_snapshot command)
+CATALOG_FEED_ROOT = BASE_DIR / 'feeds' / 'catalog'
+CATALOG_FEED_URL = '/feeds/catalog/'
+CATALOG_FEED_POINTER_MAX_AGE = 60
+CATALOG_SNAPSHOTS_TO_KEEP = 5
+# Rebuild the snapshot in the background after catalog edits (debounced)
+CATALOG_SNAPSHOT_ON_CHANGE = False
+CATALOG_SNAPSHOT_DEBOUNCE_SECONDS = 30
+
+# How long an item added to a cart holds its stock (see core.models.StockReservation)
+STOCK_RESERVATION_MINUTES = 15
+
+# Carts not updated for this long are deleted by purge_abandoned_carts
+ABANDONED_CART_DAYS = 30
+
+# Resized copies of Category/Product images (see core.images); 0 workers renders inline
+IMAGE_VARIANT_WIDTHS = [320, 640, 960, 1280]
+IMAGE_VARIANT_FORMATS = ['avif', 'webp', 'jpeg']
+IMAGE_VARIANT_QUALITY = 75
+IMAGE_VARIANT_WORKERS = 2
+
+# Rendered product cards (see core.fragments). Entries are keyed by Product.version,
+# so any backend works: LocMemCache per process, FileBasedCache shared between
+# processes on one host (e.g. LOCATION BASE_DIR / 'cache' / 'cards'), DummyCache to disable.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'product_cards': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'product-cards',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+PRODUCT_CARD_CACHE = 'product_cards'
+PRODUCT_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
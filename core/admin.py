@@ -1,10 +1,40 @@
-from django.contrib import admin
+import csv
+import io
+
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import PermissionDenied
+from django.db.models import Q
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils import timezone
 from django.utils.html import format_html
-from .models import Category, Product, Color, ProductSize, Cart, CartItem, Order, OrderItem
+from . import catalog_io, order_export, search
+from .pagination import EstimatedCountPaginator
+from .streaming import streaming_download
+from .models import Category, Product, Color, ProductSize, Cart, CartItem, StockReservation, Order, OrderItem
+
+class EstimatedCountChangeList(ChangeList):
+    def get_results(self, request):
+        super().get_results(request)
+        # The paginator may have corrected an overestimated count while reading the page
+        self.result_count = self.paginator.count
+        self.multi_page = self.result_count > self.list_per_page
+        self.page_num = min(self.page_num, self.paginator.num_pages)
+
+class EstimatedCountMixin:
+    """Changelist of a big table, with an estimated unfiltered count (see EstimatedCountPaginator)"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    def get_changelist(self, request, **kwargs):
+        return EstimatedCountChangeList
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ['name', 'is_active', 'created_at']
+    list_display = ['name', 'product_count', 'is_active', 'created_at']
     list_filter = ['is_active', 'created_at']
     search_fields = ['name', 'description']
     ordering = ['name']
@@ -19,41 +49,128 @@ class ColorInline(admin.TabularInline):
     extra = 1
     fields = ['name', 'hex_code']
 
+class CatalogImportForm(forms.Form):
+    file = forms.FileField(help_text='CSV or JSONL with the columns of an export; rows are matched on sku.')
+    format = forms.ChoiceField(
+        choices=[('', 'From the file extension'), ('csv', 'CSV'), ('jsonl', 'JSONL')],
+        required=False,
+    )
+
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
-    list_display = ['name', 'category', 'gender', 'base_price', 'is_active', 'created_at']
+class ProductAdmin(EstimatedCountMixin, admin.ModelAdmin):
+    list_display = ['name', 'sku', 'category', 'gender', 'min_price', 'max_price', 'total_stock', 'is_active', 'created_at']
     list_filter = ['category', 'gender', 'is_active', 'created_at']
-    search_fields = ['name', 'description']
+    search_fields = ['name', 'description', 'sku']
     ordering = ['-created_at']
-    readonly_fields = ['base_price']
+    readonly_fields = ['min_price', 'max_price', 'total_stock']
     inlines = [ProductSizeInline, ColorInline]
+    actions = ['export_csv', 'export_jsonl']
+    list_select_related = ['category']
+    
+    def get_search_results(self, request, queryset, search_term):
+        # Use the FTS5 index instead of icontains scans over name/description
+        if not search.is_available():
+            return super().get_search_results(request, queryset, search_term)
+        match = search.build_match_query(search_term)
+        if match is None:
+            return queryset, False
+        return queryset.filter(Q(pk__in=search.matching_ids_sql(match)) | Q(sku=search_term.strip())), False
+    
+    def get_urls(self):
+        urls = [
+            path('import/', self.admin_site.admin_view(self.import_view), name='core_product_import'),
+        ]
+        return urls + super().get_urls()
+    
+    def export(self, queryset, fmt):
+        # Streamed in chunks, the export of a whole catalog never sits in memory
+        return streaming_download(catalog_io.export_lines(queryset, fmt), f'products.{fmt}', fmt)
+    
+    @admin.action(description='Export selected products as CSV')
+    def export_csv(self, request, queryset):
+        return self.export(queryset, 'csv')
+    
+    @admin.action(description='Export selected products as JSONL')
+    def export_jsonl(self, request, queryset):
+        return self.export(queryset, 'jsonl')
+    
+    def import_view(self, request):
+        if not self.has_change_permission(request) or not self.has_add_permission(request):
+            raise PermissionDenied
+        form = CatalogImportForm(request.POST or None, request.FILES or None)
+        result = None
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            fmt = form.cleaned_data['format'] or catalog_io.guess_format(upload.name)
+            # Large uploads are spooled to a temporary file and read line by line from there
+            stream = io.TextIOWrapper(upload, encoding='utf-8-sig', newline='')
+            try:
+                result = catalog_io.import_file(stream, fmt)
+            except (catalog_io.CatalogFileError, UnicodeDecodeError, csv.Error) as exc:
+                form.add_error('file', str(exc))
+            else:
+                level = messages.WARNING if result.error_count else messages.SUCCESS
+                self.message_user(request, f'Imported {upload.name}: {result.summary()}.', level)
+                if not result.error_count:
+                    return redirect('admin:core_product_changelist')
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Import products',
+            'form': form,
+            'result': result,
+            'columns': catalog_io.COLUMNS,
+        }
+        return TemplateResponse(request, 'admin/core/product/import.html', context)
 
 @admin.register(Color)
-class ColorAdmin(admin.ModelAdmin):
+class ColorAdmin(EstimatedCountMixin, admin.ModelAdmin):
     list_display = ['name', 'hex_code', 'product']
-    list_filter = ['product']
+    # A filter on product would list every product in the sidebar
+    list_filter = ['product__category']
     search_fields = ['name', 'product__name']
+    list_select_related = ['product__category']
+    raw_id_fields = ['product']
 
 @admin.register(ProductSize)
-class ProductSizeAdmin(admin.ModelAdmin):
+class ProductSizeAdmin(EstimatedCountMixin, admin.ModelAdmin):
     list_display = ['product', 'size', 'price', 'stock_quantity', 'is_available']
-    list_filter = ['is_available', 'size', 'product__category']
+    # No filter on size: its choices need a DISTINCT over every size row; search finds sizes
+    list_filter = ['is_available', 'product__category']
     search_fields = ['product__name', 'size']
-    ordering = ['product__name', 'size']
+    # The (product, size) unique index order; sorting on product__name joins and sorts the whole table
+    ordering = ['product_id', 'size']
+    list_select_related = ['product__category']
+    raw_id_fields = ['product']
 
 class CartItemInline(admin.TabularInline):
     model = CartItem
     extra = 0
     readonly_fields = ['total_price']
+    # Plain <select>s would list every product and color on each row
+    raw_id_fields = ['product', 'color']
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
     list_display = ['session_id', 'total_items', 'total_amount', 'created_at']
     list_filter = ['created_at']
     search_fields = ['session_id']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['total_items', 'total_amount', 'created_at', 'updated_at']
     inlines = [CartItemInline]
     ordering = ['-created_at']
+    actions = ['recalculate_totals']
+    # Purged carts leave the highest id far above the row count: counted exactly (see EstimatedCountPaginator)
+    show_full_result_count = False
+    
+    def save_related(self, request, form, formsets, change):
+        # Inline item edits bypass the Cart item methods, recompute from the rows
+        super().save_related(request, form, formsets, change)
+        Cart.recalculate_totals([form.instance.pk])
+    
+    @admin.action(description='Recalculate totals of selected carts')
+    def recalculate_totals(self, request, queryset):
+        updated = Cart.recalculate_totals(queryset.values('pk'))
+        self.message_user(request, f'Recalculated totals of {updated} carts.')
 
 @admin.register(CartItem)
 class CartItemAdmin(admin.ModelAdmin):
@@ -61,17 +178,58 @@ class CartItemAdmin(admin.ModelAdmin):
     list_filter = ['cart__created_at', 'product__category']
     search_fields = ['product__name', 'cart__session_id']
     readonly_fields = ['total_price']
+    list_select_related = ['cart', 'product__category', 'color__product']
+    raw_id_fields = ['cart', 'product', 'color']
+    # Items go with purged carts, counted exactly like the carts
+    show_full_result_count = False
+    
+    def save_model(self, request, obj, form, change):
+        previous_cart_id = form.initial.get('cart')
+        super().save_model(request, obj, form, change)
+        Cart.recalculate_totals({obj.cart_id, previous_cart_id} - {None})
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        Cart.recalculate_totals([obj.cart_id])
+    
+    def delete_queryset(self, request, queryset):
+        cart_ids = set(queryset.values_list('cart_id', flat=True))
+        super().delete_queryset(request, queryset)
+        Cart.recalculate_totals(cart_ids)
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ['product_size', 'cart', 'quantity', 'expires_at', 'created_at']
+    list_filter = ['expires_at']
+    search_fields = ['product_size__product__name', 'cart__session_id']
+    list_select_related = ['product_size__product', 'cart']
+    raw_id_fields = ['product_size', 'cart']
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
     readonly_fields = ['total_price']
+    raw_id_fields = ['product', 'color']
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(EstimatedCountMixin, admin.ModelAdmin):
     list_display = ['order_id', 'customer_name', 'total_amount', 'status', 'created_at']
     list_filter = ['status', 'created_at']
     search_fields = ['order_id', 'customer_name', 'phone_number']
     readonly_fields = ['order_id', 'created_at', 'updated_at']
     inlines = [OrderItemInline]
     ordering = ['-created_at']
+    actions = ['export_csv', 'export_jsonl']
+    
+    def export(self, queryset, fmt):
+        # "Select all" exports the whole filtered changelist, streamed as it is read
+        filename = f'orders-{timezone.localtime():%Y%m%d-%H%M%S}.{fmt}'
+        return streaming_download(order_export.export_lines(queryset, fmt), filename, fmt)
+    
+    @admin.action(description='Export selected orders with their items as CSV')
+    def export_csv(self, request, queryset):
+        return self.export(queryset, 'csv')
+    
+    @admin.action(description='Export selected orders with their items as JSONL')
+    def export_jsonl(self, request, queryset):
+        return self.export(queryset, 'jsonl')
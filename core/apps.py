@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # metrics hooks its query timer into every database connection opened from here on
+        from . import metrics, signals  # noqa: F401
@@ -0,0 +1,159 @@
+import json
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.shortcuts import aget_object_or_404
+from django.template.loader import render_to_string
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_http_methods
+
+from . import facets, fragments, writer
+from .models import Cart, Category, Color, EmptyCart, Product, ProductSize, StockReservation
+from .pagination import akeyset_page
+from .views import (
+    CATEGORY_PAGE_SIZE, PRODUCT_SIZE_FIELDS, _cart_response, _missing_cart_item, _product_card_data,
+    _product_sizes_aggregates, _product_sizes_etag, _product_sizes_last_modified, _product_sizes_response,
+    _requested_cart_line, _requested_product_ids, _requested_quantity, add_to_visitor_cart, category_products,
+)
+
+
+async def aget_cart(request):
+    """get_cart() for async views: the visitor's cart, or an EmptyCart without any write"""
+    session_id = request.session.session_key
+    if not session_id:
+        return EmptyCart()
+    return await Cart.objects.filter(session_id=session_id).afirst() or EmptyCart()
+
+
+@require_http_methods(["GET"])
+async def category_products_api(request, category_id):
+    """Next page of a category listing for infinite scroll, with the same facet filters as the page.
+
+    Pass ?facets=1 to also get the facet counts.
+    """
+    try:
+        category = await aget_object_or_404(Category, id=category_id)
+        selection = facets.parse_selection(request.GET)
+        products, next_cursor = await akeyset_page(
+            facets.filter_products(category_products(category), category, selection),
+            request.GET.get('after'),
+            CATEGORY_PAGE_SIZE
+        )
+
+        product_data = await fragments.acached_per_product(products, 'data', _product_card_data)
+        html = ''.join(
+            render_to_string('core/_product_card.html', {'product': product, 'index': None}, request=request)
+            for product in await fragments.arender_product_cards(products)
+        )
+
+        response = {
+            'success': True,
+            'products': product_data,
+            'html': html,
+            'next_cursor': next_cursor
+        }
+        if request.GET.get('facets'):
+            response['facets'] = await sync_to_async(facets.facet_counts)(category, selection)
+        return JsonResponse(response)
+
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)})
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def add_to_cart(request):
+    try:
+        product_id, size, color_id, quantity = _requested_cart_line(json.loads(request.body))
+
+        product = await aget_object_or_404(Product, id=product_id)
+        color = await aget_object_or_404(Color, id=color_id, product=product) if color_id else None
+        await sync_to_async(StockReservation.check_available)(product.id, size, quantity)
+
+        cart = await writer.awrite(add_to_visitor_cart, request, product, size, color, quantity)
+
+        return _cart_response(cart)
+
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)})
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def update_cart_item(request):
+    try:
+        data = json.loads(request.body)
+        quantity = _requested_quantity(data)
+
+        cart = await aget_cart(request)
+        cart_item = await cart.items.filter(id=data.get('item_id')).afirst()
+        if cart_item is None:
+            return _missing_cart_item()
+        await writer.awrite(cart.set_item_quantity, cart_item, quantity)
+
+        return _cart_response(cart, item_total=str(cart_item.total_price))
+
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)})
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def remove_from_cart(request):
+    try:
+        data = json.loads(request.body)
+
+        cart = await aget_cart(request)
+        cart_item = await cart.items.filter(id=data.get('item_id')).afirst()
+        if cart_item is None:
+            return _missing_cart_item()
+        await writer.awrite(cart.remove_item, cart_item)
+
+        return _cart_response(cart)
+
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)})
+
+
+def _load_product_sizes_state(view):
+    """Run the validator query asynchronously before @condition reads it from the request"""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        state = None
+        try:
+            product_ids = _requested_product_ids(request)
+        except ValueError:
+            product_ids = []
+        if product_ids:
+            state = await Product.objects.filter(pk__in=product_ids).aaggregate(**_product_sizes_aggregates())
+            state['product_ids'] = product_ids
+        request._product_sizes_state = state
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+@csrf_exempt
+@require_http_methods(["GET"])
+@_load_product_sizes_state
+@condition(etag_func=_product_sizes_etag, last_modified_func=_product_sizes_last_modified)
+async def get_product_sizes(request):
+    """Sizes, prices and stock of one product (?product_id=) or many (?product_ids=1,2,3)"""
+    try:
+        bulk = 'product_ids' in request.GET
+        product_ids = _requested_product_ids(request)
+        if not product_ids:
+            return JsonResponse({'success': False, 'error': 'Product ID is required'})
+
+        state = request._product_sizes_state
+        if not state['products']:
+            return JsonResponse({'success': False, 'error': 'No Product matches the given query.'})
+
+        sizes = [
+            size async for size in
+            ProductSize.objects.filter(product_id__in=product_ids).values(*PRODUCT_SIZE_FIELDS).aiterator()
+        ]
+        return _product_sizes_response(bulk, product_ids, sizes)
+
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)})
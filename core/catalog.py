@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, connection
+from django.utils import timezone
+from whitenoise.compress import Compressor
+
+from .models import Category, Product
+
+POINTER_NAME = 'latest.json'
+SNAPSHOT_PREFIX = 'catalog-'
+PRODUCT_CHUNK_SIZE = 2000
+
+
+def feed_root():
+    return os.fspath(settings.CATALOG_FEED_ROOT)
+
+
+def _category_data(category):
+    return {
+        'id': category.id,
+        'name': category.name,
+        'description': category.description,
+        'image': category.image.url if category.image else None,
+        'product_count': category.product_count,
+    }
+
+
+def _product_data(product):
+    return {
+        'id': product.id,
+        'name': product.name,
+        'description': product.description,
+        'category_id': product.category_id,
+        'gender': product.gender,
+        'video_url': product.video_url,
+        'image': product.image.url if product.image else None,
+        'min_price': product.min_price,
+        'max_price': product.max_price,
+        'total_stock': product.total_stock,
+        'updated_at': product.updated_at,
+        'sizes': [
+            {
+                'size': size.size,
+                'price': size.price,
+                'stock_quantity': size.stock_quantity,
+                'is_available': size.is_available,
+            }
+            for size in product.product_sizes.all()
+        ],
+        'colors': [
+            {'id': color.id, 'name': color.name, 'hex_code': color.hex_code}
+            for color in product.colors.all()
+        ],
+    }
+
+
+def _dumps(data):
+    return json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':'), ensure_ascii=False)
+
+
+def read_pointer():
+    """Return the current latest.json contents, or None before the first snapshot"""
+    try:
+        with open(os.path.join(feed_root(), POINTER_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_snapshot(if_changed=False, keep=None):
+    """Write a versioned JSON and JSONL snapshot of the active catalog plus compressed copies.
+
+    Products are read in chunks and written as they are read, so memory stays
+    flat. latest.json is replaced last, atomically, so readers never see a
+    half-written version. With if_changed, a snapshot whose content matches
+    the current one is discarded. Returns the pointer data.
+    """
+    compressor = Compressor(quiet=True)
+    if not compressor.use_brotli:
+        # WhiteNoise silently skips the .br copies without the Brotli package
+        raise ImproperlyConfigured('Catalog snapshots need the Brotli package for their .br copies')
+    root = feed_root()
+    os.makedirs(root, exist_ok=True)
+    generated_at = timezone.now().astimezone(dt_timezone.utc)
+    version = generated_at.strftime('%Y%m%dT%H%M%S%fZ')
+    json_name = f'{SNAPSHOT_PREFIX}{version}.json'
+    jsonl_name = f'{SNAPSHOT_PREFIX}{version}.jsonl'
+    json_path = os.path.join(root, json_name)
+    jsonl_path = os.path.join(root, jsonl_name)
+    
+    digest = hashlib.sha256()
+    product_total = 0
+    categories = [_category_data(category) for category in Category.objects.filter(is_active=True)]
+    products = (
+        Product.objects.filter(is_active=True, category__is_active=True)
+        .order_by('id')
+        .prefetch_related('product_sizes', 'colors')
+    )
+    
+    with open(json_path, 'w', encoding='utf-8') as json_file, open(jsonl_path, 'w', encoding='utf-8') as jsonl_file:
+        header = _dumps({'version': version, 'generated_at': generated_at})
+        json_file.write(header[:-1] + ',"categories":' + _dumps(categories) + ',"products":[')
+        for category in categories:
+            line = _dumps({'type': 'category', **category})
+            digest.update(line.encode())
+            jsonl_file.write(line + '\n')
+        for product in products.iterator(chunk_size=PRODUCT_CHUNK_SIZE):
+            data = _product_data(product)
+            json_file.write((',' if product_total else '') + _dumps(data))
+            line = _dumps({'type': 'product', **data})
+            digest.update(line.encode())
+            jsonl_file.write(line + '\n')
+            product_total += 1
+        json_file.write(']}')
+    
+    previous = read_pointer()
+    if if_changed and previous and previous.get('sha256') == digest.hexdigest():
+        os.remove(json_path)
+        os.remove(jsonl_path)
+        return previous
+    
+    for path in (json_path, jsonl_path):
+        compressor.compress(path)
+    
+    pointer = {
+        'version': version,
+        'generated_at': generated_at.isoformat(),
+        'sha256': digest.hexdigest(),
+        'products': product_total,
+        'categories': len(categories),
+        'json': json_name,
+        'jsonl': jsonl_name,
+    }
+    pointer_tmp = os.path.join(root, f'.{POINTER_NAME}.tmp')
+    with open(pointer_tmp, 'w', encoding='utf-8') as f:
+        f.write(_dumps(pointer))
+    os.replace(pointer_tmp, os.path.join(root, POINTER_NAME))
+    
+    prune_snapshots(keep if keep is not None else settings.CATALOG_SNAPSHOTS_TO_KEEP)
+    return pointer
+
+
+def prune_snapshots(keep):
+    """Delete all but the newest keep snapshot versions (and their compressed copies)"""
+    root = feed_root()
+    versions = sorted({
+        name[len(SNAPSHOT_PREFIX):].split('.', 1)[0]
+        for name in os.listdir(root) if name.startswith(SNAPSHOT_PREFIX)
+    }, reverse=True)
+    for version in versions[keep:]:
+        for name in os.listdir(root):
+            if name.startswith(f'{SNAPSHOT_PREFIX}{version}.'):
+                os.remove(os.path.join(root, name))
+
+
+def is_immutable_feed_file(path, url):
+    """Versioned snapshot files never change once written; latest.json does"""
+    return os.path.basename(url).startswith(SNAPSHOT_PREFIX)
+
+
+_pending_snapshot = None
+_pending_lock = threading.Lock()
+
+
+def _run_scheduled_snapshot():
+    global _pending_snapshot
+    with _pending_lock:
+        _pending_snapshot = None
+    close_old_connections()
+    try:
+        write_snapshot(if_changed=True)
+    finally:
+        connection.close()
+
+
+def schedule_snapshot():
+    """Rebuild the snapshot shortly after catalog changes, once per burst of changes"""
+    global _pending_snapshot
+    with _pending_lock:
+        if _pending_snapshot is not None:
+            return
+        _pending_snapshot = threading.Timer(settings.CATALOG_SNAPSHOT_DEBOUNCE_SECONDS, _run_scheduled_snapshot)
+        _pending_snapshot.daemon = True
+        _pending_snapshot.start()
@@ -0,0 +1,439 @@
+import csv
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+
+from . import catalog
+from .facets import refresh_product_facets
+from .models import Category, Color, Product, ProductSize
+from .streaming import format_lines
+
+# One row per size of a product (one row without size columns for a product
+# without sizes); the product columns and colors repeat on each of its rows
+COLUMNS = [
+    'sku', 'name', 'description', 'category', 'gender', 'is_active', 'video_url',
+    'size', 'price', 'stock_quantity', 'is_available', 'colors',
+]
+FORMATS = ['csv', 'jsonl']
+PRODUCT_FIELDS = ['name', 'description', 'category_id', 'gender', 'is_active', 'video_url']
+SIZE_FIELDS = ['price', 'stock_quantity', 'is_available']
+BOOLEAN_FIELDS = {'is_active', 'is_available'}
+BOOLEAN_STRINGS = {
+    '1': True, 'true': True, 't': True, 'yes': True, 'y': True,
+    '0': False, 'false': False, 'f': False, 'no': False, 'n': False,
+}
+BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 2000
+MAX_ERRORS = 100
+
+
+class CatalogFileError(ValueError):
+    """The file as a whole cannot be imported (e.g. it has no sku column)"""
+
+
+class RowError(ValueError):
+    pass
+
+
+class ParsedRow:
+    __slots__ = ('line', 'sku', 'product', 'size', 'size_values', 'colors')
+
+    def __init__(self, line, sku, product, size, size_values, colors):
+        self.line = line
+        self.sku = sku
+        self.product = product
+        self.size = size
+        self.size_values = size_values
+        self.colors = colors
+
+
+class ImportResult:
+    """Counters of an import plus the first max_errors row errors as (line, sku, message)"""
+
+    COUNTERS = (
+        'products_created', 'products_updated', 'sizes_created', 'sizes_updated',
+        'colors_created', 'colors_updated',
+    )
+
+    def __init__(self, max_errors=MAX_ERRORS):
+        self.rows = 0
+        for counter in self.COUNTERS:
+            setattr(self, counter, 0)
+        self.max_errors = max_errors
+        self.errors = []
+        self.error_count = 0
+
+    def add_counts(self, counts):
+        for counter, value in counts.items():
+            setattr(self, counter, getattr(self, counter) + value)
+
+    def add_error(self, line, sku, message):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line, sku, message))
+
+    @property
+    def changed(self):
+        return any(getattr(self, counter) for counter in self.COUNTERS)
+
+    def summary(self):
+        return (
+            f'{self.rows} rows: {self.products_created} products created, {self.products_updated} updated; '
+            f'{self.sizes_created} sizes created, {self.sizes_updated} updated; '
+            f'{self.colors_created} colors created, {self.colors_updated} updated; '
+            f'{self.error_count} rows with errors'
+        )
+
+
+def guess_format(filename, default='csv'):
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension in ('jsonl', 'ndjson'):
+        return 'jsonl'
+    if extension == 'csv':
+        return 'csv'
+    return default
+
+
+def read_rows(stream, fmt):
+    """(line number, row) pairs of a text stream, read one line at a time.
+
+    CSV rows are dicts of strings; JSONL rows are the undecoded lines, so a
+    broken line becomes an error of that row rather than of the file.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        if not reader.fieldnames or 'sku' not in reader.fieldnames:
+            raise CatalogFileError('The file has no sku column')
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line, text in enumerate(stream, 1):
+        if text.strip():
+            yield line, text
+
+
+def _present(raw, column):
+    """The value of a column, or None when the column is missing or empty (left unchanged)"""
+    value = raw.get(column)
+    if isinstance(value, str):
+        value = value.strip()
+    if value in (None, ''):
+        return None
+    return value
+
+
+def _clean(model, name, value):
+    if name in BOOLEAN_FIELDS and isinstance(value, str):
+        if value.lower() not in BOOLEAN_STRINGS:
+            raise RowError(f'{name}: "{value}" is not a yes/no value')
+        value = BOOLEAN_STRINGS[value.lower()]
+    try:
+        return model._meta.get_field(name).clean(value, None)
+    except ValidationError as exc:
+        raise RowError(f'{name}: {" ".join(exc.messages)}')
+
+
+def _escape_color(value):
+    return value.replace('\\', '\\\\').replace('|', '\\|').replace(':', '\\:')
+
+
+def _join_colors(colors):
+    """The CSV form of a product's colors, "Name:#hex|Name:#hex" with | : and \\ backslash-escaped"""
+    return '|'.join(f"{_escape_color(color['name'])}:{_escape_color(color['hex_code'])}" for color in colors)
+
+
+def _split_colors(value):
+    """[(name, hex_code)] of the CSV form; the last unescaped colon of an item ends the name"""
+    items, parts, chars = [], [''], iter(value)
+    for char in chars:
+        if char == '\\':
+            parts[-1] += next(chars, '')
+        elif char == ':':
+            parts.append('')
+        elif char == '|':
+            items.append(parts)
+            parts = ['']
+        else:
+            parts[-1] += char
+    items.append(parts)
+    pairs = []
+    for parts in items:
+        if len(parts) < 2:
+            raise RowError(f'colors: "{parts[0]}" is not Name:#hex')
+        pairs.append((':'.join(parts[:-1]), parts[-1]))
+    return pairs
+
+
+def _parse_colors(value):
+    """[(name, hex_code)] from "Name:#hex|Name:#hex" or a list of {name, hex_code}"""
+    if isinstance(value, str):
+        pairs = _split_colors(value)
+    elif isinstance(value, list) and all(isinstance(item, dict) for item in value):
+        pairs = [(item.get('name', ''), item.get('hex_code', '')) for item in value]
+    else:
+        raise RowError('colors: expected "Name:#hex|Name:#hex" or a list of {name, hex_code}')
+    return [
+        (_clean(Color, 'name', name.strip()), _clean(Color, 'hex_code', hex_code.strip()))
+        for name, hex_code in pairs
+    ]
+
+
+def parse_row(line, raw, category_ids):
+    """Validate one row into a ParsedRow, raising RowError; category_ids maps names to ids"""
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except ValueError as exc:
+            raise RowError(f'Invalid JSON: {exc}')
+        if not isinstance(raw, dict):
+            raise RowError('Expected a JSON object')
+    sku = _present(raw, 'sku')
+    if sku is None:
+        raise RowError('sku is required')
+    sku = _clean(Product, 'sku', str(sku))
+
+    product = {}
+    for name in ('name', 'description', 'gender', 'is_active', 'video_url'):
+        value = _present(raw, name)
+        if value is not None:
+            product[name] = _clean(Product, name, value)
+    category = _present(raw, 'category')
+    if category is not None:
+        if str(category) not in category_ids:
+            raise RowError(f'Unknown category "{category}"')
+        product['category_id'] = category_ids[str(category)]
+
+    size = _present(raw, 'size')
+    size_values = {}
+    if size is not None:
+        size = _clean(ProductSize, 'size', str(size))
+        for name in SIZE_FIELDS:
+            value = _present(raw, name)
+            if value is not None:
+                size_values[name] = _clean(ProductSize, name, value)
+
+    colors = _present(raw, 'colors')
+    if colors is not None:
+        colors = _parse_colors(colors)
+    return ParsedRow(line, sku, product, size, size_values, colors)
+
+
+def import_rows(rows, batch_size=BATCH_SIZE, max_errors=MAX_ERRORS):
+    """Upsert products, sizes and colors from (line, row) pairs, keyed by sku, size and color name.
+
+    Missing or empty columns leave the stored value unchanged and nothing is
+    ever deleted. Rows are written batch_size at a time, one transaction per
+    batch; a batch the database rejects is retried row by row so only the
+    offending rows fail. Signals are not sent: price ranges, facets and card
+    versions are refreshed per batch, category counts once at the end.
+    """
+    result = ImportResult(max_errors)
+    category_ids = {name: pk for pk, name in Category.objects.values_list('pk', 'name')}
+    batch = []
+    for line, raw in rows:
+        result.rows += 1
+        try:
+            batch.append(parse_row(line, raw, category_ids))
+        except RowError as exc:
+            sku = raw.get('sku') if isinstance(raw, dict) else None
+            result.add_error(line, sku, str(exc))
+        if len(batch) >= batch_size:
+            _import_batch(batch, result)
+            batch = []
+    if batch:
+        _import_batch(batch, result)
+    result.errors.sort(key=lambda error: error[0])
+
+    if result.changed:
+        Category.rebuild_product_counts()
+        if settings.CATALOG_SNAPSHOT_ON_CHANGE:
+            catalog.schedule_snapshot()
+    return result
+
+
+def import_file(stream, fmt, **kwargs):
+    return import_rows(read_rows(stream, fmt), **kwargs)
+
+
+def _import_batch(batch, result):
+    try:
+        with transaction.atomic():
+            counts, errors = _write_batch(batch)
+    except DatabaseError as exc:
+        if len(batch) == 1:
+            result.add_error(batch[0].line, batch[0].sku, f'Database error: {exc}')
+            return
+        for row in batch:
+            _import_batch([row], result)
+        return
+    result.add_counts(counts)
+    for error in errors:
+        result.add_error(*error)
+
+
+def _write_batch(batch):
+    """Merge the rows of a batch into the stored rows and upsert them; returns (counts, errors)"""
+    skus = {row.sku for row in batch}
+    existing = {
+        values.pop('sku'): values
+        for values in Product.objects.filter(sku__in=skus).values('sku', 'pk', *PRODUCT_FIELDS)
+    }
+    sku_of = {values['pk']: sku for sku, values in existing.items()}
+    existing_sizes = {
+        (sku_of[values.pop('product_id')], values.pop('size')): values
+        for values in ProductSize.objects.filter(product_id__in=sku_of).values('product_id', 'size', *SIZE_FIELDS)
+    }
+    existing_colors = {
+        (sku_of[product_id], name.strip().lower()): (pk, hex_code)
+        for pk, product_id, name, hex_code in Color.objects.filter(product_id__in=sku_of).values_list(
+            'pk', 'product_id', 'name', 'hex_code'
+        )
+    }
+
+    products, sizes, colors, errors = {}, {}, {}, []
+    for row in batch:
+        product = products.get(row.sku) or existing.get(row.sku)
+        if product is None:
+            missing = [name for name in ('name', 'category_id') if name not in row.product]
+            if missing:
+                errors.append((row.line, row.sku, 'A new product needs a name and a category'))
+                continue
+            product = {'description': '', 'gender': 'U', 'is_active': True, 'video_url': None}
+        size_key = (row.sku, row.size)
+        size = sizes.get(size_key) or existing_sizes.get(size_key)
+        if row.size is not None and size is None:
+            if 'price' not in row.size_values:
+                errors.append((row.line, row.sku, f'The new size {row.size} needs a price'))
+                continue
+            size = {'stock_quantity': 0, 'is_available': True}
+        products[row.sku] = {**product, **row.product}
+        if row.size is not None:
+            sizes[size_key] = {**size, **row.size_values}
+        for name, hex_code in row.colors or ():
+            colors[(row.sku, name.lower())] = (name, hex_code)
+
+    # Rows equal to the stored ones are not written, so re-importing an edited
+    # export only touches (and invalidates the cards of) what was edited
+    products = {
+        sku: values for sku, values in products.items()
+        if sku not in existing or any(values[name] != existing[sku][name] for name in PRODUCT_FIELDS)
+    }
+    sizes = {
+        key: values for key, values in sizes.items()
+        if key not in existing_sizes or values != existing_sizes[key]
+    }
+    Product.objects.bulk_create(
+        [
+            Product(sku=sku, **{name: values[name] for name in PRODUCT_FIELDS})
+            for sku, values in products.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['sku'],
+        update_fields=[*PRODUCT_FIELDS, 'updated_at'],
+    )
+    product_ids = {sku: values['pk'] for sku, values in existing.items()}
+    product_ids.update(
+        Product.objects.filter(sku__in=[sku for sku in products if sku not in existing]).values_list('sku', 'pk')
+    )
+    ProductSize.objects.bulk_create(
+        [
+            ProductSize(product_id=product_ids[sku], size=size, **values)
+            for (sku, size), values in sizes.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['product', 'size'],
+        update_fields=[*SIZE_FIELDS, 'updated_at'],
+    )
+    touched = {product_ids[sku] for sku in products}
+    touched.update(product_ids[sku] for sku, size in sizes)
+    new_colors, changed_colors = [], []
+    for (sku, key), (name, hex_code) in colors.items():
+        stored = existing_colors.get((sku, key))
+        if stored is None:
+            new_colors.append(Color(product_id=product_ids[sku], name=name, hex_code=hex_code))
+        elif stored[1] != hex_code:
+            changed_colors.append(Color(pk=stored[0], hex_code=hex_code))
+        else:
+            continue
+        touched.add(product_ids[sku])
+    Color.objects.bulk_create(new_colors)
+    Color.objects.bulk_update(changed_colors, ['hex_code'])
+
+    touched = list(touched)
+    if touched:
+        Product.refresh_price_ranges(touched)
+        refresh_product_facets(touched)
+        Product.bump_versions(touched)
+    created_products = sum(sku not in existing for sku in products)
+    created_sizes = sum(key not in existing_sizes for key in sizes)
+    counts = {
+        'products_created': created_products,
+        'products_updated': len(products) - created_products,
+        'sizes_created': created_sizes,
+        'sizes_updated': len(sizes) - created_sizes,
+        'colors_created': len(new_colors),
+        'colors_updated': len(changed_colors),
+    }
+    return counts, errors
+
+
+def export_rows(queryset):
+    """Rows of COLUMNS for the products of queryset, read in primary key order, a chunk at a time.
+
+    Plain value tuples rather than model instances with prefetch_related: an
+    export touches every size and color row, and instances cost several times
+    the query itself.
+    """
+    category_names = dict(Category.objects.values_list('pk', 'name'))
+    products = queryset.order_by('pk').values_list(
+        'pk', 'sku', 'name', 'description', 'category_id', 'gender', 'is_active', 'video_url'
+    )
+    last_pk = None
+    while True:
+        chunk = products if last_pk is None else products.filter(pk__gt=last_pk)
+        chunk = list(chunk[:EXPORT_CHUNK_SIZE])
+        if not chunk:
+            return
+        last_pk = chunk[-1][0]
+        ids = [product[0] for product in chunk]
+        sizes, colors = {}, {}
+        for product_id, *size in ProductSize.objects.filter(product_id__in=ids).values_list(
+            'product_id', 'size', 'price', 'stock_quantity', 'is_available'
+        ):
+            sizes.setdefault(product_id, []).append(size)
+        for product_id, name, hex_code in Color.objects.filter(product_id__in=ids).order_by('pk').values_list(
+            'product_id', 'name', 'hex_code'
+        ):
+            colors.setdefault(product_id, []).append({'name': name, 'hex_code': hex_code})
+
+        for pk, sku, name, description, category_id, gender, is_active, video_url in chunk:
+            row = {
+                'sku': sku,
+                'name': name,
+                'description': description,
+                'category': category_names[category_id],
+                'gender': gender,
+                'is_active': is_active,
+                'video_url': video_url,
+                'colors': colors.get(pk, []),
+            }
+            if pk not in sizes:
+                yield row
+            for size, price, stock_quantity, is_available in sizes.get(pk, ()):
+                yield {
+                    **row,
+                    'size': size,
+                    'price': price,
+                    'stock_quantity': stock_quantity,
+                    'is_available': is_available,
+                }
+
+
+def export_lines(queryset, fmt):
+    """Lines of a CSV or JSONL export of queryset, importable back with import_file()"""
+    rows = export_rows(queryset)
+    if fmt == 'csv':
+        rows = ({**row, 'colors': _join_colors(row['colors'])} for row in rows)
+    return format_lines(fmt, COLUMNS, rows)
@@ -0,0 +1,124 @@
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Now
+
+from .facets import refresh_product_facets
+from .models import Order, OrderItem, Product, ProductSize, StockReservation
+
+# Stock lines decremented per UPDATE statement, keeps the SQL parameter count bounded
+STOCK_UPDATE_BATCH_SIZE = 100
+
+
+class CartEmptyError(Exception):
+    pass
+
+
+class OutOfStockError(Exception):
+    """Raised when some cart lines cannot be served from the current stock"""
+
+    def __init__(self, lines):
+        self.lines = lines
+        super().__init__('Some items are out of stock')
+
+
+class _BatchShort(Exception):
+    pass
+
+
+def _decrement_stock(cart, demand):
+    """Conditionally take {(product_id, size): quantity} out of stock.
+
+    Each batch is a single UPDATE that only touches rows holding enough stock,
+    so concurrent checkouts can never drive a size below zero. Stock held by
+    other carts' active reservations is not available. A batch that
+    cannot be fully served is rolled back to its savepoint and re-read to
+    find the short lines. Returns {(product_id, size): available} for them.
+    """
+    keys = list(demand)
+    short = {}
+    for start in range(0, len(keys), STOCK_UPDATE_BATCH_SIZE):
+        batch = keys[start:start + STOCK_UPDATE_BATCH_SIZE]
+        rows = Q()
+        quantities = []
+        for product_id, size in batch:
+            rows |= Q(product_id=product_id, size=size)
+            quantities.append(When(product_id=product_id, size=size, then=Value(demand[product_id, size])))
+        quantity = Case(*quantities, default=Value(0))
+        held = StockReservation.held_by_others(cart)
+        
+        try:
+            with transaction.atomic():
+                updated = ProductSize.objects.filter(
+                    rows, is_available=True, stock_quantity__gte=quantity + held
+                ).update(stock_quantity=F('stock_quantity') - quantity, updated_at=Now())
+                if updated != len(batch):
+                    raise _BatchShort
+        except _BatchShort:
+            stock = {
+                (product_id, size): available for product_id, size, available in
+                ProductSize.objects.filter(rows, is_available=True)
+                .annotate(available=F('stock_quantity') - held)
+                .values_list('product_id', 'size', 'available')
+            }
+            for key in batch:
+                if stock.get(key, 0) < demand[key]:
+                    short[key] = max(stock.get(key, 0), 0)
+    return short
+
+
+def place_order(cart, customer_name, phone_number, city, address):
+    """Turn a cart into an order in one transaction.
+
+    Stock is decremented, order items are bulk inserted and the cart is
+    cleared (releasing its stock holds) together; if any line is short nothing is written and
+    OutOfStockError lists the lines.
+    """
+    with transaction.atomic():
+        cart_items = list(cart.items.select_related('product'))
+        if not cart_items:
+            raise CartEmptyError('Cart is empty')
+        
+        demand = {}
+        for item in cart_items:
+            key = (item.product_id, item.size)
+            demand[key] = demand.get(key, 0) + item.quantity
+        
+        short = _decrement_stock(cart, demand)
+        if short:
+            raise OutOfStockError([
+                {
+                    'item_id': item.id,
+                    'product_id': item.product_id,
+                    'product_name': item.product.name,
+                    'size': item.size,
+                    'requested': item.quantity,
+                    'available': short[item.product_id, item.size],
+                }
+                for item in cart_items if (item.product_id, item.size) in short
+            ])
+        
+        order = Order.objects.create(
+            customer_name=customer_name,
+            phone_number=phone_number,
+            city=city,
+            address=address,
+            total_amount=sum(item.total_price for item in cart_items)
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product_id=item.product_id,
+                size=item.size,
+                color_id=item.color_id,
+                quantity=item.quantity,
+                price_per_unit=item.price_per_unit,
+                total_price=item.total_price
+            )
+            for item in cart_items
+        ])
+        
+        cart.clear()
+        product_ids = {product_id for product_id, size in demand}
+        Product.refresh_price_ranges(product_ids)
+        refresh_product_facets(product_ids)
+    return order
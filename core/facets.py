@@ -0,0 +1,161 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Color, Product, ProductFacet, ProductSize
+
+# (value, label, lower bound, upper bound) on Product.min_price, upper bound excluded
+PRICE_BANDS = [
+    ('0-50', 'Under 50 Dhs', Decimal('0'), Decimal('50')),
+    ('50-100', '50 - 100 Dhs', Decimal('50'), Decimal('100')),
+    ('100-150', '100 - 150 Dhs', Decimal('100'), Decimal('150')),
+    ('150-200', '150 - 200 Dhs', Decimal('150'), Decimal('200')),
+    ('200+', '200 Dhs and more', Decimal('200'), None),
+]
+FACETS = [facet for facet, label in ProductFacet.FACET_CHOICES]
+REBUILD_CHUNK_SIZE = 500
+
+
+def price_band(price):
+    for value, label, low, high in PRICE_BANDS:
+        if price >= low and (high is None or price < high):
+            return value
+    return PRICE_BANDS[0][0]
+
+
+def facet_values(product, sizes, colors):
+    """(facet, value) pairs of one product; sizes count only while in stock"""
+    values = {('gender', product.gender), ('price', price_band(product.min_price))}
+    values.update(
+        ('size', size.size) for size in sizes
+        if size.is_available and size.stock_quantity > 0
+    )
+    values.update(('color', color.name.strip().lower()) for color in colors if color.name.strip())
+    return values
+
+
+def refresh_product_facets(product_ids):
+    """Replace the facet rows of the given products with their current values"""
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), REBUILD_CHUNK_SIZE):
+        chunk = product_ids[start:start + REBUILD_CHUNK_SIZE]
+        products = Product.objects.filter(pk__in=chunk, is_active=True).only(
+            'id', 'category_id', 'gender', 'min_price'
+        )
+        sizes, colors = {}, {}
+        for size in ProductSize.objects.filter(product_id__in=chunk).only(
+            'product_id', 'size', 'stock_quantity', 'is_available'
+        ):
+            sizes.setdefault(size.product_id, []).append(size)
+        for color in Color.objects.filter(product_id__in=chunk).only('product_id', 'name'):
+            colors.setdefault(color.product_id, []).append(color)
+
+        rows = [
+            ProductFacet(product_id=product.id, category_id=product.category_id, facet=facet, value=value)
+            for product in products
+            for facet, value in facet_values(product, sizes.get(product.id, []), colors.get(product.id, []))
+        ]
+        with transaction.atomic():
+            ProductFacet.objects.filter(product_id__in=chunk).delete()
+            ProductFacet.objects.bulk_create(rows)
+
+
+def rebuild_facet_index():
+    """Recompute the facet rows of every product; returns the number of products"""
+    product_ids = list(Product.objects.order_by().values_list('pk', flat=True))
+    ProductFacet.objects.exclude(product_id__in=Product.objects.filter(is_active=True).values('pk')).delete()
+    refresh_product_facets(product_ids)
+    return len(product_ids)
+
+
+def parse_selection(query_dict):
+    """Selected facet values from request.GET, e.g. ?size=40&size=41&color=red"""
+    selection = {}
+    for facet in FACETS:
+        values = [value for value in query_dict.getlist(facet) if value]
+        if values:
+            selection[facet] = sorted(set(values))
+    return selection
+
+
+def _matching(category, selection, skip=None):
+    """Product ids of the category matching every selected facet except skip"""
+    matching = None
+    for facet, values in selection.items():
+        if facet == skip:
+            continue
+        ids = ProductFacet.objects.filter(category=category, facet=facet, value__in=values).values('product_id')
+        matching = ids if matching is None else ids.filter(product_id__in=matching)
+    return matching
+
+
+def filter_products(queryset, category, selection):
+    """Restrict a product queryset of the category to the selection"""
+    matching = _matching(category, selection)
+    if matching is None:
+        return queryset
+    return queryset.filter(pk__in=matching)
+
+
+def _labelled(facet, value):
+    if facet == 'gender':
+        return dict(Product.GENDER_CHOICES).get(value, value)
+    if facet == 'price':
+        return next((label for band, label, low, high in PRICE_BANDS if band == value), value)
+    if facet == 'color':
+        return value.title()
+    return value
+
+
+def facet_counts(category, selection):
+    """Options of every facet with the number of products each would show.
+
+    A facet's counts apply the selection of the other facets only, so picking
+    an option never hides its alternatives. Unselected facets share one
+    GROUP BY query, each selected facet needs one more.
+    """
+    counts = {facet: {} for facet in FACETS}
+    base = ProductFacet.objects.filter(category=category)
+    
+    groups = [(None, [facet for facet in FACETS if facet not in selection])]
+    groups += [(facet, [facet]) for facet in FACETS if facet in selection]
+    for skip, facets in groups:
+        if not facets:
+            continue
+        rows = base.filter(facet__in=facets)
+        matching = _matching(category, selection, skip=skip)
+        if matching is not None:
+            rows = rows.filter(product_id__in=matching)
+        for facet, value, total in rows.values_list('facet', 'value').annotate(total=Count('product_id')).order_by():
+            counts[facet][value] = total
+    
+    order = {
+        'price': [band for band, *rest in PRICE_BANDS],
+        'gender': [value for value, label in Product.GENDER_CHOICES],
+    }
+    result = []
+    for facet, label in ProductFacet.FACET_CHOICES:
+        values = counts[facet]
+        for value in selection.get(facet, []):
+            values.setdefault(value, 0)
+        if facet in order:
+            ordered = [value for value in order[facet] if value in values]
+        elif facet == 'size':
+            ordered = sorted(values, key=lambda value: (len(value), value))
+        else:
+            ordered = sorted(values)
+        result.append({
+            'name': facet,
+            'label': label,
+            'options': [
+                {
+                    'value': value,
+                    'label': _labelled(facet, value),
+                    'count': values[value],
+                    'selected': value in selection.get(facet, []),
+                }
+                for value in ordered
+            ],
+        })
+    return result
@@ -0,0 +1,103 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import aprefetch_related_objects, prefetch_related_objects
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+CARD_TEMPLATE = 'core/_product_card_body.html'
+# Bump when the card template or the API card data changes shape
+CARD_FORMAT = 1
+# Cards past this position share the last demo video
+DEFAULT_VIDEO_SLOTS = 3
+
+
+def card_cache():
+    return caches[settings.PRODUCT_CARD_CACHE]
+
+
+def video_slot(product, index):
+    """The only part of a card that depends on its position: which demo video a product without one gets"""
+    if product.video_url or index is None:
+        return DEFAULT_VIDEO_SLOTS
+    return min(index, DEFAULT_VIDEO_SLOTS)
+
+
+def _card_key(product, kind):
+    return f'product-card:{CARD_FORMAT}:{product.pk}:{product.version}:{kind}'
+
+
+def _card_keys(products, kind):
+    return [_card_key(product, kind(product) if callable(kind) else kind) for product in products]
+
+
+def _build_missing(products, keys, found, build):
+    built = {}
+    for product, key in zip(products, keys):
+        if key not in found and key not in built:
+            built[key] = build(product)
+    return built
+
+
+def cached_per_product(products, kind, build):
+    """Return one value per product, read from the card cache where possible.
+
+    kind names the fragment; build(product) makes a missing one and may read
+    product_sizes and colors, which are prefetched for the misses only. Keys
+    include Product.version, so changes never need an explicit delete.
+    """
+    cache = card_cache()
+    keys = _card_keys(products, kind)
+    found = cache.get_many(keys)
+    missing = [product for product, key in zip(products, keys) if key not in found]
+    if missing:
+        prefetch_related_objects(missing, 'product_sizes', 'colors')
+        built = _build_missing(products, keys, found, build)
+        cache.set_many(built, settings.PRODUCT_CARD_CACHE_TIMEOUT)
+        found.update(built)
+    return [found[key] for key in keys]
+
+
+async def acached_per_product(products, kind, build):
+    """cached_per_product() for async views"""
+    cache = card_cache()
+    keys = _card_keys(products, kind)
+    found = await cache.aget_many(keys)
+    missing = [product for product, key in zip(products, keys) if key not in found]
+    if missing:
+        await aprefetch_related_objects(missing, 'product_sizes', 'colors')
+        built = _build_missing(products, keys, found, build)
+        await cache.aset_many(built, settings.PRODUCT_CARD_CACHE_TIMEOUT)
+        found.update(built)
+    return [found[key] for key in keys]
+
+
+def _card_renderer(products, first_index):
+    slots = {
+        product.pk: video_slot(product, None if first_index is None else first_index + i)
+        for i, product in enumerate(products)
+    }
+    kind = lambda product: f'html:{slots[product.pk]}'
+    build = lambda product: render_to_string(CARD_TEMPLATE, {'product': product, 'video_slot': slots[product.pk]})
+    return kind, build
+
+
+def _attach_cards(products, cards):
+    for product, html in zip(products, cards):
+        product.card_html = mark_safe(html)
+    return products
+
+
+def render_product_cards(products, first_index=None):
+    """Attach the cached card markup to each product as product.card_html.
+
+    first_index is the page position of the first product, None for cards
+    appended by infinite scroll.
+    """
+    products = list(products)
+    return _attach_cards(products, cached_per_product(products, *_card_renderer(products, first_index)))
+
+
+async def arender_product_cards(products, first_index=None):
+    """render_product_cards() for async views"""
+    products = list(products)
+    return _attach_cards(products, await acached_per_product(products, *_card_renderer(products, first_index)))
@@ -0,0 +1,245 @@
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connection
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+VARIANT_ROOT = 'variants'
+CONTENT_TYPES = {'avif': 'image/avif', 'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+EXTENSIONS = {'avif': 'avif', 'webp': 'webp', 'jpeg': 'jpg'}
+# Width of the <img src> fallback for browsers without srcset support
+FALLBACK_WIDTH = 640
+
+
+def variant_formats():
+    """Configured output formats this Pillow build can encode, best compression first"""
+    return [fmt for fmt in settings.IMAGE_VARIANT_FORMATS if fmt == 'jpeg' or features.check(fmt)]
+
+
+def variant_widths(width, configured):
+    """Configured widths below the original width, plus the original when it is smaller than the largest"""
+    widths = [w for w in configured if w < width]
+    if width < max(configured):
+        widths.append(width)
+    return sorted(widths) or [width]
+
+
+def variant_name(source, width, fmt):
+    stem = os.path.splitext(source)[0]
+    return f'{VARIANT_ROOT}/{stem}/{width}w.{EXTENSIONS[fmt]}'
+
+
+def render_variants(data, widths, formats, quality):
+    """Resize one image into every (width, format); runs in a worker process.
+
+    Takes and returns bytes only, so the worker needs neither Django nor the
+    storage backend. Returns {'width', 'height', 'variants': [(fmt, width, bytes)]}.
+    """
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        image.load()
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    width, height = image.size
+    variants = []
+    for target in variant_widths(width, widths):
+        resized = image if target == width else image.resize(
+            (target, max(1, round(height * target / width))), Image.LANCZOS
+        )
+        for fmt in formats:
+            out = io.BytesIO()
+            if fmt == 'jpeg':
+                frame = resized
+                if has_alpha:
+                    frame = Image.new('RGB', resized.size, (255, 255, 255))
+                    frame.paste(resized, mask=resized.getchannel('A'))
+                frame.save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+            elif fmt == 'webp':
+                resized.save(out, 'WEBP', quality=quality, method=4)
+            else:
+                resized.save(out, 'AVIF', quality=quality)
+            variants.append((fmt, target, out.getvalue()))
+    return {'width': width, 'height': height, 'variants': variants}
+
+
+def _read_source(name):
+    with default_storage.open(name, 'rb') as f:
+        return f.read()
+
+
+def _render_args(data):
+    return data, list(settings.IMAGE_VARIANT_WIDTHS), variant_formats(), settings.IMAGE_VARIANT_QUALITY
+
+
+def delete_variants(manifest):
+    for entries in (manifest or {}).get('variants', {}).values():
+        for width, name in entries:
+            default_storage.delete(name)
+
+
+def store_variants(model_label, pk, source, result):
+    """Write rendered variants to storage and record the manifest on the row.
+
+    The row is only updated while it still points at source, so a variant
+    run that finishes after the image was replaced again changes nothing.
+    Variants of the image it replaced are deleted. Returns the manifest,
+    or None when the image changed meanwhile.
+    """
+    model = apps.get_model(model_label)
+    previous = model.objects.filter(pk=pk).values_list('image_variants', flat=True).first()
+    variants = {}
+    for fmt, width, content in result['variants']:
+        name = variant_name(source, width, fmt)
+        default_storage.delete(name)
+        variants.setdefault(fmt, []).append([width, default_storage.save(name, ContentFile(content))])
+    manifest = {
+        'source': source,
+        'width': result['width'],
+        'height': result['height'],
+        'variants': variants,
+    }
+    if not model.objects.filter(pk=pk, image=source).update(image_variants=manifest):
+        delete_variants(manifest)
+        return None
+    if previous and previous.get('source') != source:
+        delete_variants(previous)
+    return manifest
+
+
+def generate_variants(instance):
+    """Render and store the variants of instance.image in this process"""
+    source = instance.image.name
+    result = render_variants(*_render_args(_read_source(source)))
+    return store_variants(instance._meta.label, instance.pk, source, result)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor(max_workers=None):
+    """Shared process pool; workers are spawned, not forked, so server threads are not copied"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=max_workers or settings.IMAGE_VARIANT_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        _executor = None
+
+
+def _stored(model_label, pk, source):
+    def callback(future):
+        close_old_connections()
+        try:
+            store_variants(model_label, pk, source, future.result())
+        except BrokenProcessPool:
+            _reset_executor()
+            logger.exception('Image variant worker died for %s %s', model_label, pk)
+        except Exception:
+            logger.exception('Could not create image variants for %s %s', model_label, pk)
+        finally:
+            connection.close()
+    return callback
+
+
+def schedule_variants(instance):
+    """Queue variant generation for instance.image without waiting for it.
+
+    Decoding and encoding happen in the process pool; only reading the
+    original and writing the results happen here and in the pool's
+    result thread. With IMAGE_VARIANT_WORKERS = 0 it runs inline.
+    """
+    source = instance.image.name
+    if not settings.IMAGE_VARIANT_WORKERS:
+        generate_variants(instance)
+        return
+    try:
+        future = executor().submit(render_variants, *_render_args(_read_source(source)))
+    except BrokenProcessPool:
+        _reset_executor()
+        future = executor().submit(render_variants, *_render_args(_read_source(source)))
+    future.add_done_callback(_stored(instance._meta.label, instance.pk, source))
+
+
+def backfill(queryset, workers=None, force=False):
+    """Generate missing (or, with force, all) variants of a queryset in parallel.
+
+    At most two images per worker are in flight, so originals are not all
+    held in memory at once. Yields (instance, manifest or exception) as
+    each image finishes.
+    """
+    pool = executor(workers)
+    in_flight = 2 * (workers or settings.IMAGE_VARIANT_WORKERS or 1)
+    pending = {}
+
+    def finished(futures):
+        for future in futures:
+            instance, source = pending.pop(future)
+            try:
+                yield instance, store_variants(instance._meta.label, instance.pk, source, future.result())
+            except Exception as exc:
+                yield instance, exc
+
+    for instance in queryset.exclude(image='').exclude(image__isnull=True).iterator():
+        if not force and (instance.image_variants or {}).get('source') == instance.image.name:
+            continue
+        try:
+            future = pool.submit(render_variants, *_render_args(_read_source(instance.image.name)))
+        except Exception as exc:
+            yield instance, exc
+            continue
+        pending[future] = (instance, instance.image.name)
+        if len(pending) >= in_flight:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            yield from finished(done)
+    for future in as_completed(list(pending)):
+        yield from finished([future])
+
+
+def image_sources(image, manifest):
+    """<picture> data for an image field: fallback src, size and one srcset per format.
+
+    Falls back to the original file while its variants are not generated yet.
+    """
+    if not image:
+        return None
+    manifest = manifest or {}
+    if manifest.get('source') != image.name or not manifest.get('variants'):
+        return {'src': image.url, 'width': None, 'height': None, 'sources': []}
+
+    variants = manifest['variants']
+    sources = [
+        {
+            'type': CONTENT_TYPES[fmt],
+            'srcset': ', '.join(f'{default_storage.url(name)} {width}w' for width, name in variants[fmt]),
+        }
+        for fmt in CONTENT_TYPES if fmt in variants
+    ]
+    fallback = variants.get('jpeg') or next(iter(variants.values()))
+    width, name = min(fallback, key=lambda entry: abs(entry[0] - FALLBACK_WIDTH))
+    return {
+        'src': default_storage.url(name),
+        'width': manifest['width'],
+        'height': manifest['height'],
+        'sources': sources,
+    }
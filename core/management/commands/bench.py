@@ -0,0 +1,377 @@
+import http.client
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.cookies import SimpleCookie
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from core import sample_data
+from core.models import Category, Color, ProductSize
+
+SETTINGS_MODULE = 'bench_settings'
+QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+CUSTOMER = {
+    'customer_name': 'Bench Customer', 'customer_phone': '0600000000',
+    'customer_city': 'Casablanca', 'customer_address': '1 Benchmark Street',
+}
+
+
+def add_to_cart_request(rng, catalog):
+    product_id, size, color_id = rng.choice(catalog['sizes'])
+    return 'POST', '/api/cart/add/', {'product_id': product_id, 'size': size, 'color_id': color_id}
+
+
+# endpoint: (request builder, request sent untimed before each timed one)
+ENDPOINTS = {
+    'home': (lambda rng, catalog: ('GET', '/', None), None),
+    'category_page': (lambda rng, catalog: ('GET', f"/category/{rng.choice(catalog['categories'])}/", None), None),
+    'category_api': (
+        lambda rng, catalog: ('GET', f"/api/category/{rng.choice(catalog['categories'])}/products/", None), None
+    ),
+    'product_sizes': (
+        lambda rng, catalog: ('GET', f"/api/product-sizes/?product_id={rng.choice(catalog['sizes'])[0]}", None), None
+    ),
+    'search': (lambda rng, catalog: ('GET', f"/api/search/?q={rng.choice(sample_data.PRODUCT_WORDS)}", None), None),
+    'cart_add': (add_to_cart_request, None),
+    'cart_view': (lambda rng, catalog: ('GET', '/cart/', None), None),
+    'checkout_view': (lambda rng, catalog: ('GET', '/checkout/', None), None),
+    'create_order': (lambda rng, catalog: ('POST', '/api/create-order/', CUSTOMER), add_to_cart_request),
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+@contextmanager
+def database_at(path):
+    """Point this process's SQLite aliases at another database file for the duration"""
+    names = {}
+    for alias in connections:
+        database = connections.settings[alias]
+        if database['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError(f'bench needs SQLite databases, {alias!r} is {database["ENGINE"]}')
+        connections[alias].close()
+        names[alias] = database['NAME']
+        uri = database.get('OPTIONS', {}).get('uri')
+        database['NAME'] = f'file:{path}?mode=ro' if uri else str(path)
+    try:
+        yield
+    finally:
+        for alias, name in names.items():
+            connections[alias].close()
+            connections.settings[alias]['NAME'] = name
+
+
+def process_tree(pid):
+    """pid and the pids of its children (gunicorn workers); Linux only, else just pid"""
+    pids = [pid]
+    for stat in Path('/proc').glob('[0-9]*/stat'):
+        try:
+            fields = stat.read_text().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(fields[1]) == pid:
+            pids.append(int(stat.parent.name))
+    return pids
+
+
+def reset_peak_rss(pids):
+    for pid in pids:
+        try:
+            Path(f'/proc/{pid}/clear_refs').write_text('5')
+        except OSError:
+            pass
+
+
+def peak_rss_mb(pids):
+    """Largest peak resident set size among the server processes, None where /proc is missing"""
+    peaks = []
+    for pid in pids:
+        try:
+            status = Path(f'/proc/{pid}/status').read_text()
+        except OSError:
+            continue
+        match = re.search(r'^VmHWM:\s+(\d+) kB', status, re.MULTILINE)
+        if match:
+            peaks.append(int(match[1]) / 1024)
+    return round(max(peaks), 1) if peaks else None
+
+
+class Client:
+    """One visitor: a keep-alive connection with its own session cookie"""
+
+    def __init__(self, port):
+        self.port = port
+        self.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        self.cookies = SimpleCookie()
+
+    def request(self, method, path, data=None):
+        """Send a request; returns (ok, seconds, queries run by the server)"""
+        headers = {}
+        body = None
+        if data is not None:
+            body = json.dumps(data)
+            headers['Content-Type'] = 'application/json'
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{key}={morsel.value}' for key, morsel in self.cookies.items())
+        started = time.perf_counter()
+        try:
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+            content = response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            return False, time.perf_counter() - started, None
+        elapsed = time.perf_counter() - started
+
+        for cookie in response.headers.get_all('Set-Cookie') or []:
+            self.cookies.load(cookie)
+        match = QUERIES_RE.search(response.getheader('Server-Timing') or '')
+        ok = response.status < 400
+        if ok and response.getheader('Content-Type', '').startswith('application/json'):
+            ok = json.loads(content).get('success', True)
+        return ok, elapsed, int(match[1]) if match else None
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-test the storefront pages and cart/order API on a seeded copy of the database, '
+        'served by gunicorn with the current settings; writes JSON results and can compare them with an earlier run'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoints', nargs='+', choices=list(ENDPOINTS), default=list(ENDPOINTS))
+        parser.add_argument('--categories', type=int, default=12, help='Categories in the seeded database')
+        parser.add_argument('--products', type=int, default=2000, help='Products in the seeded database')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed of the data and the clients')
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent client threads')
+        parser.add_argument('--seconds', type=float, default=10, help='Measured duration per endpoint')
+        parser.add_argument('--warmup', type=float, default=1, help='Unmeasured seconds before each endpoint run')
+        parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+        parser.add_argument('--server-threads', type=int, default=8, help='Threads per gunicorn worker')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--compare', help='Results JSON of an earlier run; exit with an error on regressions')
+        parser.add_argument('--tolerance', type=float, default=0.15,
+                            help='Allowed relative slowdown of p95 latency and throughput when comparing')
+
+    def handle(self, *args, **options):
+        if shutil.which('gunicorn') is None:
+            raise CommandError('gunicorn is not installed')
+        if not settings.REQUEST_METRICS:
+            raise CommandError('bench reads query counts from Server-Timing, enable REQUEST_METRICS')
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+
+        workdir = Path(tempfile.mkdtemp(prefix='bench-'))
+        try:
+            database = workdir / 'bench.sqlite3'
+            catalog = self.seed(database, options)
+            self.write_settings(workdir, database)
+            endpoints = self.run_server(workdir, catalog, options)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        results = {
+            'settings': {
+                key: options[key]
+                for key in ('categories', 'products', 'seed', 'threads', 'seconds', 'workers', 'server_threads')
+            },
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+            },
+            'endpoints': endpoints,
+        }
+        self.report(endpoints)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+        if baseline is not None:
+            self.compare(baseline, results, options['tolerance'])
+
+    def seed(self, database, options):
+        """Migrate and fill a new database; returns the ids the clients pick from"""
+        self.stdout.write(f"Seeding {options['products']} products in {options['categories']} categories...")
+        rng = random.Random(options['seed'])
+        with database_at(database):
+            call_command('migrate', verbosity=0, interactive=False)
+            sample_data.generate(options['categories'], options['products'], seed=options['seed'])
+
+            sizes = list(
+                ProductSize.objects.filter(stock_quantity__gte=10, is_available=True, product__is_active=True)
+                .values_list('product_id', 'size')[:20000]
+            )
+            sizes = rng.sample(sizes, min(len(sizes), 2000))
+            colors = dict(
+                Color.objects.filter(product_id__in={product_id for product_id, size in sizes})
+                .values_list('product_id', 'pk')
+            )
+            categories = list(Category.objects.filter(product_count__gt=0).values_list('pk', flat=True))
+        if not sizes:
+            raise CommandError('The seeded catalog has no sizes in stock, use more --products')
+        return {
+            'categories': categories,
+            'sizes': [(product_id, size, colors.get(product_id)) for product_id, size in sizes],
+        }
+
+    def write_settings(self, workdir, database):
+        replica = f'file:{database}?mode=ro'
+        (workdir / f'{SETTINGS_MODULE}.py').write_text(
+            f'from {settings.SETTINGS_MODULE} import *\n'
+            f'DATABASES["default"]["NAME"] = {str(database)!r}\n'
+            f'if "replica" in DATABASES:\n'
+            f'    DATABASES["replica"]["NAME"] = {replica!r}\n'
+        )
+
+    def run_server(self, workdir, catalog, options):
+        port = free_port()
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE=SETTINGS_MODULE,
+            PYTHONPATH=os.pathsep.join([str(workdir), os.getcwd(), *sys.path]),
+        )
+        process = subprocess.Popen([
+            'gunicorn', 'cms.wsgi:application', '--bind', f'127.0.0.1:{port}',
+            '--worker-class', 'gthread', '--workers', str(options['workers']),
+            '--threads', str(options['server_threads']), '--log-level', 'warning',
+        ], env=env)
+        try:
+            self.wait_until_ready(port)
+            pids = process_tree(process.pid)
+            return {
+                endpoint: self.run_endpoint(endpoint, port, pids, catalog, options)
+                for endpoint in options['endpoints']
+            }
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    def wait_until_ready(self, port, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            ok, elapsed, queries = Client(port).request('GET', '/')
+            if ok:
+                return
+            time.sleep(0.2)
+        raise CommandError(f'The server on port {port} did not start')
+
+    def run_endpoint(self, endpoint, port, pids, catalog, options):
+        self.stdout.write(f"{endpoint}: {options['threads']} threads for {options['seconds']}s")
+        build, setup = ENDPOINTS[endpoint]
+        latencies, queries, errors = [], [], [0]
+        lock = threading.Lock()
+        measure_from = time.monotonic() + options['warmup']
+        deadline = measure_from + options['seconds']
+        reset_peak_rss(pids)
+
+        def client(n):
+            rng = random.Random(f"{options['seed']}-{endpoint}-{n}")
+            visitor = Client(port)
+            # Every visitor has a session and something in the cart, as on a real store
+            visitor.request(*add_to_cart_request(rng, catalog))
+            mine, my_queries, my_errors = [], [], 0
+            while time.monotonic() < deadline:
+                if setup:
+                    visitor.request(*setup(rng, catalog))
+                measured = time.monotonic() >= measure_from
+                ok, elapsed, count = visitor.request(*build(rng, catalog))
+                if not measured:
+                    continue
+                if not ok:
+                    my_errors += 1
+                    continue
+                mine.append(elapsed)
+                if count is not None:
+                    my_queries.append(count)
+            visitor.connection.close()
+            with lock:
+                latencies.extend(mine)
+                queries.extend(my_queries)
+                errors[0] += my_errors
+
+        threads = [threading.Thread(target=client, args=(n,)) for n in range(options['threads'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return {
+            'requests': len(latencies),
+            'errors': errors[0],
+            'rps': round(len(latencies) / options['seconds'], 1),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+            'peak_rss_mb': peak_rss_mb(pids),
+        }
+
+    def report(self, endpoints):
+        self.stdout.write(
+            f"\n{'endpoint':<16}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+            f"{'queries':>9}{'RSS MB':>9}{'errors':>8}"
+        )
+        for endpoint, result in endpoints.items():
+            self.stdout.write(
+                f"{endpoint:<16}{result['rps']:>8.0f}{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}"
+                f"{result['p99_ms']:>9.1f}{result['queries_per_request'] or 0:>9.1f}"
+                f"{result['peak_rss_mb'] or 0:>9.0f}{result['errors']:>8}"
+            )
+
+    def compare(self, baseline, results, tolerance):
+        """Print the change per endpoint and fail on slower p95, lower throughput, more queries or new errors"""
+        regressions = []
+        if baseline.get('settings') != results['settings']:
+            self.stdout.write(self.style.WARNING('The baseline ran with different settings, numbers may not be comparable'))
+        self.stdout.write(f"\n{'endpoint':<16}{'req/s':>10}{'p95':>10}{'queries':>10}")
+        for endpoint, result in results['endpoints'].items():
+            before = baseline.get('endpoints', {}).get(endpoint)
+            if not before:
+                continue
+            rps = result['rps'] / before['rps'] - 1 if before['rps'] else 0
+            p95 = result['p95_ms'] / before['p95_ms'] - 1 if before['p95_ms'] else 0
+            queries = (result['queries_per_request'] or 0) - (before['queries_per_request'] or 0)
+            self.stdout.write(f'{endpoint:<16}{rps:>+10.0%}{p95:>+10.0%}{queries:>+10.1f}')
+            if rps < -tolerance:
+                regressions.append(f'{endpoint}: throughput {rps:+.0%}')
+            if p95 > tolerance:
+                regressions.append(f'{endpoint}: p95 latency {p95:+.0%}')
+            if queries >= 0.5:
+                regressions.append(f'{endpoint}: {queries:+.1f} queries per request')
+            if result['errors'] and not before['errors']:
+                regressions.append(f"{endpoint}: {result['errors']} errors")
+        if regressions:
+            raise CommandError('Regressions against the baseline:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core.catalog import write_snapshot
+
+class Command(BaseCommand):
+    help = 'Write a versioned JSON/JSONL catalog snapshot (plus gzip/brotli copies) for the catalog feed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--if-changed',
+            action='store_true',
+            help='Keep the current snapshot when the catalog content has not changed',
+        )
+        parser.add_argument(
+            '--keep',
+            type=int,
+            default=settings.CATALOG_SNAPSHOTS_TO_KEEP,
+            help='Number of snapshot versions to keep on disk',
+        )
+
+    def handle(self, *args, **options):
+        pointer = write_snapshot(if_changed=options['if_changed'], keep=options['keep'])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Catalog snapshot {pointer['version']}: {pointer['products']} products, "
+                f"{pointer['categories']} categories ({settings.CATALOG_FEED_URL}{pointer['json']})"
+            )
+        )
@@ -0,0 +1,47 @@
+import sys
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from core import order_export
+from core.catalog_io import FORMATS, guess_format
+from core.models import Order
+from core.streaming import chunked
+
+class Command(BaseCommand):
+    help = 'Stream orders, one row per order item with its product, size and color, as CSV or JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to write, or - for stdout')
+        parser.add_argument('--format', choices=FORMATS, help='Default: from the file extension, else csv')
+        parser.add_argument('--status', action='append', choices=[value for value, label in Order.STATUS_CHOICES],
+                            help='Only orders with this status (repeatable)')
+        parser.add_argument('--since', type=self.parse_date, help='Only orders created on or after YYYY-MM-DD')
+        parser.add_argument('--until', type=self.parse_date, help='Only orders created before YYYY-MM-DD')
+
+    @staticmethod
+    def parse_date(value):
+        return timezone.make_aware(datetime.combine(datetime.strptime(value, '%Y-%m-%d').date(), time.min))
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or guess_format(path)
+        orders = Order.objects.all()
+        if options['status']:
+            orders = orders.filter(status__in=options['status'])
+        if options['since']:
+            orders = orders.filter(created_at__gte=options['since'])
+        if options['until']:
+            orders = orders.filter(created_at__lt=options['until'])
+
+        chunks = chunked(order_export.export_lines(orders, fmt))
+        if path == '-':
+            for chunk in chunks:
+                sys.stdout.write(chunk)
+            return
+        try:
+            with open(path, 'w', encoding='utf-8', newline='') as output:
+                output.writelines(chunks)
+        except OSError as exc:
+            raise CommandError(exc)
+        self.stdout.write(self.style.SUCCESS(f'Exported orders to {path}'))
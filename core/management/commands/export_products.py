@@ -0,0 +1,36 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from core import catalog_io
+from core.models import Product
+from core.streaming import chunked
+
+class Command(BaseCommand):
+    help = 'Write products, one row per size, as CSV or JSONL that import_products can read back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to write, or - for stdout')
+        parser.add_argument('--format', choices=catalog_io.FORMATS, help='Default: from the file extension, else csv')
+        parser.add_argument('--category', action='append', help='Only products of this category name (repeatable)')
+        parser.add_argument('--active', action='store_true', help='Only active products')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or catalog_io.guess_format(path)
+        products = Product.objects.all()
+        if options['category']:
+            products = products.filter(category__name__in=options['category'])
+        if options['active']:
+            products = products.filter(is_active=True)
+
+        chunks = chunked(catalog_io.export_lines(products, fmt))
+        if path == '-':
+            for chunk in chunks:
+                sys.stdout.write(chunk)
+            return
+        try:
+            with open(path, 'w', encoding='utf-8', newline='') as output:
+                output.writelines(chunks)
+        except OSError as exc:
+            raise CommandError(exc)
+        self.stdout.write(self.style.SUCCESS(f'Exported products to {path}'))
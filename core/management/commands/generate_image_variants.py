@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from core import images
+from core.models import Category, Product
+
+class Command(BaseCommand):
+    help = 'Create resized WebP/AVIF/JPEG variants for category and product images that lack them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=['category', 'product'], help='Only process one model')
+        parser.add_argument('--workers', type=int, default=None, help='Worker processes (default IMAGE_VARIANT_WORKERS)')
+        parser.add_argument('--force', action='store_true', help='Regenerate variants that are already up to date')
+
+    def handle(self, *args, **options):
+        models = {'category': Category, 'product': Product}
+        if options['model']:
+            models = {options['model']: models[options['model']]}
+
+        for label, model in models.items():
+            done = failed = 0
+            for instance, result in images.backfill(model.objects.order_by('pk'), options['workers'], options['force']):
+                if isinstance(result, Exception):
+                    failed += 1
+                    self.stderr.write(f'{label} {instance.pk} ({instance.image.name}): {result}')
+                else:
+                    done += 1
+
+            self.stdout.write(self.style.SUCCESS(f'{label}: {done} images processed, {failed} failed'))
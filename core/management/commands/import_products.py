@@ -0,0 +1,42 @@
+import csv
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from core import catalog_io
+
+class Command(BaseCommand):
+    help = (
+        'Upsert products, sizes and colors from a CSV or JSONL file (the format of export_products), '
+        'streamed in batches; rows are matched on sku'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or - for stdin')
+        parser.add_argument('--format', choices=catalog_io.FORMATS, help='Default: from the file extension, else csv')
+        parser.add_argument('--batch-size', type=int, default=catalog_io.BATCH_SIZE, help='Rows per transaction')
+        parser.add_argument('--max-errors', type=int, default=catalog_io.MAX_ERRORS, help='Row errors to list')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or catalog_io.guess_format(path)
+        try:
+            if path == '-':
+                sys.stdin.reconfigure(encoding='utf-8-sig', newline='')
+                result = self.run_import(sys.stdin, fmt, options)
+            else:
+                with open(path, encoding='utf-8-sig', newline='') as stream:
+                    result = self.run_import(stream, fmt, options)
+        except (OSError, catalog_io.CatalogFileError, UnicodeDecodeError, csv.Error) as exc:
+            raise CommandError(exc)
+
+        for line, sku, message in result.errors:
+            self.stderr.write(f'Line {line} ({sku or "no sku"}): {message}')
+        if result.error_count > len(result.errors):
+            self.stderr.write(f'... and {result.error_count - len(result.errors)} more errors')
+        style = self.style.WARNING if result.error_count else self.style.SUCCESS
+        self.stdout.write(style(result.summary()))
+
+    def run_import(self, stream, fmt, options):
+        return catalog_io.import_file(
+            stream, fmt, batch_size=options['batch_size'], max_errors=options['max_errors']
+        )
@@ -1,11 +1,28 @@
-from django.core.management.base import BaseCommand
+import time
+
+from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
+from core import sample_data
 from core.models import Category, Product, ProductSize, Color
 
 class Command(BaseCommand):
-    help = 'Populate database with sample products, categories, sizes, and colors'
+    help = (
+        'Populate database with sample products, categories, sizes, and colors. '
+        'With --products/--carts/--orders, bulk-generate a catalog of that size instead'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=12, help='Categories to generate')
+        parser.add_argument('--products', type=int, help='Products to generate (each with 3-6 sizes and 1-3 colors)')
+        parser.add_argument('--carts', type=int, default=0, help='Open carts to generate')
+        parser.add_argument('--orders', type=int, default=0, help='Historical orders to generate')
+        parser.add_argument('--days', type=int, default=365, help='Period the products and orders are spread over')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed; the same seed gives the same data')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk insert and transaction')
 
     def handle(self, *args, **options):
+        if options['products'] is not None or options['carts'] or options['orders']:
+            return self.generate(options)
         with transaction.atomic():
             self.stdout.write('Creating sample data...')
             
@@ -154,4 +171,26 @@ class Command(BaseCommand):
             
             self.stdout.write(
                 self.style.SUCCESS('Successfully populated database with sample data!')
-            ) 
\ No newline at end of file
+            ) 
+
+    def generate(self, options):
+        if not options['products'] or not options['categories']:
+            raise CommandError('Generating carts or orders needs --products and --categories')
+        if Category.objects.exists():
+            raise CommandError('The catalog is not empty; generate into a new database (or run flush first)')
+
+        started = time.monotonic()
+        sample_data.generate(
+            categories=options['categories'],
+            products=options['products'],
+            carts=options['carts'],
+            orders=options['orders'],
+            seed=options['seed'],
+            days=options['days'],
+            batch_size=options['batch_size'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {options['categories']} categories, {options['products']} products, "
+            f"{options['carts']} carts and {options['orders']} orders in {time.monotonic() - started:.0f}s"
+        ))
@@ -0,0 +1,57 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from core.models import Cart
+
+class Command(BaseCommand):
+    help = 'Delete expired sessions and idle carts (with their items and reservations) in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='Idle age of a cart in days (default ABANDONED_CART_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows deleted per transaction')
+        parser.add_argument('--pause', type=float, default=0,
+                            help='Seconds to sleep between batches, to leave room for live writes')
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be deleted')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        days = options['days'] if options['days'] is not None else settings.ABANDONED_CART_DAYS
+        targets = [
+            ('sessions', Session.objects.filter(expire_date__lt=now)),
+            # A live stock hold means a visitor is still shopping, however old the cart
+            ('carts', Cart.objects.filter(updated_at__lt=now - timedelta(days=days))
+                      .exclude(reservations__expires_at__gt=now)),
+        ]
+
+        for label, queryset in targets:
+            if options['dry_run']:
+                self.stdout.write(f'Would delete {queryset.count()} {label}')
+                continue
+            started = time.monotonic()
+            deleted, batches = self.purge(queryset, options['batch_size'], options['pause'])
+            elapsed = time.monotonic() - started
+            rate = deleted / elapsed if elapsed else 0
+            self.stdout.write(self.style.SUCCESS(
+                f'Deleted {deleted} {label} in {batches} batches, {elapsed:.1f}s ({rate:.0f} rows/s)'
+            ))
+
+    def purge(self, queryset, batch_size, pause):
+        """Delete queryset rows batch by batch, each batch in its own transaction"""
+        deleted = batches = 0
+        while True:
+            with transaction.atomic():
+                pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+                if not pks:
+                    break
+                queryset.model.objects.filter(pk__in=pks).delete()
+            deleted += len(pks)
+            batches += 1
+            if pause:
+                time.sleep(pause)
+        return deleted, batches
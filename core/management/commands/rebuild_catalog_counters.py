@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core.models import Category, Product
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized catalog counters (active products per category, product price ranges and stock)'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            categories = Category.rebuild_product_counts()
+            products = Product.refresh_price_ranges()
+        
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Rebuilt product counts for {categories} categories and price ranges for {products} products'
+            )
+        )
@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from core.facets import rebuild_facet_index
+
+class Command(BaseCommand):
+    help = 'Rebuild the category page facet index (gender, in-stock size, color, price band)'
+
+    def handle(self, *args, **options):
+        products = rebuild_facet_index()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt facets of {products} products'))
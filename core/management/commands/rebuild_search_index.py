@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from core import search
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text product search index (SQLite FTS5)'
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError('The search index requires the SQLite database backend')
+        
+        with transaction.atomic():
+            indexed = search.rebuild_index()
+        
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} products'))
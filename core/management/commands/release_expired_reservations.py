@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from core.models import StockReservation
+
+class Command(BaseCommand):
+    help = 'Delete expired stock reservations in small batches (safe to run every minute)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Reservations deleted per transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        now = timezone.now()
+        released = 0
+        
+        while True:
+            with transaction.atomic():
+                expired = list(
+                    StockReservation.objects.filter(expires_at__lte=now)
+                    .values_list('pk', flat=True)[:batch_size]
+                )
+                if not expired:
+                    break
+                StockReservation.objects.filter(pk__in=expired).delete()
+            released += len(expired)
+        
+        self.stdout.write(self.style.SUCCESS(f'Released {released} expired reservations'))
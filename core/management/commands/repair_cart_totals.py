@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Round
+from core.models import Cart
+
+class Command(BaseCommand):
+    help = 'Check the stored Cart totals against their items and repair the ones that drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report carts whose stored totals are wrong, exit with an error if any',
+        )
+
+    def handle(self, *args, **options):
+        # Amounts are compared at cent precision, SQLite does decimal arithmetic in floating point
+        drifted = Cart.with_computed_totals().filter(
+            ~Q(total_items=F('computed_items'))
+            | ~Q(total_amount__exact=Round(F('computed_amount'), 2))
+        )
+        
+        mismatches = list(drifted.values_list(
+            'pk', 'total_items', 'computed_items', 'total_amount', 'computed_amount'
+        ))
+        for pk, items, computed_items, amount, computed_amount in mismatches:
+            self.stdout.write(
+                f'Cart {pk}: stored {items} items / {amount}, computed {computed_items} items / {computed_amount}'
+            )
+        
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('All cart totals are consistent'))
+            return
+        
+        if options['check']:
+            raise CommandError(f'{len(mismatches)} carts have inconsistent totals')
+        
+        with transaction.atomic():
+            repaired = Cart.recalculate_totals([pk for pk, *_ in mismatches])
+        
+        self.stdout.write(self.style.SUCCESS(f'Repaired totals of {repaired} carts'))
@@ -0,0 +1,204 @@
+import random
+import shutil
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from core.models import Cart, CartItem, Category, Color, Product, ProductSize
+from core.writer import WriteQueue
+
+BENCH_MODELS = [Category, Product, Color, ProductSize, Cart, CartItem]
+
+
+def database_settings(mode, path):
+    """(write alias settings, read alias settings) for a benchmark mode; queued uses the production settings"""
+    primary = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': str(path)}
+    if mode == 'default':
+        return primary, primary
+    primary['OPTIONS'] = {
+        'init_command': ';'.join(f'PRAGMA {pragma}' for pragma in settings.SQLITE_PRAGMAS),
+        'transaction_mode': 'IMMEDIATE',
+    }
+    replica = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f'file:{path}?mode=ro',
+        'OPTIONS': {
+            'uri': True,
+            'init_command': ';'.join(f'PRAGMA {pragma}' for pragma in settings.SQLITE_READ_PRAGMAS),
+        },
+    }
+    return primary, replica
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class Command(BaseCommand):
+    help = 'Compare concurrent cart writes and catalog reads on default and production SQLite settings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent client threads')
+        parser.add_argument('--seconds', type=float, default=5, help='Duration of each run')
+        parser.add_argument('--write-ratio', type=float, default=0.3, help='Share of operations that write a cart')
+        parser.add_argument('--products', type=int, default=500, help='Products in the benchmark database')
+        parser.add_argument('--modes', nargs='+', choices=['default', 'production', 'queued'],
+                            default=['default', 'production', 'queued'])
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        workdir = Path(tempfile.mkdtemp(prefix='sqlite-bench-'))
+        try:
+            results = [self.run_mode(mode, workdir, options) for mode in options['modes']]
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        self.stdout.write(
+            f"\n{'mode':<12}{'reads/s':>10}{'writes/s':>10}{'read p95 ms':>13}"
+            f"{'write p95 ms':>14}{'locked':>8}{'failed':>8}"
+        )
+        for result in results:
+            self.stdout.write(
+                f"{result['mode']:<12}{result['reads_per_s']:>10.0f}{result['writes_per_s']:>10.0f}"
+                f"{result['read_p95_ms']:>13.1f}{result['write_p95_ms']:>14.1f}"
+                f"{result['locked']:>8}{result['failed']:>8}"
+            )
+
+    def run_mode(self, mode, workdir, options):
+        write_alias, read_alias = f'bench_{mode}', f'bench_{mode}_read'
+        primary, replica = database_settings(mode, workdir / f'{mode}.sqlite3')
+        connections.settings.update(connections.configure_settings({
+            'default': connections.settings['default'], write_alias: primary, read_alias: replica,
+        }))
+        try:
+            category_ids, sizes, cart_ids = self.seed(write_alias, options)
+            self.stdout.write(f'{mode}: {options["threads"]} threads for {options["seconds"]}s')
+            write_queue = WriteQueue(using=write_alias) if mode == 'queued' else None
+
+            stats = {'reads': [], 'writes': [], 'locked': 0, 'failed': 0}
+            lock = threading.Lock()
+            deadline = time.monotonic() + options['seconds']
+            threads = [
+                threading.Thread(
+                    target=self.client,
+                    args=(write_alias, read_alias, write_queue, category_ids, sizes, cart_ids, options, deadline, stats, lock, n),
+                )
+                for n in range(options['threads'])
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            if write_queue:
+                write_queue.stop()
+        finally:
+            for alias in (write_alias, read_alias):
+                connections[alias].close()
+                del connections.settings[alias]
+
+        return {
+            'mode': mode,
+            'reads_per_s': len(stats['reads']) / options['seconds'],
+            'writes_per_s': len(stats['writes']) / options['seconds'],
+            'read_p95_ms': percentile(stats['reads'], 95) * 1000,
+            'write_p95_ms': percentile(stats['writes'], 95) * 1000,
+            'locked': stats['locked'],
+            'failed': stats['failed'],
+        }
+
+    def seed(self, alias, options):
+        """Create the tables and a small catalog without signals, so nothing touches the real database"""
+        rng = random.Random(options['seed'])
+        with connections[alias].schema_editor() as editor:
+            for model in BENCH_MODELS:
+                editor.create_model(model)
+
+        categories = Category.objects.using(alias).bulk_create(
+            [Category(name=f'Category {n}') for n in range(10)]
+        )
+        now = timezone.now()
+        products = Product.objects.using(alias).bulk_create([
+            Product(
+                name=f'Product {n}', description='Benchmark product',
+                category=rng.choice(categories), min_price=Decimal('100'), max_price=Decimal('150'),
+                created_at=now, updated_at=now,
+            )
+            for n in range(options['products'])
+        ])
+        product_sizes = ProductSize.objects.using(alias).bulk_create([
+            ProductSize(product=product, size=str(size), price=Decimal(100 + size), stock_quantity=50)
+            for product in products for size in range(38, 44)
+        ])
+        carts = Cart.objects.using(alias).bulk_create(
+            [Cart(session_id=f'bench-{n}') for n in range(options['threads'] * 20)]
+        )
+        connections[alias].close()
+        return (
+            [category.pk for category in categories],
+            [(size.product_id, size.size, size.price) for size in product_sizes],
+            [cart.pk for cart in carts],
+        )
+
+    def client(self, write_alias, read_alias, write_queue, category_ids, sizes, cart_ids, options, deadline, stats, lock, n):
+        rng = random.Random(options['seed'] + n)
+        reads, writes, locked, failed = [], [], 0, 0
+        try:
+            while time.monotonic() < deadline:
+                is_write = rng.random() < options['write_ratio']
+                started = time.perf_counter()
+                try:
+                    if is_write and write_queue:
+                        write_queue.submit(self.add_to_cart, write_alias, rng.choice(cart_ids), rng.choice(sizes)).result()
+                    elif is_write:
+                        self.add_to_cart(write_alias, rng.choice(cart_ids), rng.choice(sizes))
+                    else:
+                        self.read_category(read_alias, rng.choice(category_ids))
+                except OperationalError as exc:
+                    if 'locked' in str(exc):
+                        locked += 1
+                    else:
+                        failed += 1
+                    continue
+                (writes if is_write else reads).append(time.perf_counter() - started)
+        finally:
+            connections[write_alias].close()
+            connections[read_alias].close()
+        with lock:
+            stats['reads'] += reads
+            stats['writes'] += writes
+            stats['locked'] += locked
+            stats['failed'] += failed
+
+    def read_category(self, alias, category_id):
+        products = list(
+            Product.objects.using(alias).filter(category_id=category_id, is_active=True)
+            .order_by('-created_at', '-id')[:12]
+        )
+        list(ProductSize.objects.using(alias).filter(product__in=products))
+
+    def add_to_cart(self, alias, cart_id, size):
+        """Same shape as Cart.add_item: read the line, then write it and the cart totals"""
+        product_id, size_name, price = size
+        with transaction.atomic(using=alias):
+            lines = CartItem.objects.using(alias).filter(cart_id=cart_id, product_id=product_id, size=size_name, color=None)
+            if lines.exists():
+                lines.update(quantity=F('quantity') + 1)
+            else:
+                CartItem.objects.using(alias).bulk_create([
+                    CartItem(cart_id=cart_id, product_id=product_id, size=size_name, quantity=1, price_per_unit=price)
+                ])
+            Cart.objects.using(alias).filter(pk=cart_id).update(
+                total_items=F('total_items') + 1,
+                total_amount=F('total_amount') + price,
+                updated_at=timezone.now(),
+            )
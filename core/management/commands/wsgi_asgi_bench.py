@@ -0,0 +1,178 @@
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from core.models import Product
+
+SETTINGS_MODULE = 'wsgi_asgi_bench_settings'
+SERVER_PROGRAMS = {'wsgi': 'gunicorn', 'asgi': 'uvicorn'}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def fetch(port, path):
+    """One GET on a fresh connection; returns the status code"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n'.encode())
+        await writer.drain()
+        status_line = await reader.readline()
+        await reader.read()
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+async def slow_client(port, seconds, body_size):
+    """A phone on a bad network: sends a cart request body a few bytes at a time"""
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    except OSError:
+        return
+    body = b'{"product_id": 0, "size": "40", "quantity": 1}'.ljust(body_size)
+    try:
+        writer.write(
+            f'POST /api/cart/add/ HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n'
+            f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n'.encode()
+        )
+        step = max(1, len(body) // max(1, int(seconds * 4)))
+        for start in range(0, len(body), step):
+            writer.write(body[start:start + step])
+            await writer.drain()
+            await asyncio.sleep(0.25)
+        await reader.read()
+    except OSError:
+        pass
+    finally:
+        writer.close()
+
+
+class Command(BaseCommand):
+    help = 'Compare request throughput of gunicorn (WSGI threads) and uvicorn (ASGI, async views) with slow clients connected'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--servers', nargs='+', choices=['wsgi', 'asgi'], default=['wsgi', 'asgi'])
+        parser.add_argument('--path', help='URL the fast clients request (default: sizes of the first product)')
+        parser.add_argument('--seconds', type=float, default=10, help='Duration of each run')
+        parser.add_argument('--concurrency', type=int, default=10, help='Fast clients requesting in a loop')
+        parser.add_argument('--slow-clients', type=int, default=50, help='Clients trickling a request body for the whole run')
+        parser.add_argument('--workers', type=int, default=1, help='Server processes')
+        parser.add_argument('--threads', type=int, default=8, help='Threads per gunicorn worker')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not path:
+            product_id = Product.objects.filter(is_active=True).values_list('pk', flat=True).first()
+            if product_id is None:
+                raise CommandError('No products to request, pass --path')
+            path = f'/api/product-sizes/?product_id={product_id}'
+        for server in options['servers']:
+            if shutil.which(SERVER_PROGRAMS[server]) is None:
+                raise CommandError(f'{SERVER_PROGRAMS[server]} is not installed')
+
+        settings_dir = tempfile.mkdtemp(prefix='wsgi-asgi-bench-')
+        with open(os.path.join(settings_dir, f'{SETTINGS_MODULE}.py'), 'w') as f:
+            f.write(f'from {settings.SETTINGS_MODULE} import *\nASYNC_VIEWS = True\n')
+        try:
+            results = [self.run_server(server, path, settings_dir, options) for server in options['servers']]
+        finally:
+            shutil.rmtree(settings_dir, ignore_errors=True)
+
+        self.stdout.write(f"\n{'server':<8}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'errors':>8}")
+        for result in results:
+            self.stdout.write(
+                f"{result['server']:<8}{result['rps']:>8.0f}{result['p50']:>9.1f}"
+                f"{result['p95']:>9.1f}{result['errors']:>8}"
+            )
+
+    def server_command(self, server, port, options):
+        if server == 'wsgi':
+            return [
+                'gunicorn', 'cms.wsgi:application', '--bind', f'127.0.0.1:{port}',
+                '--worker-class', 'gthread', '--workers', str(options['workers']),
+                '--threads', str(options['threads']), '--log-level', 'warning',
+            ]
+        return [
+            'uvicorn', 'cms.asgi:application', '--host', '127.0.0.1', '--port', str(port),
+            '--workers', str(options['workers']), '--log-level', 'warning', '--no-access-log',
+        ]
+
+    def run_server(self, server, path, settings_dir, options):
+        port = free_port()
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([settings_dir, os.getcwd(), *sys.path]))
+        if server == 'asgi':
+            env['DJANGO_SETTINGS_MODULE'] = SETTINGS_MODULE
+        process = subprocess.Popen(self.server_command(server, port, options), env=env)
+        try:
+            self.wait_until_ready(port, path)
+            self.stdout.write(
+                f'{server}: {options["concurrency"]} clients, {options["slow_clients"]} slow clients, {options["seconds"]}s'
+            )
+            latencies, errors = asyncio.run(self.load(port, path, options))
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+        return {
+            'server': server,
+            'rps': len(latencies) / options['seconds'],
+            'p50': percentile(latencies, 50) * 1000,
+            'p95': percentile(latencies, 95) * 1000,
+            'errors': errors,
+        }
+
+    def wait_until_ready(self, port, path, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                asyncio.run(fetch(port, path))
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError(f'Server on port {port} did not start')
+
+    async def load(self, port, path, options):
+        latencies, errors = [], 0
+        deadline = time.monotonic() + options['seconds']
+
+        async def fast_client():
+            nonlocal errors
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    status = await asyncio.wait_for(fetch(port, path), timeout=options['seconds'])
+                except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+                    errors += 1
+                    continue
+                if status >= 500:
+                    errors += 1
+                else:
+                    latencies.append(time.perf_counter() - started)
+
+        slow = [
+            asyncio.create_task(slow_client(port, options['seconds'], 4096))
+            for _ in range(options['slow_clients'])
+        ]
+        await asyncio.sleep(0.5)
+        await asyncio.gather(*(fast_client() for _ in range(options['concurrency'])))
+        for task in slow:
+            task.cancel()
+        await asyncio.gather(*slow, return_exceptions=True)
+        return latencies, errors
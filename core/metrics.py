@@ -0,0 +1,167 @@
+import logging
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.db.backends.signals import connection_created
+from django.template.backends.django import DjangoTemplates, Template
+
+logger = logging.getLogger(__name__)
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+class RequestStats:
+    """What one request spent, filled in by the query wrapper and the template backend"""
+
+    __slots__ = ('queries', 'db_time', 'slowest_time', 'slowest_sql', 'template_time', 'rendering')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_sql = ''
+        self.template_time = 0.0
+        self.rendering = False
+
+
+# Set by RequestMetricsMiddleware for the duration of a request. sync_to_async
+# copies the context, so queries an async view runs in a thread still count.
+current = ContextVar('request_stats', default=None)
+
+
+def time_query(execute, sql, params, many, context):
+    stats = current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = perf_counter() - started
+        stats.queries += 1
+        stats.db_time += elapsed
+        if elapsed > stats.slowest_time:
+            stats.slowest_time = elapsed
+            stats.slowest_sql = sql
+
+
+def install_query_timer(sender, connection, **kwargs):
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+connection_created.connect(install_query_timer)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        stats = current.get()
+        # Templates rendered from inside another one are part of the outer time
+        if stats is None or stats.rendering:
+            return super().render(context, request)
+        stats.rendering = True
+        started = perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_time += perf_counter() - started
+            stats.rendering = False
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing every top-level render into the request's stats"""
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+
+class Histogram:
+    """A Prometheus histogram with one series per label set"""
+
+    def __init__(self, name, documentation, buckets, labels):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.labels = labels
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            # bucket counts, then +Inf, then the sum
+            series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for label_values, series in sorted(self._series.items()):
+            labels = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {series[-1]}')
+            lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+
+    def inc(self, *label_values):
+        self._values[label_values] = self._values.get(label_values, 0) + 1
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        for label_values, value in sorted(self._values.items()):
+            labels = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labels, label_values))
+            lines.append(f'{self.name}{{{labels}}} {value}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+_lock = threading.Lock()
+REQUEST_SECONDS = Histogram('shop_request_duration_seconds', 'Time spent in the view and the middleware below it.',
+                            SECONDS_BUCKETS, ('route', 'method'))
+DB_SECONDS = Histogram('shop_request_db_seconds', 'Time spent running SQL queries per request.',
+                       SECONDS_BUCKETS, ('route', 'method'))
+QUERIES = Histogram('shop_request_queries', 'SQL queries run per request.', QUERY_BUCKETS, ('route', 'method'))
+TEMPLATE_SECONDS = Histogram('shop_request_template_seconds', 'Time spent rendering templates per request.',
+                             SECONDS_BUCKETS, ('route', 'method'))
+RESPONSES = Counter('shop_responses_total', 'Responses sent, by status code.', ('route', 'method', 'status'))
+METRICS = (REQUEST_SECONDS, DB_SECONDS, QUERIES, TEMPLATE_SECONDS, RESPONSES)
+
+
+def observe(route, method, status, elapsed, stats):
+    with _lock:
+        REQUEST_SECONDS.observe(elapsed, route, method)
+        DB_SECONDS.observe(stats.db_time, route, method)
+        QUERIES.observe(stats.queries, route, method)
+        TEMPLATE_SECONDS.observe(stats.template_time, route, method)
+        RESPONSES.inc(route, method, str(status))
+
+
+def exposition():
+    """All metrics in the Prometheus text format.
+
+    The numbers are per process: with several server workers, each one keeps
+    its own histograms and answers /metrics for itself.
+    """
+    with _lock:
+        lines = [line for metric in METRICS for line in metric.exposition()]
+    return '\n'.join(lines) + '\n'
+
@@ -0,0 +1,153 @@
+import re
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from whitenoise.base import WhiteNoise
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from . import metrics
+from .catalog import is_immutable_feed_file
+
+METRIC_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+class CatalogFeedMiddleware:
+    """Serve catalog snapshot files from CATALOG_FEED_ROOT without touching views or the ORM.
+
+    Files are looked up on disk per request (WhiteNoise autorefresh mode) so
+    snapshots written after startup are found; versioned files are sent as
+    immutable, the latest.json pointer with a short max-age. Precompressed
+    .br/.gz copies are negotiated by WhiteNoise.
+    """
+
+    sync_capable = True
+    async_capable = True
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        self.prefix = settings.CATALOG_FEED_URL
+        self.whitenoise = WhiteNoise(
+            application=None,
+            autorefresh=True,
+            max_age=settings.CATALOG_FEED_POINTER_MAX_AGE,
+            immutable_file_test=is_immutable_feed_file,
+        )
+        self.whitenoise.add_files(settings.CATALOG_FEED_ROOT, prefix=self.prefix)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if request.path_info.startswith(self.prefix):
+            static_file = self.whitenoise.find_file(request.path_info)
+            if static_file is not None:
+                return WhiteNoiseMiddleware.serve(static_file, request)
+        return self.get_response(request)
+    
+    async def __acall__(self, request):
+        if request.path_info.startswith(self.prefix):
+            static_file = await sync_to_async(self.whitenoise.find_file)(request.path_info)
+            if static_file is not None:
+                return await sync_to_async(WhiteNoiseMiddleware.serve)(static_file, request)
+        return await self.get_response(request)
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """WhiteNoiseMiddleware that also runs natively under ASGI.
+
+    WhiteNoise's own middleware is sync only, which makes Django run every
+    request's view chain in a thread, async views included.
+    """
+
+    sync_capable = True
+    async_capable = True
+    
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+    
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+    
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
+
+
+class RequestMetricsMiddleware:
+    """Time every request: SQL queries, template rendering and the whole view.
+
+    The numbers go out in a Server-Timing header (shown in the browser's
+    network panel) and into per-route histograms served at /metrics. Queries
+    slower than SLOW_QUERY_MS are logged. The cost is a few perf_counter()
+    calls per query and one lock per request.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = metrics.RequestStats()
+        token = metrics.current.set(stats)
+        started = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.current.reset(token)
+        self.record(request, response, perf_counter() - started, stats)
+        return response
+
+    async def __acall__(self, request):
+        stats = metrics.RequestStats()
+        token = metrics.current.set(stats)
+        started = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.current.reset(token)
+        self.record(request, response, perf_counter() - started, stats)
+        return response
+
+    def record(self, request, response, elapsed, stats):
+        match = request.resolver_match
+        route = match.view_name if match else 'unmatched'
+        method = request.method if request.method in METRIC_METHODS else 'other'
+        metrics.observe(route, method, response.status_code, elapsed, stats)
+
+        if stats.slowest_time * 1000 >= settings.SLOW_QUERY_MS:
+            metrics.logger.warning(
+                'Slow query (%.0f ms) in %s %s: %s', stats.slowest_time * 1000,
+                request.method, request.path, stats.slowest_sql
+            )
+
+        timings = [
+            f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries"',
+            f'tpl;dur={stats.template_time * 1000:.1f};desc="templates"',
+            f'app;dur={elapsed * 1000:.1f};desc="view"',
+        ]
+        if stats.queries:
+            desc = 'slowest query'
+            if settings.SERVER_TIMING_SQL:
+                desc = re.sub(r'\s+', ' ', stats.slowest_sql)[:200].replace('\\', '').replace('"', "'")
+            timings.insert(1, f'sql;dur={stats.slowest_time * 1000:.1f};desc="{desc}"')
+        response.headers['Server-Timing'] = ', '.join(timings)
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-17 23:32
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_product_counts(apps, schema_editor):
+    Category = apps.get_model('core', 'Category')
+    Product = apps.get_model('core', 'Product')
+    active_products = (
+        Product.objects.filter(category=OuterRef('pk'), is_active=True)
+        .order_by()
+        .values('category')
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    Category.objects.update(product_count=Coalesce(Subquery(active_products), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_cart_cartitem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_product_counts, migrations.RunPython.noop),
+    ]
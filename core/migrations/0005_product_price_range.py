@@ -0,0 +1,44 @@
+# Generated by Django 5.2.4 on 2026-10-17 23:33
+
+from django.db import migrations, models
+from django.db.models import Max, Min, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def populate_price_ranges(apps, schema_editor):
+    Product = apps.get_model('core', 'Product')
+    ProductSize = apps.get_model('core', 'ProductSize')
+    sizes = ProductSize.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    price_field = models.DecimalField(max_digits=10, decimal_places=2)
+    stock_field = models.PositiveIntegerField()
+    Product.objects.update(
+        min_price=Coalesce(Subquery(sizes.annotate(value=Min('price')).values('value'), output_field=price_field), 0, output_field=price_field),
+        max_price=Coalesce(Subquery(sizes.annotate(value=Max('price')).values('value'), output_field=price_field), 0, output_field=price_field),
+        total_stock=Coalesce(Subquery(sizes.annotate(value=Sum('stock_quantity')).values('value'), output_field=stock_field), 0, output_field=stock_field),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_category_product_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='max_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='min_price',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='total_stock',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_price_ranges, migrations.RunPython.noop),
+    ]
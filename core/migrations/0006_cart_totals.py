@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-17 23:35
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def populate_cart_totals(apps, schema_editor):
+    Cart = apps.get_model('core', 'Cart')
+    CartItem = apps.get_model('core', 'CartItem')
+    items = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+    amount_field = models.DecimalField(max_digits=10, decimal_places=2)
+    line_total = Sum(F('quantity') * F('price_per_unit'), output_field=amount_field)
+    Cart.objects.update(
+        total_items=Coalesce(Subquery(items.annotate(value=Sum('quantity')).values('value')), 0),
+        total_amount=Coalesce(Subquery(items.annotate(value=line_total).values('value'), output_field=amount_field), 0, output_field=amount_field),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_product_price_range'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='total_items',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_cart_totals, migrations.RunPython.noop),
+    ]
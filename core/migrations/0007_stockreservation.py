@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-17 23:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_cart_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('cart', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='core.cart')),
+                ('product_size', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='core.productsize')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product_size', 'expires_at'], name='core_stockr_product_a8c5e4_idx'), models.Index(fields=['expires_at'], name='core_stockr_expires_3f11d8_idx')],
+                'unique_together': {('product_size', 'cart')},
+            },
+        ),
+    ]
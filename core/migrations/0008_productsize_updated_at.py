@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 23:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_stockreservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productsize',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+
+from core.migrations._search_triggers import DROP_SQL, INDEX_ROWS_SQL, SEARCH_TABLE, TABLE_SQL, TRIGGER_SQL
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in [TABLE_SQL, *TRIGGER_SQL]:
+        schema_editor.execute(statement)
+    schema_editor.execute(
+        f'INSERT INTO {SEARCH_TABLE} (rowid, name, description, category, colors) {INDEX_ROWS_SQL}'
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP_SQL:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_productsize_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.4 on 2026-10-17 23:42
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Frozen copy of core.facets as of this migration, later edits must not change the backfill
+PRICE_BANDS = [
+    ('0-50', Decimal('0'), Decimal('50')),
+    ('50-100', Decimal('50'), Decimal('100')),
+    ('100-150', Decimal('100'), Decimal('150')),
+    ('150-200', Decimal('150'), Decimal('200')),
+    ('200+', Decimal('200'), None),
+]
+
+
+def price_band(price):
+    for value, low, high in PRICE_BANDS:
+        if price >= low and (high is None or price < high):
+            return value
+    return PRICE_BANDS[0][0]
+
+
+def facet_values(product, sizes, colors):
+    values = {('gender', product.gender), ('price', price_band(product.min_price))}
+    values.update(
+        ('size', size.size) for size in sizes
+        if size.is_available and size.stock_quantity > 0
+    )
+    values.update(('color', color.name.strip().lower()) for color in colors if color.name.strip())
+    return values
+
+
+def populate_facets(apps, schema_editor):
+    Product = apps.get_model('core', 'Product')
+    ProductSize = apps.get_model('core', 'ProductSize')
+    Color = apps.get_model('core', 'Color')
+    ProductFacet = apps.get_model('core', 'ProductFacet')
+    sizes, colors = {}, {}
+    for size in ProductSize.objects.all():
+        sizes.setdefault(size.product_id, []).append(size)
+    for color in Color.objects.all():
+        colors.setdefault(color.product_id, []).append(color)
+    ProductFacet.objects.bulk_create([
+        ProductFacet(product_id=product.id, category_id=product.category_id, facet=facet, value=value)
+        for product in Product.objects.filter(is_active=True)
+        for facet, value in facet_values(product, sizes.get(product.id, []), colors.get(product.id, []))
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(choices=[('gender', 'Gender'), ('size', 'Size'), ('color', 'Color'), ('price', 'Price')], max_length=10)),
+                ('value', models.CharField(max_length=50)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.category')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='core.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['category', 'facet', 'value', 'product'], name='core_produc_categor_801664_idx')],
+                'unique_together': {('product', 'facet', 'value')},
+            },
+        ),
+        migrations.RunPython(populate_facets, migrations.RunPython.noop),
+    ]
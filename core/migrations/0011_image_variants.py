@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-17 23:45
+
+from django.db import migrations, models
+
+from core.migrations._search_triggers import without_triggers
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_productfacet'),
+    ]
+
+    # Adding a column rebuilds the tables on SQLite, see without_triggers()
+    operations = without_triggers(
+        migrations.AddField(
+            model_name='category',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    )
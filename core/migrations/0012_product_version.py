@@ -0,0 +1,20 @@
+# Generated by Django 5.2.4 on 2026-10-17 23:47
+
+from django.db import migrations, models
+
+from core.migrations._search_triggers import without_triggers
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_image_variants'),
+    ]
+
+    operations = without_triggers(
+        migrations.AddField(
+            model_name='product',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    )
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-17 23:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_product_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cart',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
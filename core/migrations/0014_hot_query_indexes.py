@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-17 23:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_cart_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='productsize',
+            options={'ordering': ['product_id', 'size']},
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at'], name='core_order_created_912d27_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'created_at'], name='core_order_status_273d1f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', '-created_at', 'id'], name='core_produc_categor_3ff9a2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['created_at'], name='core_produc_created_182d27_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productsize',
+            index=models.Index(fields=['product', 'is_available', 'size'], name='core_produc_product_9b7b0b_idx'),
+        ),
+    ]
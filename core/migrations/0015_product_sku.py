@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-18 00:39
+
+from django.db import migrations, models
+from django.db.models import Value
+from django.db.models.functions import Cast, Concat
+
+from core.migrations._search_triggers import without_triggers
+
+
+def populate_skus(apps, schema_editor):
+    # Existing products get P<id>, so an export can be edited and imported back
+    Product = apps.get_model('core', 'Product')
+    Product.objects.filter(sku__isnull=True).update(
+        sku=Concat(Value('P'), Cast('id', models.CharField()), output_field=models.CharField())
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_hot_query_indexes'),
+    ]
+
+    operations = [
+        *without_triggers(
+            migrations.AddField(
+                model_name='product',
+                name='sku',
+                field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+            ),
+        ),
+        migrations.RunPython(populate_skus, migrations.RunPython.noop),
+    ]
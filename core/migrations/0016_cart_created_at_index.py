@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-18 01:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_product_sku'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(fields=['created_at'], name='core_cart_created_fa5e44_idx'),
+        ),
+    ]
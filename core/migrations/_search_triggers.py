@@ -0,0 +1,93 @@
+"""Frozen copy of the search index SQL of core.search, as created by migration 0009.
+
+Migrations must not follow later edits of core.search, so they import the
+statements from here. Never edit this file: when the index or its triggers
+change, the migration making the change carries its own copy of the new SQL.
+(The migration loader skips modules starting with an underscore.)
+"""
+from django.db import migrations
+
+SEARCH_TABLE = 'core_product_search'
+
+INDEX_ROWS_SQL = """
+    SELECT p.id, p.name, p.description, c.name,
+           COALESCE((SELECT group_concat(name, ' ') FROM core_color WHERE product_id = p.id), '')
+    FROM core_product p JOIN core_category c ON c.id = p.category_id
+"""
+
+TABLE_SQL = """CREATE VIRTUAL TABLE core_product_search USING fts5(
+    name, description, category, colors,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+)"""
+
+TRIGGER_SQL = [
+    """CREATE TRIGGER core_product_search_ai AFTER INSERT ON core_product BEGIN
+        INSERT INTO core_product_search (rowid, name, description, category, colors)
+        VALUES (NEW.id, NEW.name, NEW.description,
+                (SELECT name FROM core_category WHERE id = NEW.category_id), '');
+    END""",
+    """CREATE TRIGGER core_product_search_au AFTER UPDATE OF name, description, category_id ON core_product BEGIN
+        UPDATE core_product_search
+        SET name = NEW.name, description = NEW.description,
+            category = (SELECT name FROM core_category WHERE id = NEW.category_id)
+        WHERE rowid = NEW.id;
+    END""",
+    """CREATE TRIGGER core_product_search_ad AFTER DELETE ON core_product BEGIN
+        DELETE FROM core_product_search WHERE rowid = OLD.id;
+    END""",
+    """CREATE TRIGGER core_category_search_au AFTER UPDATE OF name ON core_category BEGIN
+        UPDATE core_product_search SET category = NEW.name
+        WHERE rowid IN (SELECT id FROM core_product WHERE category_id = NEW.id);
+    END""",
+    """CREATE TRIGGER core_color_search_ai AFTER INSERT ON core_color BEGIN
+        UPDATE core_product_search
+        SET colors = COALESCE((SELECT group_concat(name, ' ') FROM core_color WHERE product_id = NEW.product_id), '')
+        WHERE rowid = NEW.product_id;
+    END""",
+    """CREATE TRIGGER core_color_search_au AFTER UPDATE OF name, product_id ON core_color BEGIN
+        UPDATE core_product_search
+        SET colors = COALESCE((SELECT group_concat(name, ' ') FROM core_color WHERE product_id = core_product_search.rowid), '')
+        WHERE rowid IN (OLD.product_id, NEW.product_id);
+    END""",
+    """CREATE TRIGGER core_color_search_ad AFTER DELETE ON core_color BEGIN
+        UPDATE core_product_search
+        SET colors = COALESCE((SELECT group_concat(name, ' ') FROM core_color WHERE product_id = OLD.product_id), '')
+        WHERE rowid = OLD.product_id;
+    END""",
+]
+
+DROP_TRIGGER_SQL = [
+    'DROP TRIGGER IF EXISTS core_color_search_ad',
+    'DROP TRIGGER IF EXISTS core_color_search_au',
+    'DROP TRIGGER IF EXISTS core_color_search_ai',
+    'DROP TRIGGER IF EXISTS core_category_search_au',
+    'DROP TRIGGER IF EXISTS core_product_search_ad',
+    'DROP TRIGGER IF EXISTS core_product_search_au',
+    'DROP TRIGGER IF EXISTS core_product_search_ai',
+]
+
+DROP_SQL = [*DROP_TRIGGER_SQL, 'DROP TABLE IF EXISTS core_product_search']
+
+
+def run_sql(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'sqlite':
+            for statement in statements:
+                schema_editor.execute(statement)
+    return run
+
+
+def without_triggers(*operations):
+    """Wrap migration operations that rebuild core_product, core_category or core_color.
+
+    SQLite alters those tables by copying them into a new table and renaming
+    it, which fails while the search triggers reference the old one; the
+    triggers are dropped around the operations and created again after.
+    """
+    drop, create = run_sql(DROP_TRIGGER_SQL), run_sql(TRIGGER_SQL)
+    return [
+        migrations.RunPython(drop, create),
+        *operations,
+        migrations.RunPython(create, drop),
+    ]
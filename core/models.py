@@ -1,23 +1,79 @@
-from django.db import models
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Count, F, Max, Min, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 import uuid
 
-class Category(models.Model):
+from .images import image_sources
+
+class DenormalizedFieldsMixin:
+    """Leave counter columns out of plain saves of existing rows.
+
+    These columns are maintained with UPDATE ... F() statements, so a save of
+    an instance loaded earlier must not write its stale copy back.
+    """
+    denormalized_fields = ()
+    
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not args and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.denormalized_fields
+            ]
+        super().save(*args, **kwargs)
+
+class Category(DenormalizedFieldsMixin, models.Model):
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True)
     image = models.ImageField(upload_to='categories/', blank=True, null=True)
+    # Resized copies of image, written by core.images in the background
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     is_active = models.BooleanField(default=True)
+    product_count = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    denormalized_fields = ('product_count', 'image_variants')
+    
     class Meta:
         verbose_name_plural = "Categories"
         ordering = ['name']
     
     def __str__(self):
         return self.name
+    
+    @property
+    def image_sources(self):
+        """srcset data of the image for <picture>, None without an image"""
+        return image_sources(self.image, self.image_variants)
+    
+    @classmethod
+    def adjust_product_count(cls, category_id, delta):
+        """Add delta to the stored active product count of a category"""
+        categories = cls.objects.filter(pk=category_id)
+        if delta < 0:
+            categories = categories.filter(product_count__gte=-delta)
+        categories.update(product_count=F('product_count') + delta)
+    
+    @classmethod
+    def rebuild_product_counts(cls):
+        """Recount active products for every category in a single UPDATE"""
+        active_products = (
+            Product.objects.filter(category=OuterRef('pk'), is_active=True)
+            .order_by()
+            .values('category')
+            .annotate(total=Count('pk'))
+            .values('total')
+        )
+        return cls.objects.update(
+            product_count=Coalesce(Subquery(active_products), 0)
+        )
 
-class Product(models.Model):
+class Product(DenormalizedFieldsMixin, models.Model):
     GENDER_CHOICES = [
         ('M', 'Men'),
         ('F', 'Women'),
@@ -25,17 +81,34 @@ class Product(models.Model):
     ]
     
     name = models.CharField(max_length=200)
+    # Key of the product in catalog imports and exports (see core.catalog_io)
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     description = models.TextField()
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
     gender = models.CharField(max_length=1, choices=GENDER_CHOICES, default='U')
     video_url = models.URLField(blank=True, null=True)
     image = models.ImageField(upload_to='products/', blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     is_active = models.BooleanField(default=True)
+    # Denormalized from ProductSize, see refresh_price_ranges()
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False, db_index=True)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+    total_stock = models.PositiveIntegerField(default=0, editable=False)
+    # Bumped on every change to the product, its sizes or colors; keys the card cache
+    version = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    denormalized_fields = ('min_price', 'max_price', 'total_stock', 'image_variants', 'version')
+    
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Category listings: filter by category, keyset order (-created_at, id)
+            models.Index(fields=['category', '-created_at', 'id']),
+            # Default ordering of unfiltered lists (admin, home)
+            models.Index(fields=['created_at']),
+        ]
     
     def __str__(self):
         return f"{self.name} - {self.category.name}"
@@ -43,10 +116,38 @@ class Product(models.Model):
     @property
     def base_price(self):
         """Get the base price (lowest size price)"""
-        sizes = self.product_sizes.all()
-        if sizes.exists():
-            return min(size.price for size in sizes)
-        return 0
+        return self.min_price
+    
+    @property
+    def image_sources(self):
+        """srcset data of the image for <picture>, None without an image"""
+        return image_sources(self.image, self.image_variants)
+    
+    @classmethod
+    def refresh_price_ranges(cls, product_ids=None):
+        """Recompute stored price range and stock total from the ProductSize rows"""
+        sizes = ProductSize.objects.filter(product=OuterRef('pk')).order_by().values('product')
+        
+        def size_aggregate(aggregate, output_field):
+            return Coalesce(
+                Subquery(sizes.annotate(value=aggregate).values('value'), output_field=output_field),
+                0,
+                output_field=output_field,
+            )
+        
+        products = cls.objects.all()
+        if product_ids is not None:
+            products = products.filter(pk__in=product_ids)
+        return products.update(
+            min_price=size_aggregate(Min('price'), models.DecimalField(max_digits=10, decimal_places=2)),
+            max_price=size_aggregate(Max('price'), models.DecimalField(max_digits=10, decimal_places=2)),
+            total_stock=size_aggregate(Sum('stock_quantity'), models.PositiveIntegerField()),
+        )
+    
+    @classmethod
+    def bump_versions(cls, product_ids):
+        """Invalidate the cached cards of the given products"""
+        return cls.objects.filter(pk__in=product_ids).update(version=F('version') + 1)
     
     @property
     def available_sizes(self):
@@ -67,31 +168,159 @@ class ProductSize(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock_quantity = models.PositiveIntegerField(default=0)
     is_available = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         unique_together = ['product', 'size']
-        ordering = ['size']
+        # product_id first so fetching the sizes of several products walks the
+        # (product, size) unique index instead of sorting
+        ordering = ['product_id', 'size']
+        indexes = [
+            # available_sizes: filter(product, is_available) ordered by size
+            models.Index(fields=['product', 'is_available', 'size']),
+        ]
     
     def __str__(self):
         return f"{self.product.name} - Size {self.size} - ${self.price}"
 
-class Cart(models.Model):
+class ProductFacet(models.Model):
+    """One filterable attribute value of an active product (see core.facets).
+
+    Category pages filter and count on this narrow table instead of joining
+    Product, ProductSize and Color on every request.
+    """
+    FACET_CHOICES = [
+        ('gender', 'Gender'),
+        ('size', 'Size'),
+        ('color', 'Color'),
+        ('price', 'Price'),
+    ]
+    
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='facets')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    facet = models.CharField(max_length=10, choices=FACET_CHOICES)
+    value = models.CharField(max_length=50)
+    
+    class Meta:
+        unique_together = ['product', 'facet', 'value']
+        indexes = [
+            models.Index(fields=['category', 'facet', 'value', 'product']),
+        ]
+    
+    def __str__(self):
+        return f"{self.product_id} {self.facet}={self.value}"
+
+class Cart(DenormalizedFieldsMixin, models.Model):
     session_id = models.CharField(max_length=100, unique=True)
+    # Denormalized from CartItem, maintained by the item methods below
+    total_items = models.PositiveIntegerField(default=0, editable=False)
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    # Indexed for purge_abandoned_carts
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    
+    denormalized_fields = ('total_items', 'total_amount')
+    
+    class Meta:
+        indexes = [
+            # Admin cart list: newest first
+            models.Index(fields=['created_at']),
+        ]
     
     def __str__(self):
         return f"Cart {self.session_id}"
     
-    @property
-    def total_items(self):
-        """Get total number of items in cart"""
-        return sum(item.quantity for item in self.items.all())
+    def _apply_totals_delta(self, items, amount):
+        """Shift the stored totals by a delta and re-read them (one row)"""
+        Cart.objects.filter(pk=self.pk).update(
+            total_items=F('total_items') + items,
+            total_amount=F('total_amount') + amount,
+            updated_at=timezone.now(),
+        )
+        self.refresh_from_db(fields=['total_items', 'total_amount', 'updated_at'])
     
-    @property
-    def total_amount(self):
-        """Get total amount of cart"""
-        return sum(item.total_price for item in self.items.all())
+    def add_item(self, product, size, color=None, quantity=1, price_per_unit=None):
+        """Add quantity of a product/size/color, merging with an existing line"""
+        if price_per_unit is None:
+            price_per_unit = product.base_price
+        with transaction.atomic():
+            item, created = self.items.get_or_create(
+                product=product,
+                size=size,
+                color=color,
+                defaults={'quantity': quantity, 'price_per_unit': price_per_unit}
+            )
+            if not created:
+                CartItem.objects.filter(pk=item.pk).update(quantity=F('quantity') + quantity)
+                item.refresh_from_db(fields=['quantity'])
+            StockReservation.sync(self, item.product_id, item.size)
+            self._apply_totals_delta(quantity, quantity * item.price_per_unit)
+        return item
+    
+    def set_item_quantity(self, item, quantity, price_per_unit=None):
+        """Set the quantity (and optionally the unit price) of one of this cart's lines"""
+        with transaction.atomic():
+            current = CartItem.objects.select_for_update().get(pk=item.pk, cart=self)
+            if price_per_unit is None:
+                price_per_unit = current.price_per_unit
+            CartItem.objects.filter(pk=item.pk).update(quantity=quantity, price_per_unit=price_per_unit)
+            StockReservation.sync(self, current.product_id, current.size)
+            self._apply_totals_delta(
+                quantity - current.quantity,
+                quantity * price_per_unit - current.total_price
+            )
+        item.quantity = quantity
+        item.price_per_unit = price_per_unit
+        return item
+    
+    def remove_item(self, item):
+        """Delete one of this cart's lines"""
+        with transaction.atomic():
+            current = CartItem.objects.select_for_update().get(pk=item.pk, cart=self)
+            current.delete()
+            StockReservation.sync(self, current.product_id, current.size)
+            self._apply_totals_delta(-current.quantity, -current.total_price)
+    
+    def clear(self):
+        """Delete every line, release the stock holds and reset the stored totals"""
+        with transaction.atomic():
+            self.items.all().delete()
+            self.reservations.all().delete()
+            Cart.objects.filter(pk=self.pk).update(
+                total_items=0, total_amount=0, updated_at=timezone.now()
+            )
+        self.total_items = 0
+        self.total_amount = 0
+    
+    @staticmethod
+    def _computed_totals():
+        """Expressions computing a cart's (items, amount) from its CartItem rows"""
+        items = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+        amount_field = models.DecimalField(max_digits=10, decimal_places=2)
+        line_total = Sum(F('quantity') * F('price_per_unit'), output_field=amount_field)
+        return (
+            Coalesce(Subquery(items.annotate(value=Sum('quantity')).values('value')), 0),
+            Coalesce(
+                Subquery(items.annotate(value=line_total).values('value'), output_field=amount_field),
+                0,
+                output_field=amount_field,
+            ),
+        )
+    
+    @classmethod
+    def with_computed_totals(cls):
+        """Annotate carts with totals computed from their items, to check the stored ones"""
+        computed_items, computed_amount = cls._computed_totals()
+        return cls.objects.annotate(computed_items=computed_items, computed_amount=computed_amount)
+    
+    @classmethod
+    def recalculate_totals(cls, cart_ids=None):
+        """Overwrite the stored totals with the ones computed from the items"""
+        computed_items, computed_amount = cls._computed_totals()
+        carts = cls.objects.all()
+        if cart_ids is not None:
+            carts = carts.filter(pk__in=cart_ids)
+        return carts.update(total_items=computed_items, total_amount=computed_amount)
     
     def get_or_create_cart_item(self, product, size, color=None):
         """Get existing cart item or create new one"""
@@ -103,6 +332,20 @@ class Cart(models.Model):
         )
         return item
 
+class EmptyCart:
+    """Cart of a visitor who has not added anything yet; reading it runs no queries"""
+    pk = id = None
+    session_id = None
+    total_items = 0
+    total_amount = Decimal('0.00')
+    
+    def __str__(self):
+        return "Empty cart"
+    
+    @property
+    def items(self):
+        return CartItem.objects.none()
+
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -120,18 +363,104 @@ class CartItem(models.Model):
     @property
     def total_price(self):
         """Calculate total price for this item"""
+        if self.price_per_unit is None:
+            # Unsaved line, e.g. the blank row of an admin inline
+            return None
         return self.quantity * self.price_per_unit
     
     def update_quantity(self, new_quantity):
         """Update quantity and recalculate price"""
-        self.quantity = max(1, new_quantity)
+        price_per_unit = None
         # Get the current price for this size
         try:
             product_size = self.product.product_sizes.get(size=self.size)
-            self.price_per_unit = product_size.price
+            price_per_unit = product_size.price
         except ProductSize.DoesNotExist:
             pass
-        self.save()
+        self.cart.set_item_quantity(self, max(1, new_quantity), price_per_unit)
+
+class InsufficientStock(ValueError):
+    pass
+
+class StockReservation(models.Model):
+    """Time-limited hold on the stock of a size, taken while it sits in a cart.
+
+    Holds are rows of a ledger rather than counters on ProductSize, so adding
+    to a cart never writes the hot stock row; only checkout decrements it.
+    Expired rows are ignored by every check and deleted by the
+    release_expired_reservations command.
+    """
+    product_size = models.ForeignKey(ProductSize, on_delete=models.CASCADE, related_name='reservations')
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = ['product_size', 'cart']
+        indexes = [
+            models.Index(fields=['product_size', 'expires_at']),
+            models.Index(fields=['expires_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.quantity} x {self.product_size_id} for cart {self.cart_id} until {self.expires_at}"
+    
+    @staticmethod
+    def hold_duration():
+        return timedelta(minutes=getattr(settings, 'STOCK_RESERVATION_MINUTES', 15))
+    
+    @classmethod
+    def held_by_others(cls, cart=None):
+        """Expression: quantity of the outer ProductSize held by active holds of other carts"""
+        holds = cls.objects.filter(product_size=OuterRef('pk'), expires_at__gt=timezone.now())
+        if cart is not None:
+            holds = holds.exclude(cart=cart)
+        return Coalesce(
+            Subquery(holds.order_by().values('product_size').annotate(total=Sum('quantity')).values('total')),
+            0
+        )
+    
+    @classmethod
+    def check_available(cls, product_id, size, demand, cart=None):
+        """Return the ProductSize if demand fits in its stock less the active holds
+        of other carts (of all carts without one); raise InsufficientStock otherwise
+        """
+        product_size = (
+            ProductSize.objects.filter(product_id=product_id, size=size)
+            .annotate(held=cls.held_by_others(cart))
+            .first()
+        )
+        if product_size is None or not product_size.is_available:
+            raise InsufficientStock(f'Size {size} is not available')
+        available = product_size.stock_quantity - product_size.held
+        if available < demand:
+            raise InsufficientStock(f'Only {max(available, 0)} left in size {size}')
+        return product_size
+    
+    @classmethod
+    def sync(cls, cart, product_id, size):
+        """Make the cart's hold on a size match how many of it the cart contains.
+
+        Stock is only checked when the hold grows, so a cart can always be
+        reduced, even below a hold that stock changes have since overtaken.
+        """
+        demand = cart.items.filter(product_id=product_id, size=size).aggregate(total=Sum('quantity'))['total'] or 0
+        holds = cls.objects.filter(cart=cart, product_size__product_id=product_id, product_size__size=size)
+        if not demand:
+            holds.delete()
+            return
+        
+        if demand > (holds.values_list('quantity', flat=True).first() or 0):
+            product_size = cls.check_available(product_id, size, demand, cart)
+        else:
+            product_size = ProductSize.objects.get(product_id=product_id, size=size)
+        
+        cls.objects.update_or_create(
+            cart=cart,
+            product_size=product_size,
+            defaults={'quantity': demand, 'expires_at': timezone.now() + cls.hold_duration()}
+        )
 
 class Order(models.Model):
     STATUS_CHOICES = [
@@ -152,6 +481,13 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            # Admin order list: newest first, optionally filtered by status
+            models.Index(fields=['created_at']),
+            models.Index(fields=['status', 'created_at']),
+        ]
+    
     def __str__(self):
         return f"Order {self.order_id} - {self.customer_name}"
 
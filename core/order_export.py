@@ -0,0 +1,65 @@
+from itertools import islice
+
+from .models import OrderItem
+from .streaming import format_lines
+
+# One row per order item, the order columns repeating on each of its rows
+# (one row with empty item columns for an order without items)
+COLUMNS = [
+    'order_id', 'created_at', 'status', 'customer_name', 'phone_number', 'city', 'address', 'order_total',
+    'product_id', 'sku', 'product_name', 'size', 'color', 'quantity', 'price_per_unit', 'total_price',
+]
+ORDER_FIELDS = ('pk', 'order_id', 'created_at', 'status', 'customer_name', 'phone_number', 'city', 'address',
+                'total_amount')
+ITEM_FIELDS = ('order_id', 'product_id', 'product__sku', 'product__name', 'size', 'color__name', 'quantity',
+               'price_per_unit', 'total_price')
+CHUNK_SIZE = 2000
+
+
+def export_rows(queryset, chunk_size=CHUNK_SIZE):
+    """Flattened rows of the orders of queryset, oldest first.
+
+    Orders are read with a server-side iterator, chunk_size at a time, and the
+    items of each chunk with one joined query, so memory does not grow with
+    the number of orders.
+    """
+    orders = queryset.order_by('created_at', 'pk').values_list(*ORDER_FIELDS).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(orders, chunk_size))
+        if not chunk:
+            return
+        items = {}
+        for order_pk, *item in OrderItem.objects.filter(order_id__in=[order[0] for order in chunk]).order_by(
+            'order_id', 'pk'
+        ).values_list(*ITEM_FIELDS):
+            items.setdefault(order_pk, []).append(item)
+
+        for pk, order_id, created_at, status, customer_name, phone_number, city, address, total in chunk:
+            row = {
+                'order_id': order_id,
+                'created_at': created_at,
+                'status': status,
+                'customer_name': customer_name,
+                'phone_number': phone_number,
+                'city': city,
+                'address': address,
+                'order_total': total,
+            }
+            if pk not in items:
+                yield row
+            for product_id, sku, product_name, size, color, quantity, price_per_unit, total_price in items.get(pk, ()):
+                yield {
+                    **row,
+                    'product_id': product_id,
+                    'sku': sku,
+                    'product_name': product_name,
+                    'size': size,
+                    'color': color,
+                    'quantity': quantity,
+                    'price_per_unit': price_per_unit,
+                    'total_price': total_price,
+                }
+
+
+def export_lines(queryset, fmt):
+    return format_lines(fmt, COLUMNS, export_rows(queryset))
@@ -0,0 +1,116 @@
+import base64
+from datetime import datetime
+
+from django.core.paginator import Paginator
+from django.db import connections, router
+from django.db.models import Max, Q
+from django.utils.functional import cached_property
+
+# Unfiltered tables estimated above this many rows are not counted exactly
+ESTIMATED_COUNT_THRESHOLD = 100_000
+
+
+def encode_cursor(product):
+    """Encode the (created_at, id) position of a product as an opaque cursor"""
+    raw = f"{product.created_at.isoformat()}|{product.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor back into (created_at, id); raises ValueError if malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, pk = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(pk)
+    except (TypeError, UnicodeDecodeError, ValueError) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def keyset_queryset(queryset, after=None, page_size=12):
+    """The queryset of one page plus one extra row that tells whether a next page exists"""
+    queryset = queryset.order_by('-created_at', 'id')
+    if after:
+        created_at, pk = decode_cursor(after)
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__gt=pk)
+        )
+    return queryset[:page_size + 1]
+
+
+def _page(items, page_size):
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_cursor = encode_cursor(items[-1])
+    return items, next_cursor
+
+
+def keyset_page(queryset, after=None, page_size=12):
+    """Return one page of products ordered by (-created_at, id) and the cursor of the next one.
+
+    The position is carried in the cursor instead of an OFFSET, so every page
+    costs the same whatever its depth in the listing.
+    """
+    return _page(list(keyset_queryset(queryset, after, page_size)), page_size)
+
+
+async def akeyset_page(queryset, after=None, page_size=12):
+    """keyset_page() for async views"""
+    return _page([item async for item in keyset_queryset(queryset, after, page_size)], page_size)
+
+
+def estimated_row_count(model):
+    """Cheap estimate of the number of rows of a model's table, None when there is none.
+
+    PostgreSQL keeps one in its statistics. Elsewhere the highest primary key
+    is read from the end of its index: exact until rows are deleted, then an
+    overestimate.
+    """
+    using = router.db_for_read(model)
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+            row = cursor.fetchone()
+        return row[0] if row and row[0] >= 0 else None
+    top = model._default_manager.using(using).aggregate(top=Max('pk'))['top']
+    return top if isinstance(top, int) else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator for admin changelists of big tables.
+
+    A COUNT(*) reads the whole table, so the unfiltered count of a big table
+    is estimated instead. Filtered and searched lists, which are narrowed by
+    an index, are still counted exactly. Off PostgreSQL the estimate grows
+    with every deleted row; the first page found short of rows shows where
+    the table really ends, and from there on the count is exact (an empty
+    page is replaced by the real last one). Tables that lose many rows, like
+    the purged Cart, are still better counted exactly.
+    """
+    estimated = False
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is None or query.where:
+            return super().count
+        estimate = estimated_row_count(self.object_list.model)
+        if estimate is None or estimate < ESTIMATED_COUNT_THRESHOLD:
+            return super().count
+        self.estimated = True
+        return estimate
+
+    def page(self, number):
+        page = super().page(number)
+        rows = len(page.object_list)
+        if not self.estimated or rows >= self.per_page:
+            return page
+        # Short of a full page: the estimate ran past the last row
+        self.estimated = False
+        self.__dict__.pop('num_pages', None)
+        if rows:
+            self.count = (page.number - 1) * self.per_page + rows
+            return page
+        self.count = self.object_list.count()
+        return super().page(min(page.number, self.num_pages))
@@ -0,0 +1,26 @@
+from django.db import connections
+
+REPLICA = 'replica'
+
+
+class ReadReplicaRouter:
+    """Send reads to the read-only SQLite connection and everything else to default.
+
+    Both aliases open the same WAL database file, so readers see every
+    committed write and never wait for the writer. Reads inside a transaction
+    stay on default to see that transaction's own uncommitted rows.
+    """
+
+    def db_for_read(self, model, **hints):
+        if connections['default'].in_atomic_block:
+            return 'default'
+        return REPLICA
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA
@@ -0,0 +1,275 @@
+import random
+import uuid
+from array import array
+from bisect import bisect
+from collections import namedtuple
+from datetime import timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import facets, search
+from .models import Cart, CartItem, Category, Color, Order, OrderItem, Product, ProductFacet, ProductSize
+
+SIZES = ['36', '37', '38', '39', '40', '41', '42', '43', '44', '45']
+COLORS = [
+    ('Black', '#000000'), ('White', '#ecf0f1'), ('Red', '#e74c3c'), ('Navy Blue', '#2c3e50'),
+    ('Brown', '#8B4513'), ('Green', '#2ecc71'), ('Blue', '#3498db'), ('Teal', '#16a085'),
+]
+CATEGORY_NAMES = ['Running', 'Basketball', 'Training', 'Casual', 'Boots', 'Sandals', 'Hiking', 'Lifestyle']
+PRODUCT_WORDS = ['Premium', 'Classic', 'Ultra', 'Lite', 'Pro', 'Trail', 'Court', 'Street', 'Summer', 'Leather']
+FIRST_NAMES = ['Sara', 'Youssef', 'Fatima', 'Omar', 'Khadija', 'Amine', 'Salma', 'Hamza', 'Imane', 'Mehdi']
+LAST_NAMES = ['Alaoui', 'Bennani', 'Tazi', 'El Idrissi', 'Berrada', 'Chraibi', 'Fassi', 'Amrani']
+CITIES = ['Casablanca', 'Rabat', 'Marrakech', 'Fes', 'Tangier', 'Agadir', 'Meknes', 'Oujda']
+
+# Zipf exponents: a few categories hold most products, a few products get most sales
+CATEGORY_SKEW = 1.2
+PRODUCT_SKEW = 1.1
+
+PRODUCT_FIELDS = (
+    'id', 'sku', 'name', 'description', 'category_id', 'gender', 'is_active', 'image_variants',
+    'min_price', 'max_price', 'total_stock', 'version', 'created_at', 'updated_at',
+)
+SIZE_FIELDS = ('product_id', 'size', 'price', 'stock_quantity', 'is_available', 'updated_at')
+COLOR_FIELDS = ('id', 'product_id', 'name', 'hex_code')
+FACET_FIELDS = ('product_id', 'category_id', 'facet', 'value')
+CART_FIELDS = ('id', 'session_id', 'total_items', 'total_amount', 'created_at', 'updated_at')
+CART_ITEM_FIELDS = ('cart_id', 'product_id', 'size', 'color_id', 'quantity', 'price_per_unit')
+ORDER_FIELDS = (
+    'id', 'order_id', 'customer_name', 'phone_number', 'city', 'address', 'total_amount', 'status',
+    'created_at', 'updated_at',
+)
+ORDER_ITEM_FIELDS = ('order_id', 'product_id', 'size', 'color_id', 'quantity', 'price_per_unit', 'total_price')
+
+# What core.facets.facet_values() reads from products, sizes and colors
+FacetProduct = namedtuple('FacetProduct', 'gender min_price')
+FacetSize = namedtuple('FacetSize', 'size stock_quantity is_available')
+FacetColor = namedtuple('FacetColor', 'name')
+
+
+def zipf_weights(count, skew):
+    """Cumulative weights of ranks 1..count for random.choices"""
+    return list(accumulate(1 / (rank ** skew) for rank in range(1, count + 1)))
+
+
+def insert_rows(model, fields, rows):
+    """INSERT tuples of database-ready values for the given fields with one executemany.
+
+    bulk_create builds a model instance and prepares every value through its
+    field, which caps it at a few thousand rows per second; this skips both.
+    Every NOT NULL column without a database default must be listed.
+    """
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(model._meta.get_field(field).column) for field in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {quote(model._meta.db_table)} ({columns}) VALUES ({placeholders})', rows)
+
+
+def next_id(model):
+    return (model.objects.aggregate(top=Max('pk'))['top'] or 0) + 1
+
+
+def size_price(base_price, offset):
+    return Decimal(base_price + offset * 5) - Decimal('0.01')
+
+
+class SampleCatalog:
+    """Compact record of the generated products, enough to pick realistic cart and order lines"""
+
+    def __init__(self):
+        self.product_ids = array('q')
+        self.base_prices = array('H')
+        self.first_sizes = array('B')
+        self.size_counts = array('B')
+        self.first_colors = array('q')
+        self.color_counts = array('B')
+        self.popularity = None
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def add(self, product_id, base_price, first_size, size_count, first_color, color_count):
+        self.product_ids.append(product_id)
+        self.base_prices.append(base_price)
+        self.first_sizes.append(first_size)
+        self.size_counts.append(size_count)
+        self.first_colors.append(first_color)
+        self.color_counts.append(color_count)
+
+    def rank_popularity(self, rng):
+        """Shuffle which products are the best sellers"""
+        order = list(range(len(self)))
+        rng.shuffle(order)
+        self.popularity = order, zipf_weights(len(order), PRODUCT_SKEW)
+
+    def pick(self, rng):
+        """(product_id, size, color_id, price) of a line, hot products first"""
+        order, weights = self.popularity
+        n = order[bisect(weights, rng.random() * weights[-1])]
+        offset = rng.randrange(self.size_counts[n])
+        color = self.first_colors[n] + rng.randrange(self.color_counts[n])
+        return self.product_ids[n], SIZES[self.first_sizes[n] + offset], color, size_price(self.base_prices[n], offset)
+
+
+def generate(categories=6, products=100, carts=0, orders=0, seed=1, days=365, batch_size=5000, log=None):
+    """Insert a random catalog with carts and order history, the same for the same arguments.
+
+    Category sizes and product sales follow a Zipf distribution. Rows are
+    written in batches of batch_size, one transaction each, with no signals:
+    price ranges and facets are computed as the rows are generated, product
+    counts and the search index are rebuilt once at the end. Returns the new
+    categories.
+    """
+    log = log or (lambda message: None)
+    rng = random.Random(seed)
+    now = timezone.now()
+    category_objs = Category.objects.bulk_create([
+        Category(
+            name=f'{CATEGORY_NAMES[n % len(CATEGORY_NAMES)]} {n // len(CATEGORY_NAMES) + 1}',
+            description='Sample category',
+        )
+        for n in range(categories)
+    ])
+    with search.triggers_suspended():
+        catalog = _generate_products(rng, category_objs, products, now, days, batch_size, log)
+    if catalog and (carts or orders):
+        catalog.rank_popularity(rng)
+        _generate_carts(rng, catalog, carts, now, batch_size, log)
+        _generate_orders(rng, catalog, orders, now, days, batch_size, log)
+
+    log('Rebuilding product counts and the search index...')
+    with transaction.atomic():
+        Category.rebuild_product_counts()
+        if search.is_available():
+            search.rebuild_index()
+    return category_objs
+
+
+def _generate_products(rng, category_objs, count, now, days, batch_size, log):
+    catalog = SampleCatalog()
+    category_weights = zipf_weights(len(category_objs), CATEGORY_SKEW)
+    adapt_datetime = connection.ops.adapt_datetimefield_value
+    for start in range(0, count, batch_size):
+        stop = min(start + batch_size, count)
+        product_rows, size_rows, color_rows, facet_rows = [], [], [], []
+        with transaction.atomic():
+            product_id, color_id = next_id(Product), next_id(Color)
+            picked_categories = rng.choices(category_objs, cum_weights=category_weights, k=stop - start)
+            for n, category in zip(range(start, stop), picked_categories):
+                # Oldest first, so ids follow creation dates
+                created_at = adapt_datetime(now - timedelta(days=days) * (1 - n / count))
+                gender, is_active = rng.choice('MFU'), rng.random() > 0.02
+                base_price = rng.randint(40, 200)
+                first_size, size_count = rng.randint(0, 4), rng.randint(3, 6)
+                sizes = [
+                    FacetSize(size, 0 if rng.random() < 0.1 else rng.randint(1, 50), True)
+                    for size in SIZES[first_size:first_size + size_count]
+                ]
+                colors = rng.sample(COLORS, rng.randint(1, 3))
+
+                min_price, max_price = size_price(base_price, 0), size_price(base_price, len(sizes) - 1)
+                product_rows.append((
+                    product_id, f'P{product_id}', f'{rng.choice(PRODUCT_WORDS)} {category.name.split()[0]} Shoe {n + 1}',
+                    'Sample product', category.pk, gender, is_active, '{}',
+                    min_price, max_price, sum(size.stock_quantity for size in sizes), 0, created_at, created_at,
+                ))
+                size_rows.extend(
+                    (product_id, size.size, size_price(base_price, offset), size.stock_quantity, True, created_at)
+                    for offset, size in enumerate(sizes)
+                )
+                color_rows.extend(
+                    (color_id + offset, product_id, name, hex_code) for offset, (name, hex_code) in enumerate(colors)
+                )
+                if is_active:
+                    facet_rows.extend(
+                        (product_id, category.pk, facet, value) for facet, value in facets.facet_values(
+                            FacetProduct(gender, min_price), sizes, [FacetColor(name) for name, hex_code in colors]
+                        )
+                    )
+                catalog.add(product_id, base_price, first_size, len(sizes), color_id, len(colors))
+                product_id += 1
+                color_id += len(colors)
+
+            insert_rows(Product, PRODUCT_FIELDS, product_rows)
+            insert_rows(ProductSize, SIZE_FIELDS, size_rows)
+            insert_rows(Color, COLOR_FIELDS, color_rows)
+            insert_rows(ProductFacet, FACET_FIELDS, facet_rows)
+        log(f'{stop} products')
+    return catalog
+
+
+def _lines(rng, catalog, count):
+    """Up to count distinct ((product_id, size, color_id, price), quantity) lines"""
+    lines = {}
+    for _ in range(count):
+        line = catalog.pick(rng)
+        lines[line[:3]] = line
+    return [(line, rng.choice((1, 1, 1, 2))) for line in lines.values()]
+
+
+def _generate_carts(rng, catalog, count, now, batch_size, log):
+    adapt_datetime = connection.ops.adapt_datetimefield_value
+    for start in range(0, count, batch_size):
+        stop = min(start + batch_size, count)
+        cart_rows, item_rows = [], []
+        with transaction.atomic():
+            cart_id = next_id(Cart)
+            for n in range(start, stop):
+                lines = _lines(rng, catalog, rng.randint(1, 4))
+                # Mostly recent, with a tail of abandoned carts for purge_abandoned_carts
+                updated_at = now - timedelta(days=rng.expovariate(1 / 10))
+                cart_rows.append((
+                    cart_id, f'sample-{uuid.UUID(int=rng.getrandbits(128)).hex}',
+                    sum(quantity for line, quantity in lines),
+                    sum(line[3] * quantity for line, quantity in lines),
+                    adapt_datetime(updated_at - timedelta(minutes=rng.randint(1, 120))),
+                    adapt_datetime(updated_at),
+                ))
+                item_rows.extend(
+                    (cart_id, product_id, size, color_id, quantity, price)
+                    for (product_id, size, color_id, price), quantity in lines
+                )
+                cart_id += 1
+            insert_rows(Cart, CART_FIELDS, cart_rows)
+            insert_rows(CartItem, CART_ITEM_FIELDS, item_rows)
+        log(f'{stop} carts')
+
+
+def _order_status(rng, age):
+    if age > timedelta(days=14):
+        return rng.choices(['delivered', 'cancelled', 'shipped'], weights=[85, 10, 5])[0]
+    return rng.choices(['pending', 'confirmed', 'shipped', 'delivered', 'cancelled'], weights=[30, 25, 25, 15, 5])[0]
+
+
+def _generate_orders(rng, catalog, count, now, days, batch_size, log):
+    adapt_datetime = connection.ops.adapt_datetimefield_value
+    for start in range(0, count, batch_size):
+        stop = min(start + batch_size, count)
+        order_rows, item_rows = [], []
+        with transaction.atomic():
+            order_id = next_id(Order)
+            for n in range(start, stop):
+                lines = _lines(rng, catalog, rng.choice((1, 1, 1, 2, 2, 3)))
+                # Spread over the period in id order, like real order history
+                created_at = now - timedelta(days=days) * (1 - (n + rng.random()) / count)
+                order_rows.append((
+                    order_id, uuid.UUID(int=rng.getrandbits(128), version=4).hex,
+                    f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                    f'06{rng.randrange(10 ** 8):08d}', rng.choice(CITIES),
+                    f'{rng.randint(1, 200)} Rue {rng.choice(LAST_NAMES)}',
+                    sum(line[3] * quantity for line, quantity in lines),
+                    _order_status(rng, now - created_at),
+                    adapt_datetime(created_at), adapt_datetime(created_at),
+                ))
+                item_rows.extend(
+                    (order_id, product_id, size, color_id, quantity, price, price * quantity)
+                    for (product_id, size, color_id, price), quantity in lines
+                )
+                order_id += 1
+            insert_rows(Order, ORDER_FIELDS, order_rows)
+            insert_rows(OrderItem, ORDER_ITEM_FIELDS, item_rows)
+        log(f'{stop} orders')
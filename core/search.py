@@ -0,0 +1,146 @@
+import re
+from contextlib import contextmanager
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+SEARCH_TABLE = 'core_product_search'
+# bm25() column weights: name, description, category, colors
+RANK = f'bm25({SEARCH_TABLE}, 10.0, 1.0, 3.0, 2.0)'
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Row of the search index for every product, colors flattened into one column
+INDEX_ROWS_SQL = """
+    SELECT p.id, p.name, p.description, c.name,
+           COALESCE((SELECT group_concat(name, ' ') FROM core_color WHERE product_id = p.id), '')
+    FROM core_product p JOIN core_category c ON c.id = p.category_id
+"""
+
+TABLE_SQL = f"""CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(
+    name, description, category, colors,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+)"""
+
+# The triggers keep the index in step with every write to the catalog tables.
+# They reference core_product, core_category and core_color, so SQLite cannot
+# rebuild those tables while they exist: any migration that alters one of them
+# (adding or changing a column rebuilds the table) must wrap its operations in
+# without_triggers() from core/migrations/_search_triggers.py. Migrations use
+# that frozen copy rather than this module; changing the index or its triggers
+# here needs a migration that carries its own copy of the new SQL.
+TRIGGER_SQL = [
+    f"""CREATE TRIGGER core_product_search_ai AFTER INSERT ON core_product BEGIN
+        INSERT INTO {SEARCH_TABLE} (rowid, name, description, category, colors)
+        VALUES (NEW.id, NEW.name, NEW.description,
+                (SELECT name FROM core_category WHERE id = NEW.category_id), '');
+    END""",
+    f"""CREATE TRIGGER core_product_search_au AFTER UPDATE OF name, description, category_id ON core_product BEGIN
+        UPDATE {SEARCH_TABLE}
+        SET name = NEW.name, description = NEW.description,
+            category = (SELECT name FROM core_category WHERE id = NEW.category_id)
+        WHERE rowid = NEW.id;
+    END""",
+    f"""CREATE TRIGGER core_product_search_ad AFTER DELETE ON core_product BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = OLD.id;
+    END""",
+    f"""CREATE TRIGGER core_category_search_au AFTER UPDATE OF name ON core_category BEGIN
+        UPDATE {SEARCH_TABLE} SET category = NEW.name
+        WHERE rowid IN (SELECT id FROM core_product WHERE category_id = NEW.id);
+    END""",
+    f"""CREATE TRIGGER core_color_search_ai AFTER INSERT ON core_color BEGIN
+        UPDATE {SEARCH_TABLE}
+        SET colors = COALESCE((SELECT group_concat(name, ' ') FROM core_color WHERE product_id = NEW.product_id), '')
+        WHERE rowid = NEW.product_id;
+    END""",
+    f"""CREATE TRIGGER core_color_search_au AFTER UPDATE OF name, product_id ON core_color BEGIN
+        UPDATE {SEARCH_TABLE}
+        SET colors = COALESCE((SELECT group_concat(name, ' ') FROM core_color WHERE product_id = {SEARCH_TABLE}.rowid), '')
+        WHERE rowid IN (OLD.product_id, NEW.product_id);
+    END""",
+    f"""CREATE TRIGGER core_color_search_ad AFTER DELETE ON core_color BEGIN
+        UPDATE {SEARCH_TABLE}
+        SET colors = COALESCE((SELECT group_concat(name, ' ') FROM core_color WHERE product_id = OLD.product_id), '')
+        WHERE rowid = OLD.product_id;
+    END""",
+]
+
+DROP_TRIGGER_SQL = [
+    'DROP TRIGGER IF EXISTS core_color_search_ad',
+    'DROP TRIGGER IF EXISTS core_color_search_au',
+    'DROP TRIGGER IF EXISTS core_color_search_ai',
+    'DROP TRIGGER IF EXISTS core_category_search_au',
+    'DROP TRIGGER IF EXISTS core_product_search_ad',
+    'DROP TRIGGER IF EXISTS core_product_search_au',
+    'DROP TRIGGER IF EXISTS core_product_search_ai',
+]
+
+DROP_SQL = [*DROP_TRIGGER_SQL, f'DROP TABLE IF EXISTS {SEARCH_TABLE}']
+
+
+@contextmanager
+def triggers_suspended():
+    """Drop the triggers for a bulk load of the catalog tables and create them again after.
+
+    Rows written meanwhile are not indexed: call rebuild_index() once at the end.
+    """
+    if not is_available():
+        yield
+        return
+    with connection.cursor() as cursor:
+        for statement in DROP_TRIGGER_SQL:
+            cursor.execute(statement)
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            for statement in TRIGGER_SQL:
+                cursor.execute(statement)
+
+
+def is_available(using=None):
+    """The index only exists on SQLite (FTS5); other backends fall back to icontains"""
+    return (using or connection).vendor == 'sqlite'
+
+
+def build_match_query(text):
+    """Turn free text into an FTS5 query: every word must match, as a prefix.
+
+    Words are quoted so user input can never be parsed as FTS5 syntax.
+    """
+    tokens = TOKEN_RE.findall(text or '')
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def matching_ids_sql(match):
+    """Unranked subquery of matching product ids, for filtering querysets"""
+    return RawSQL(f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s', [match])
+
+
+def search_product_ids(text, limit=20, offset=0):
+    """Ids of active products matching text, best match first"""
+    match = build_match_query(text)
+    if match is None:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""SELECT p.id FROM {SEARCH_TABLE} JOIN core_product p ON p.id = {SEARCH_TABLE}.rowid
+                WHERE {SEARCH_TABLE} MATCH %s AND p.is_active
+                ORDER BY {RANK} LIMIT %s OFFSET %s""",
+            [match, limit, offset]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def rebuild_index():
+    """Repopulate the whole index from the catalog tables; returns the number of rows"""
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, name, description, category, colors) {INDEX_ROWS_SQL}'
+        )
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+        cursor.execute(f'SELECT count(*) FROM {SEARCH_TABLE}')
+        return cursor.fetchone()[0]
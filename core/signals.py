@@ -0,0 +1,133 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import catalog, images
+from .facets import refresh_product_facets
+from .models import Category, Color, Product, ProductSize
+
+
+def deleted_with_parent(sender, origin):
+    """True when a post_delete comes from a cascade (e.g. sizes of a deleted product)"""
+    if origin is None:
+        return False
+    return getattr(origin, 'model', type(origin)) is not sender
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_listing(sender, instance, raw=False, **kwargs):
+    """Keep the category and active flag the product had before this save"""
+    instance._previous_listing = None
+    if raw or instance.pk is None:
+        return
+    instance._previous_listing = (
+        sender.objects.filter(pk=instance.pk)
+        .values_list('category_id', 'is_active')
+        .first()
+    )
+
+
+@receiver(post_save, sender=Product)
+def update_category_count_on_save(sender, instance, raw=False, **kwargs):
+    """Move the product between category counts when it is created, moved or (de)activated"""
+    if raw:
+        return
+    previous = getattr(instance, '_previous_listing', None)
+    current = (instance.category_id, instance.is_active)
+    if previous == current:
+        return
+    if previous and previous[1]:
+        Category.adjust_product_count(previous[0], -1)
+    if instance.is_active:
+        Category.adjust_product_count(instance.category_id, 1)
+
+
+@receiver(post_save, sender=Product)
+def assign_default_sku(sender, instance, created, raw=False, **kwargs):
+    """Give a product created without a sku P<id>, like the migration did, so exports can be imported back"""
+    if raw or not created or instance.sku:
+        return
+    sku = f'P{instance.pk}'
+    if not sender.objects.filter(sku=sku).exists():
+        sender.objects.filter(pk=instance.pk).update(sku=sku)
+        instance.sku = sku
+
+
+@receiver(post_delete, sender=Product)
+def update_category_count_on_delete(sender, instance, **kwargs):
+    if instance.is_active:
+        Category.adjust_product_count(instance.category_id, -1)
+
+
+@receiver(post_save, sender=ProductSize)
+@receiver(post_delete, sender=ProductSize)
+def refresh_product_price_range(sender, instance, raw=False, origin=None, **kwargs):
+    """Keep Product.min_price/max_price/total_stock in step with its sizes"""
+    if raw or deleted_with_parent(sender, origin):
+        return
+    Product.refresh_price_ranges([instance.product_id])
+
+
+@receiver(post_delete, sender=ProductSize)
+def touch_product_on_size_delete(sender, instance, origin=None, **kwargs):
+    """A deleted size leaves no newer timestamp behind, bump the product's for HTTP validators"""
+    if deleted_with_parent(sender, origin):
+        return
+    Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductSize)
+@receiver(post_delete, sender=ProductSize)
+@receiver(post_save, sender=Color)
+@receiver(post_delete, sender=Color)
+def schedule_catalog_snapshot(sender, raw=False, **kwargs):
+    if raw or not settings.CATALOG_SNAPSHOT_ON_CHANGE:
+        return
+    transaction.on_commit(catalog.schedule_snapshot)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductSize)
+@receiver(post_delete, sender=ProductSize)
+@receiver(post_save, sender=Color)
+@receiver(post_delete, sender=Color)
+def update_product_facets(sender, instance, raw=False, origin=None, **kwargs):
+    """Keep the facet index of the product in step (runs after the price range refresh)"""
+    if raw or deleted_with_parent(sender, origin):
+        return
+    product_id = instance.pk if sender is Product else instance.product_id
+    refresh_product_facets([product_id])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductSize)
+@receiver(post_delete, sender=ProductSize)
+@receiver(post_save, sender=Color)
+@receiver(post_delete, sender=Color)
+def bump_product_version(sender, instance, raw=False, origin=None, **kwargs):
+    """Invalidate the cached product card (see core.fragments)"""
+    if raw or deleted_with_parent(sender, origin):
+        return
+    Product.bump_versions([instance.pk if sender is Product else instance.product_id])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Product)
+def refresh_image_variants(sender, instance, raw=False, **kwargs):
+    """Queue resized variants of a new or replaced image once the save is committed"""
+    if raw:
+        return
+    manifest = instance.image_variants or {}
+    if manifest.get('source', '') == (instance.image.name or ''):
+        return
+    if not instance.image:
+        sender.objects.filter(pk=instance.pk).update(image_variants={})
+        transaction.on_commit(lambda: images.delete_variants(manifest))
+        return
+    transaction.on_commit(lambda: images.schedule_variants(instance))
@@ -1,3 +1,914 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import re
+import threading
+import time
+import unittest
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import async_views, catalog_io, fragments, order_export, search, views, writer
+from .admin import OrderAdmin
+from .checkout import OutOfStockError, place_order
+from .models import (
+    Cart, CartItem, Category, Color, InsufficientStock, Order, OrderItem, Product, ProductSize, StockReservation,
+)
+
+# A table read row by row (no index at all), or a sort done in a temporary B-tree
+FULL_SCAN_RE = re.compile(r'^SCAN \S+$')
+TEMP_SORT_RE = re.compile(r'USE TEMP B-TREE FOR (ORDER BY|GROUP BY|RIGHT PART OF ORDER BY|LAST TERM OF ORDER BY)')
+# Newest first by primary key: the table b-tree is walked backwards, no sort
+PK_ORDER_RE = re.compile(r'ORDER BY "(\w+)"\."id" DESC$')
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite specific')
+class QueryPlanTests(TestCase):
+    """Every query of the hot views must be answered from an index, without a sort"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Sneakers')
+        cls.products = []
+        for n in range(3):
+            product = Product.objects.create(name=f'Runner {n}', description='Light', category=cls.category)
+            ProductSize.objects.create(product=product, size='40', price='100', stock_quantity=5)
+            ProductSize.objects.create(product=product, size='41', price='110', stock_quantity=5)
+            Color.objects.create(product=product, name='Red', hex_code='#ff0000')
+            cls.products.append(product)
+        cls.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def assertQueriesUseIndexes(self, make_requests, paged_tables=()):
+        """paged_tables may be walked in primary key order: their lists read one LIMITed page"""
+        with CaptureQueriesContext(connection) as context:
+            make_requests()
+        checked = 0
+        for query in context.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                plan = [row[3] for row in cursor.fetchall()]
+            bad = [step for step in plan if FULL_SCAN_RE.match(step) or TEMP_SORT_RE.search(step)]
+            ordered_by_pk = PK_ORDER_RE.search(sql)
+            if ordered_by_pk and ordered_by_pk.group(1) in paged_tables:
+                bad = [step for step in bad if step != f'SCAN {ordered_by_pk.group(1)}']
+            self.assertEqual(bad, [], f'{sql}\n' + '\n'.join(plan))
+            checked += 1
+        self.assertGreater(checked, 0)
+
+    def post_json(self, url, data):
+        return self.client.post(url, json.dumps(data), content_type='application/json')
+
+    def test_home(self):
+        self.assertQueriesUseIndexes(lambda: self.client.get('/'))
+
+    def test_category_page(self):
+        url = f'/category/{self.category.id}/'
+        self.assertQueriesUseIndexes(lambda: self.client.get(url))
+
+    def test_filtered_category_page(self):
+        url = f'/category/{self.category.id}/'
+        self.assertQueriesUseIndexes(lambda: self.client.get(url, {'size': '40', 'color': 'red'}))
+
+    def test_category_products_api(self):
+        url = f'/api/category/{self.category.id}/products/'
+        first = self.client.get(url, {'facets': 1}).json()
+        self.assertQueriesUseIndexes(lambda: self.client.get(url, {'after': first['next_cursor'] or ''}))
+
+    def test_product_sizes(self):
+        ids = ','.join(str(product.id) for product in self.products)
+        self.assertQueriesUseIndexes(lambda: (
+            self.client.get('/api/product-sizes/', {'product_id': self.products[0].id}),
+            self.client.get('/api/product-sizes/', {'product_ids': ids}),
+        ))
+
+    def test_available_sizes(self):
+        self.assertQueriesUseIndexes(lambda: list(self.products[0].available_sizes))
+
+    def test_cart_and_checkout(self):
+        product = self.products[0]
+        color = product.colors.get()
+
+        def shop():
+            self.post_json('/api/cart/add/', {'product_id': product.id, 'size': '40', 'color_id': color.id})
+            self.client.get('/cart/')
+            self.client.get('/checkout/')
+            self.post_json('/api/create-order/', {
+                'customer_name': 'Sara', 'customer_phone': '0600000000',
+                'customer_city': 'Rabat', 'customer_address': '1 Rue A',
+            })
+
+        self.assertQueriesUseIndexes(shop)
+        self.assertTrue(Order.objects.exists())
+
+    def test_admin_order_list(self):
+        self.client.force_login(self.admin)
+        self.assertQueriesUseIndexes(lambda: (
+            self.client.get('/admin/core/order/'),
+            self.client.get('/admin/core/order/', {'status__exact': 'pending'}),
+        ))
+
+    def test_admin_changelists(self):
+        cart = Cart.objects.create(session_id='admin-test')
+        cart.add_item(self.products[0], '40', self.products[0].colors.get())
+        self.client.force_login(self.admin)
+        self.assertQueriesUseIndexes(lambda: [
+            self.client.get(f'/admin/core/{model}/')
+            for model in ['product', 'color', 'productsize', 'cart', 'cartitem']
+        ], paged_tables=['core_color', 'core_cartitem'])
+
+
+class CategoryListingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Sneakers')
+        cls.active = []
+        for n, is_active in enumerate([True, True, False]):
+            product = Product.objects.create(
+                name=f'Runner {n}', description='Light', category=cls.category, is_active=is_active
+            )
+            ProductSize.objects.create(product=product, size='40', price='100', stock_quantity=5)
+            if is_active:
+                cls.active.append(product.id)
+
+    def test_inactive_products_are_neither_listed_nor_counted(self):
+        url = f'/api/category/{self.category.id}/products/'
+        for selection in [{}, {'size': '40'}]:
+            data = self.client.get(url, {'facets': 1, **selection}).json()
+            self.assertCountEqual([product['id'] for product in data['products']], self.active)
+            sizes = next(facet for facet in data['facets'] if facet['name'] == 'size')
+            self.assertEqual(sizes['options'][0]['count'], len(self.active))
+
+
+class CategoryCountTests(TestCase):
+    def setUp(self):
+        self.sneakers = Category.objects.create(name='Sneakers')
+        self.boots = Category.objects.create(name='Boots')
+
+    def counts(self):
+        return dict(Category.objects.values_list('name', 'product_count'))
+
+    def assertCountsMatchRebuild(self, expected):
+        stored = self.counts()
+        Category.rebuild_product_counts()
+        self.assertEqual(stored, self.counts())
+        self.assertEqual(stored, expected)
+
+    def test_signals_keep_product_counts_in_step_with_a_rebuild(self):
+        runner = Product.objects.create(name='Runner', description='Light', category=self.sneakers)
+        walker = Product.objects.create(name='Walker', description='Light', category=self.sneakers)
+        hiker = Product.objects.create(name='Hiker', description='Warm', category=self.boots, is_active=False)
+        self.assertCountsMatchRebuild({'Sneakers': 2, 'Boots': 0})
+
+        walker.is_active = False
+        walker.save()
+        self.assertCountsMatchRebuild({'Sneakers': 1, 'Boots': 0})
+        walker.save()
+        self.assertCountsMatchRebuild({'Sneakers': 1, 'Boots': 0})
+
+        runner.category = self.boots
+        runner.save()
+        self.assertCountsMatchRebuild({'Sneakers': 0, 'Boots': 1})
+        walker.category = self.boots
+        walker.save()
+        self.assertCountsMatchRebuild({'Sneakers': 0, 'Boots': 1})
+        hiker.category, hiker.is_active = self.sneakers, True
+        hiker.save()
+        self.assertCountsMatchRebuild({'Sneakers': 1, 'Boots': 1})
+
+        runner.delete()
+        walker.delete()
+        self.assertCountsMatchRebuild({'Sneakers': 1, 'Boots': 0})
+
+
+class PriceRangeTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Sneakers')
+        self.product = Product.objects.create(name='Runner', description='Light', category=category)
+
+    def assertRange(self, min_price, max_price, total_stock):
+        self.product.refresh_from_db()
+        self.assertEqual(
+            (self.product.min_price, self.product.max_price, self.product.total_stock),
+            (Decimal(min_price), Decimal(max_price), total_stock)
+        )
+        # The lowest price of any size, available or not, 0 without sizes, as before it was stored
+        sizes = self.product.product_sizes.all()
+        self.assertEqual(self.product.base_price, min(size.price for size in sizes) if sizes else 0)
+
+    def test_ranges_follow_the_sizes(self):
+        self.assertRange(0, 0, 0)
+        small = ProductSize.objects.create(product=self.product, size='40', price='120', stock_quantity=3)
+        large = ProductSize.objects.create(product=self.product, size='41', price='90.50', stock_quantity=4)
+        self.assertRange('90.50', 120, 7)
+
+        large.price, large.stock_quantity = Decimal('130'), 1
+        large.save()
+        self.assertRange(120, 130, 4)
+        small.is_available = False
+        small.save()
+        self.assertRange(120, 130, 4)
+
+        large.delete()
+        self.assertRange(120, 120, 3)
+        small.delete()
+        self.assertRange(0, 0, 0)
+
+    def test_refresh_price_ranges_repairs_stored_values(self):
+        ProductSize.objects.create(product=self.product, size='40', price='120', stock_quantity=3)
+        ProductSize.objects.create(product=self.product, size='41', price='90', stock_quantity=4)
+        Product.objects.filter(pk=self.product.pk).update(min_price=1, max_price=2, total_stock=99)
+        self.assertEqual(Product.refresh_price_ranges([self.product.pk]), 1)
+        self.assertRange(90, 120, 7)
+
+
+@unittest.skipUnless(search.is_available(), 'The search index is SQLite FTS5')
+class SearchTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Sneakers')
+        self.runner = Product.objects.create(name='Trail Runner', description='Light', category=self.category)
+        self.walker = Product.objects.create(name='City Walker', description='Soft', category=self.category)
+        Color.objects.create(product=self.runner, name='Crimson', hex_code='#dc143c')
+
+    def found(self, query):
+        response = self.client.get('/api/search/', {'q': query})
+        self.assertEqual(response.status_code, 200, query)
+        data = response.json()
+        self.assertTrue(data['success'], query)
+        return [result['name'] for result in data['results']]
+
+    def test_triggers_keep_the_index_in_step(self):
+        self.assertEqual(self.found('run'), ['Trail Runner'])
+        self.assertEqual(self.found('crim'), ['Trail Runner'])
+        self.assertCountEqual(self.found('sneak'), ['Trail Runner', 'City Walker'])
+
+        self.runner.name = 'Trail Sprinter'
+        self.runner.save()
+        self.category.name = 'Trainers'
+        self.category.save()
+        self.assertEqual(self.found('runner'), [])
+        self.assertEqual(self.found('sprint'), ['Trail Sprinter'])
+        self.assertEqual(self.found('sneak'), [])
+        self.assertCountEqual(self.found('train'), ['Trail Sprinter', 'City Walker'])
+
+        self.runner.colors.update(name='Navy')
+        self.assertEqual(self.found('crimson'), [])
+        self.runner.colors.all().delete()
+        self.assertEqual(self.found('navy'), [])
+
+        self.walker.is_active = False
+        self.walker.save()
+        self.assertEqual(self.found('walker'), [])
+        self.walker.delete()
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {search.SEARCH_TABLE}')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_query_syntax_is_not_interpreted(self):
+        for query in ['"trail*', 'trail OR city', 'NEAR(trail', 'name:trail', '-', '*', '^trail', "trail'", 'AND']:
+            self.found(query)
+        self.assertEqual(self.found('name:trail'), [])
+        self.assertEqual(self.found('"trail runner"'), ['Trail Runner'])
+
+    def test_rebuild_index(self):
+        with search.triggers_suspended():
+            hiker = Product.objects.create(name='Hill Hiker', description='Warm', category=self.category)
+            Product.objects.filter(pk=self.runner.pk).update(name='Road Racer')
+        self.assertEqual(self.found('hiker'), [])
+        self.assertEqual(self.found('racer'), [])
+
+        self.assertEqual(search.rebuild_index(), 3)
+        self.assertEqual(self.found('hiker'), [hiker.name])
+        self.assertEqual(self.found('racer crim'), ['Road Racer'])
+        self.assertEqual(self.found('runner'), [])
+
+
+class ProductCardCacheTests(TestCase):
+    def setUp(self):
+        fragments.card_cache().clear()
+        category = Category.objects.create(name='Sneakers')
+        self.product = Product.objects.create(name='Runner', description='Light', category=category)
+        self.size = ProductSize.objects.create(product=self.product, size='40', price='100', stock_quantity=5)
+
+    def card(self):
+        product = Product.objects.get(pk=self.product.pk)
+        return fragments._card_key(product, 'data'), fragments.cached_per_product(
+            [product], 'data', lambda product: [str(size.price) for size in product.product_sizes.all()]
+        )[0]
+
+    def test_catalog_edits_change_the_card_key(self):
+        key, card = self.card()
+        self.assertEqual(card, ['100.00'])
+        self.assertEqual(self.card(), (key, card))
+
+        self.size.price = Decimal('90')
+        self.size.save()
+        size_key, card = self.card()
+        self.assertNotEqual(size_key, key)
+        self.assertEqual(card, ['90.00'])
+
+        keys = {key, size_key}
+        for edit in [
+            lambda: Color.objects.create(product=self.product, name='Red', hex_code='#ff0000'),
+            lambda: self.product.colors.get().delete(),
+            lambda: ProductSize.objects.create(product=self.product, size='41', price='95', stock_quantity=1),
+            lambda: self.size.delete(),
+            lambda: Product.objects.get(pk=self.product.pk).save(),
+        ]:
+            edit()
+            key, card = self.card()
+            self.assertNotIn(key, keys)
+            keys.add(key)
+        self.assertEqual(card, ['95.00'])
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Sneakers')
+        self.product = Product.objects.create(name='Runner', description='Light', category=category)
+        self.size = ProductSize.objects.create(product=self.product, size='40', price='100', stock_quantity=3)
+        self.cart = Cart.objects.create(session_id='a')
+        self.other = Cart.objects.create(session_id='b')
+
+    def held(self, cart):
+        return list(StockReservation.objects.filter(cart=cart).values_list('quantity', flat=True))
+
+    def test_holds_follow_the_cart_and_block_other_carts(self):
+        item = self.cart.add_item(self.product, '40', quantity=2)
+        self.assertEqual(self.held(self.cart), [2])
+        with self.assertRaisesMessage(InsufficientStock, 'Only 1 left in size 40'):
+            self.other.add_item(self.product, '40', quantity=2)
+        self.assertFalse(self.other.items.exists())
+        self.other.add_item(self.product, '40', quantity=1)
+
+        self.cart.remove_item(item)
+        self.assertEqual(self.held(self.cart), [])
+        self.other.clear()
+        self.assertEqual(self.held(self.other), [])
+
+    def test_expired_holds_are_ignored(self):
+        self.other.add_item(self.product, '40', quantity=3)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.cart.add_item(self.product, '40', quantity=3)
+        self.assertEqual(self.held(self.cart), [3])
+
+    def test_a_cart_can_always_be_reduced(self):
+        item = self.cart.add_item(self.product, '40', quantity=2)
+        self.other.add_item(self.product, '40', quantity=1)
+        ProductSize.objects.filter(pk=self.size.pk).update(stock_quantity=1, is_available=False)
+        self.cart.set_item_quantity(item, 1)
+        self.assertEqual(self.held(self.cart), [1])
+        with self.assertRaises(InsufficientStock):
+            self.cart.set_item_quantity(item, 2)
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Sneakers')
+        self.product = Product.objects.create(name='Runner', description='Light', category=category)
+        ProductSize.objects.create(product=self.product, size='40', price='100', stock_quantity=3)
+        ProductSize.objects.create(product=self.product, size='41', price='100', stock_quantity=5)
+
+    def cart(self, session_id, quantities):
+        """A cart whose lines were added without taking stock holds, like two shoppers racing"""
+        cart = Cart.objects.create(session_id=session_id)
+        for size, quantity in quantities.items():
+            CartItem.objects.create(cart=cart, product=self.product, size=size, quantity=quantity, price_per_unit='100')
+        return cart
+
+    def place(self, cart):
+        return place_order(cart, customer_name='Sara', phone_number='0600000000', city='Rabat', address='1 Rue A')
+
+    def stock(self):
+        return dict(ProductSize.objects.values_list('size', 'stock_quantity'))
+
+    def test_second_checkout_of_the_last_pairs_is_refused(self):
+        first, second = self.cart('a', {'40': 2}), self.cart('b', {'40': 2})
+        self.place(first)
+        with self.assertRaises(OutOfStockError) as raised:
+            self.place(second)
+        self.assertEqual([(line['size'], line['available']) for line in raised.exception.lines], [('40', 1)])
+        self.assertEqual(self.stock(), {'40': 1, '41': 5})
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(second.items.count(), 1)
+
+    def test_a_short_line_leaves_the_other_lines_untouched(self):
+        with self.assertRaises(OutOfStockError):
+            self.place(self.cart('a', {'40': 4, '41': 1}))
+        self.assertEqual(self.stock(), {'40': 3, '41': 5})
+        self.assertFalse(Order.objects.exists())
+
+    def test_stock_held_by_other_carts_is_not_sold(self):
+        Cart.objects.create(session_id='holder').add_item(self.product, '40', quantity=2)
+        with self.assertRaises(OutOfStockError) as raised:
+            self.place(self.cart('a', {'40': 2}))
+        self.assertEqual(raised.exception.lines[0]['available'], 1)
+        self.place(self.cart('b', {'40': 1}))
+        self.assertEqual(self.stock()['40'], 2)
+
+
+class CartTotalsTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Sneakers')
+        self.product = Product.objects.create(name='Runner', description='Light', category=category)
+        for size in ['40', '41']:
+            ProductSize.objects.create(product=self.product, size=size, price='19.99', stock_quantity=10)
+        self.cart = Cart.objects.create(session_id='a')
+
+    def assertTotalsConsistent(self, cart):
+        stored = Cart.with_computed_totals().values_list(
+            'total_items', 'total_amount', 'computed_items', 'computed_amount'
+        ).get(pk=cart.pk)
+        self.assertEqual(stored[:2], (stored[2], round(stored[3], 2)))
+        self.assertEqual((cart.total_items, cart.total_amount), stored[:2])
+
+    def test_delta_updates_match_the_items(self):
+        first = self.cart.add_item(self.product, '40', quantity=2, price_per_unit=Decimal('19.99'))
+        self.assertTotalsConsistent(self.cart)
+        self.cart.add_item(self.product, '40', price_per_unit=Decimal('19.99'))
+        second = self.cart.add_item(self.product, '41', quantity=3, price_per_unit=Decimal('24.50'))
+        self.assertTotalsConsistent(self.cart)
+        self.cart.set_item_quantity(first, 1, price_per_unit=Decimal('17.25'))
+        self.assertTotalsConsistent(self.cart)
+        self.cart.remove_item(second)
+        self.assertTotalsConsistent(self.cart)
+        self.assertEqual((self.cart.total_items, self.cart.total_amount), (1, Decimal('17.25')))
+        self.cart.clear()
+        self.assertTotalsConsistent(self.cart)
+
+    def test_repair_cart_totals_finds_and_fixes_drift(self):
+        self.cart.add_item(self.product, '40', quantity=3, price_per_unit=Decimal('19.99'))
+        untouched = Cart.objects.create(session_id='b')
+        untouched.add_item(self.product, '41', price_per_unit=Decimal('19.99'))
+        Cart.objects.filter(pk=self.cart.pk).update(total_items=7, total_amount='1.00')
+
+        with self.assertRaisesMessage(CommandError, '1 carts have inconsistent totals'):
+            call_command('repair_cart_totals', '--check', stdout=io.StringIO())
+        out = io.StringIO()
+        call_command('repair_cart_totals', stdout=out)
+        self.assertIn(f'Cart {self.cart.pk}: stored 7 items / 1.00', out.getvalue())
+        self.assertIn('Repaired totals of 1 carts', out.getvalue())
+
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.total_items, self.cart.total_amount), (3, Decimal('59.97')))
+        out = io.StringIO()
+        call_command('repair_cart_totals', '--check', stdout=out)
+        self.assertIn('All cart totals are consistent', out.getvalue())
+
+
+class PurgeAbandonedCartsTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Sneakers')
+        self.product = Product.objects.create(name='Runner', description='Light', category=category)
+        ProductSize.objects.create(product=self.product, size='40', price='100', stock_quantity=50)
+        now = timezone.now()
+        self.idle = []
+        for n in range(5):
+            cart = Cart.objects.create(session_id=f'idle-{n}')
+            cart.add_item(self.product, '40')
+            self.idle.append(cart.pk)
+        self.recent = Cart.objects.create(session_id='recent')
+        self.recent.add_item(self.product, '40')
+        self.held = Cart.objects.create(session_id='held')
+        self.held.add_item(self.product, '40')
+        # Old carts, all holds expired except the one of self.held
+        Cart.objects.exclude(pk=self.recent.pk).update(updated_at=now - timedelta(days=31))
+        StockReservation.objects.exclude(cart=self.held).update(expires_at=now - timedelta(minutes=1))
+        Session.objects.create(session_key='expired', session_data='', expire_date=now - timedelta(days=1))
+        Session.objects.create(session_key='live', session_data='', expire_date=now + timedelta(days=1))
+
+    def purge(self, *args):
+        out = io.StringIO()
+        call_command('purge_abandoned_carts', *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run_only_counts(self):
+        self.assertEqual(self.purge('--dry-run'), 'Would delete 1 sessions\nWould delete 5 carts\n')
+        self.assertEqual(Cart.objects.count(), 7)
+        self.assertEqual(Session.objects.count(), 2)
+
+    def test_idle_carts_are_deleted_in_batches(self):
+        out = self.purge('--batch-size', '2')
+        self.assertIn('Deleted 1 sessions in 1 batches', out)
+        self.assertIn('Deleted 5 carts in 3 batches', out)
+        self.assertCountEqual(Cart.objects.values_list('pk', flat=True), [self.recent.pk, self.held.pk])
+        self.assertFalse(CartItem.objects.filter(cart__in=self.idle).exists())
+        self.assertFalse(StockReservation.objects.filter(cart__in=self.idle).exists())
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['live'])
+
+    def test_days_option(self):
+        self.assertIn('Deleted 0 carts', self.purge('--days', '60'))
+        self.assertEqual(Cart.objects.count(), 7)
+        # Even a cart idle for no time at all is kept while it holds stock
+        self.assertIn('Deleted 6 carts', self.purge('--days', '0'))
+        self.assertEqual(list(Cart.objects.values_list('pk', flat=True)), [self.held.pk])
+
+
+class CartEndpointTests(TestCase):
+    """The sync views and their async twins must answer the same requests the same way"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Sneakers')
+        cls.product = Product.objects.create(name='Runner', description='Light', category=category)
+        ProductSize.objects.create(product=cls.product, size='40', price='100', stock_quantity=5)
+
+    def post(self, module, view, session, data):
+        request = RequestFactory().post('/', json.dumps(data), content_type='application/json')
+        request.session = session
+        view = getattr(module, view)
+        return async_to_sync(view)(request) if asyncio.iscoroutinefunction(view) else view(request)
+
+    def conversation(self, module):
+        session = SessionStore()
+
+        def post(view, data):
+            return json.loads(self.post(module, view, session, data).content)
+
+        answers = [
+            post('add_to_cart', {'product_id': self.product.id}),
+            post('add_to_cart', {'product_id': self.product.id, 'size': '40', 'quantity': 0}),
+            post('add_to_cart', {'product_id': self.product.id, 'size': '40', 'quantity': 2}),
+        ]
+        item = CartItem.objects.get(cart__session_id=session.session_key)
+        answers += [
+            post('update_cart_item', {'item_id': item.id, 'quantity': 0}),
+            post('update_cart_item', {'item_id': item.id, 'quantity': 3}),
+            post('remove_from_cart', {'item_id': item.id}),
+        ]
+        return answers
+
+    def test_sync_and_async_views_agree(self):
+        answers = self.conversation(views)
+        self.assertEqual(answers, [
+            {'success': False, 'error': 'Product ID and size are required'},
+            {'success': False, 'error': 'Quantity must be at least 1'},
+            {'success': True, 'cart_total': '200.00', 'cart_count': 2},
+            {'success': False, 'error': 'Quantity must be at least 1'},
+            {'success': True, 'item_total': '300.00', 'cart_total': '300.00', 'cart_count': 3},
+            {'success': True, 'cart_total': '0.00', 'cart_count': 0},
+        ])
+        self.assertEqual(self.conversation(async_views), answers)
+
+    def test_items_of_other_carts_are_not_found(self):
+        for module in (views, async_views):
+            owner, intruder = SessionStore(), SessionStore()
+            add = {'product_id': self.product.id, 'size': '40'}
+            self.post(module, 'add_to_cart', owner, {**add, 'quantity': 2})
+            self.post(module, 'add_to_cart', intruder, add)
+            cart = Cart.objects.get(session_id=owner.session_key)
+            item = cart.items.get()
+
+            for session in (intruder, SessionStore()):
+                for view, data in [('update_cart_item', {'quantity': 4}), ('remove_from_cart', {})]:
+                    response = self.post(module, view, session, {'item_id': item.id, **data})
+                    self.assertEqual(response.status_code, 404, (module.__name__, view))
+                    self.assertEqual(json.loads(response.content)['error'], 'Cart item not found')
+
+            cart.refresh_from_db()
+            self.assertEqual((cart.total_items, cart.total_amount), (2, 200))
+            self.assertEqual(list(cart.items.values_list('quantity', flat=True)), [2])
+            self.assertEqual(list(cart.reservations.values_list('quantity', flat=True)), [2])
+            Cart.objects.all().delete()
+
+    def test_rejected_adds_create_no_session_or_cart(self):
+        color = Color.objects.create(product=self.product, name='Red', hex_code='#ff0000')
+        other = Product.objects.create(name='Walker', description='Light', category=self.product.category)
+        add = {'product_id': self.product.id, 'size': '40'}
+        rejected = [
+            {**add, 'size': '45'},
+            {**add, 'quantity': 6},
+            {**add, 'color_id': Color.objects.create(product=other, name='Red', hex_code='#ff0000').id},
+            {**add, 'product_id': other.id + 1},
+        ]
+        for module in (views, async_views):
+            session = SessionStore()
+            for data in rejected:
+                self.assertFalse(json.loads(self.post(module, 'add_to_cart', session, data).content)['success'])
+            # Passing the early check and failing in the write job rolls back the session with the cart
+            with mock.patch.object(StockReservation, 'check_available'):
+                self.assertFalse(json.loads(self.post(module, 'add_to_cart', session, rejected[1]).content)['success'])
+            self.assertIsNone(session.session_key, module.__name__)
+            self.assertFalse(Session.objects.exists())
+            self.assertFalse(Cart.objects.exists())
+
+            response = self.post(module, 'add_to_cart', session, {**add, 'color_id': color.id})
+            self.assertTrue(json.loads(response.content)['success'])
+            self.assertTrue(Session.objects.filter(session_key=session.session_key).exists())
+            Cart.objects.all().delete()
+            Session.objects.all().delete()
+
+
+class PageViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Sneakers')
+        product = Product.objects.create(name='Runner', description='Light', category=cls.category)
+        ProductSize.objects.create(product=product, size='40', price='100', stock_quantity=5)
+
+    def test_browsing_writes_nothing(self):
+        for url in ['/', f'/category/{self.category.id}/', '/cart/', '/checkout/']:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+            self.assertLess(response.status_code, 400, url)
+            inserts = [query['sql'] for query in context.captured_queries if query['sql'].startswith('INSERT')]
+            self.assertEqual(inserts, [], url)
+            self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies, url)
+        self.assertFalse(Session.objects.exists())
+        self.assertFalse(Cart.objects.exists())
+
+
+class CartBatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Sneakers')
+        cls.product = Product.objects.create(name='Runner', description='Light', category=category)
+        ProductSize.objects.create(product=cls.product, size='40', price='100', stock_quantity=3)
+
+    def batch(self, *operations):
+        return self.client.post(
+            '/api/cart/batch/', json.dumps({'operations': operations}), content_type='application/json'
+        ).json()
+
+    def test_a_failing_operation_is_rolled_back_alone(self):
+        add = {'op': 'add', 'product_id': self.product.id, 'size': '40', 'quantity': 2}
+        item_id = self.batch(add)['results'][0]['item_id']
+
+        # The second add writes the line, then finds too little stock: its savepoint undoes the write
+        data = self.batch(add, {'op': 'update', 'item_id': item_id, 'quantity': 1}, {'op': 'refund'})
+        self.assertFalse(data['success'])
+        self.assertEqual(data['results'], [
+            {'success': False, 'error': 'Only 3 left in size 40'},
+            {'success': True, 'item_id': item_id, 'quantity': 1, 'item_total': '100.00'},
+            {'success': False, 'error': "Unknown operation: 'refund'"},
+        ])
+        self.assertEqual((data['cart_count'], data['cart_total']), (1, '100.00'))
+        cart = Cart.objects.get()
+        self.assertEqual((cart.total_items, cart.total_amount), (1, 100))
+        self.assertEqual(list(cart.items.values_list('quantity', flat=True)), [1])
+        self.assertEqual(list(cart.reservations.values_list('quantity', flat=True)), [1])
+
+    def test_writes_of_an_operation_failing_after_them_are_undone(self):
+        add_item = Cart.add_item
+
+        def add_then_fail(cart, *args, **kwargs):
+            add_item(cart, *args, **kwargs)
+            raise ValueError('Price changed')
+
+        add = {'op': 'add', 'product_id': self.product.id, 'size': '40', 'quantity': 1}
+        with mock.patch.object(Cart, 'add_item', add_then_fail):
+            data = self.batch(add)
+        self.assertEqual(data['results'], [{'success': False, 'error': 'Price changed'}])
+        self.assertFalse(CartItem.objects.exists())
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertTrue(self.batch(add)['success'])
+
+
+class ProductSizesValidatorTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Sneakers')
+        self.product = Product.objects.create(name='Runner', description='Light', category=category)
+        self.size = ProductSize.objects.create(product=self.product, size='40', price='100', stock_quantity=3)
+        ProductSize.objects.create(product=self.product, size='41', price='100', stock_quantity=3)
+
+    def get(self, **headers):
+        return self.client.get('/api/product-sizes/', {'product_id': self.product.id}, headers=headers)
+
+    def test_unchanged_sizes_are_not_modified(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(self.get(if_none_match=etag).status_code, 304)
+        self.assertEqual(self.get(if_modified_since=response['Last-Modified']).status_code, 304)
+
+        bulk = {'product_ids': str(self.product.id)}
+        etag = self.client.get('/api/product-sizes/', bulk)['ETag']
+        response = self.client.get('/api/product-sizes/', bulk, headers={'if_none_match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_size_changes_and_deletions_change_the_etag(self):
+        etag = self.get()['ETag']
+        self.size.stock_quantity = 2
+        self.size.save()
+        response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['sizes'][0]['stock_quantity'], 2)
+
+        etag = response['ETag']
+        self.size.delete()
+        response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([size['size'] for size in response.json()['sizes']], ['41'])
+
+
+class CatalogImportExportTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Sneakers')
+        Category.objects.create(name='Boots')
+        product = Product.objects.create(sku='RUN-1', name='Runner', description='Light, "fast"', category=category)
+        ProductSize.objects.create(product=product, size='40', price='100.00', stock_quantity=3)
+        ProductSize.objects.create(product=product, size='41', price='110.00', stock_quantity=0, is_available=False)
+        for name, hex_code in [('Black|White', '#000000'), ('Navy: deep', '#000080'), ('Back\\slash', '#ffffff')]:
+            Color.objects.create(product=product, name=name, hex_code=hex_code)
+        Product.objects.create(sku='BOOT-1', name='Boot', description='Warm', category_id=category.pk + 1)
+
+    def export(self, fmt):
+        return ''.join(catalog_io.export_lines(Product.objects.all(), fmt))
+
+    def test_export_imports_back_unchanged(self):
+        for fmt in catalog_io.FORMATS:
+            with self.subTest(fmt=fmt):
+                exported = self.export(fmt)
+                Product.objects.all().delete()
+                result = catalog_io.import_file(io.StringIO(exported), fmt)
+                self.assertEqual(result.errors, [])
+                self.assertEqual((result.products_created, result.sizes_created, result.colors_created), (2, 2, 3))
+                self.assertEqual(self.export(fmt), exported)
+                self.assertCountEqual(
+                    Color.objects.values_list('name', flat=True), ['Black|White', 'Navy: deep', 'Back\\slash']
+                )
+
+    def test_bad_rows_are_reported_and_the_others_imported(self):
+        lines = self.export('csv').splitlines(keepends=True)
+        lines += [
+            ',Nameless,,Sneakers,U,1,,,,,,\r\n',
+            'RUN-2,Trail,,Sandals,U,1,,,,,,\r\n',
+            'RUN-1,,,,,,,42,cheap,1,1,\r\n',
+            'RUN-1,,,,,,,,,,,Red\r\n',
+            'RUN-3,Trail,Grippy,Boots,U,1,,42,120,2,1,Red:#ff0000\r\n',
+        ]
+        result = catalog_io.import_file(io.StringIO(''.join(lines)), 'csv')
+        first = len(lines) - 4
+        self.assertEqual([(line, sku) for line, sku, message in result.errors], [
+            (first, ''), (first + 1, 'RUN-2'), (first + 2, 'RUN-1'), (first + 3, 'RUN-1'),
+        ])
+        self.assertIn('colors: "Red" is not Name:#hex', result.errors[-1][2])
+        self.assertEqual(result.products_created, 1)
+        trail = Product.objects.get(sku='RUN-3')
+        self.assertEqual((trail.category.name, trail.min_price), ('Boots', 120))
+        self.assertFalse(ProductSize.objects.filter(size='42', product__sku='RUN-1').exists())
+
+
+class OrderExportTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Sneakers')
+        product = Product.objects.create(sku='RUN-1', name='Runner', description='Light', category=category)
+        color = Color.objects.create(product=product, name='Red', hex_code='#ff0000')
+        order = Order.objects.create(
+            customer_name='Sara, "S."', phone_number='0600000000', city='Rabat', address='1 Rue A\nApt 2',
+            total_amount='300.00'
+        )
+        for size, quantity in [('40', 1), ('41', 2)]:
+            OrderItem.objects.create(
+                order=order, product=product, size=size, color=color, quantity=quantity,
+                price_per_unit='100.00', total_price=quantity * 100
+            )
+        Order.objects.create(customer_name='Omar', phone_number='0611111111', city='Fes', address='2 Rue B',
+                             total_amount='0.00')
+
+    def export(self, fmt):
+        return ''.join(order_export.export_lines(Order.objects.all(), fmt))
+
+    def test_csv_and_jsonl_hold_the_same_values(self):
+        csv_rows = list(csv.DictReader(io.StringIO(self.export('csv'))))
+        jsonl_rows = [json.loads(line) for line in self.export('jsonl').splitlines()]
+        self.assertEqual([row.get('size') for row in jsonl_rows], ['40', '41', None])
+        self.assertEqual(list(csv_rows[0]), order_export.COLUMNS)
+        self.assertEqual(csv_rows, [
+            {column: '' if row.get(column) is None else str(row[column]) for column in order_export.COLUMNS}
+            for row in jsonl_rows
+        ])
+        self.assertRegex(csv_rows[0]['created_at'], r'^\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d(\.\d{3})?Z$')
+        self.assertEqual(csv_rows[0]['customer_name'], 'Sara, "S."')
+        self.assertEqual(csv_rows[1]['total_price'], '200.00')
+
+
+@mock.patch('core.pagination.ESTIMATED_COUNT_THRESHOLD', 0)
+@mock.patch.object(OrderAdmin, 'list_per_page', 2)
+class EstimatedCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        orders = [
+            Order.objects.create(customer_name=f'Customer {n}', phone_number='0600000000', city='Rabat',
+                                 address='1 Rue A', total_amount='100.00')
+            for n in range(7)
+        ]
+        # Deleted orders leave the highest id, the estimate, 2 above the row count
+        orders[1].delete()
+        orders[2].delete()
+        cls.estimate = orders[-1].pk
+        cls.admin = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def changelist(self, page):
+        self.client.force_login(self.admin)
+        return self.client.get('/admin/core/order/', {'p': page}).context['cl']
+
+    def test_full_pages_keep_the_estimate(self):
+        cl = self.changelist(1)
+        self.assertEqual((cl.result_count, len(cl.result_list)), (self.estimate, 2))
+
+    def test_a_short_page_corrects_the_count(self):
+        cl = self.changelist(3)
+        self.assertEqual((cl.result_count, cl.paginator.num_pages, cl.page_num), (5, 3, 3))
+        self.assertEqual([order.customer_name for order in cl.result_list], ['Customer 0'])
+
+    def test_a_page_past_the_last_order_shows_the_last_page(self):
+        last_estimated_page = -(-self.estimate // 2)
+        self.assertGreater(last_estimated_page, 3)
+        cl = self.changelist(last_estimated_page)
+        self.assertEqual((cl.result_count, cl.paginator.num_pages, cl.page_num), (5, 3, 3))
+        self.assertEqual([order.customer_name for order in cl.result_list], ['Customer 0'])
+
+    def test_filtered_lists_are_counted_exactly(self):
+        self.client.force_login(self.admin)
+        cl = self.client.get('/admin/core/order/', {'status__exact': 'pending'}).context['cl']
+        self.assertEqual(cl.result_count, 5)
+
+
+@override_settings(METRICS_TOKEN='scrape-secret')
+class MetricsViewTests(TestCase):
+    def test_only_staff_and_token_bearers_get_metrics(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').status_code, 404)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 404)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '# TYPE shop_request_duration_seconds histogram')
+        self.client.force_login(get_user_model().objects.create_user('staff', password='password', is_staff=True))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_empty_token_turns_token_access_off(self):
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer ').status_code, 404)
+
+
+@override_settings(WRITE_QUEUE=True, WRITE_QUEUE_TIMEOUT=0.2)
+class WriteQueueTests(TransactionTestCase):
+    def setUp(self):
+        self.queue = writer.WriteQueue()
+        patcher = mock.patch.object(writer, '_queue', self.queue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.queue.stop)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def block(self):
+        """Occupy the writer thread until self.release is set"""
+        started = threading.Event()
+
+        def job():
+            started.set()
+            self.release.wait(5)
+        self.queue.submit(job)
+        started.wait(5)
+
+    def test_jobs_commit_and_fail_alone(self):
+        def fail():
+            Category.objects.create(name='Rolled back')
+            raise ValueError('bad job')
+
+        self.assertEqual(writer.write(Category.objects.create, name='Boots').name, 'Boots')
+        with self.assertRaisesMessage(ValueError, 'bad job'):
+            writer.write(fail)
+        self.assertEqual(list(Category.objects.values_list('name', flat=True)), ['Boots'])
+
+    def test_timeout_cancels_a_job_that_has_not_started(self):
+        ran = []
+        self.block()
+        with self.assertRaises(writer.WriteTimeout):
+            writer.write(ran.append, 'late')
+        self.release.set()
+        writer.write(lambda: None)
+        self.assertEqual(ran, [])
+
+    def test_timeout_waits_for_a_running_job(self):
+        def slow():
+            time.sleep(0.5)
+            return Category.objects.create(name='Slow').name
+
+        self.assertEqual(writer.write(slow), 'Slow')
+        self.assertTrue(Category.objects.filter(name='Slow').exists())
+
+    def test_async_timeout_cancels_or_waits(self):
+        ran = []
+        self.block()
+        with self.assertRaises(writer.WriteTimeout):
+            async_to_sync(writer.awrite)(ran.append, 'late')
+        self.release.set()
+        self.assertEqual(async_to_sync(writer.awrite)(lambda: time.sleep(0.5) or 'done'), 'done')
+        self.assertEqual(ran, [])
@@ -1,14 +1,24 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# Under ASGI, the hot JSON endpoints can run as native async views
+api = views
+if settings.ASYNC_VIEWS:
+    from . import async_views as api
+
 urlpatterns = [
     path('', views.home, name='home'),
     path('category/<int:category_id>/', views.category_page, name='category_detail'),
     path('cart/', views.cart_view, name='cart'),
     path('checkout/', views.checkout_view, name='checkout'),
-    path('api/cart/add/', views.add_to_cart, name='add_to_cart'),
-    path('api/cart/update/', views.update_cart_item, name='update_cart_item'),
-    path('api/cart/remove/', views.remove_from_cart, name='remove_from_cart'),
+    path('api/category/<int:category_id>/products/', api.category_products_api, name='category_products_api'),
+    path('api/cart/add/', api.add_to_cart, name='add_to_cart'),
+    path('api/cart/update/', api.update_cart_item, name='update_cart_item'),
+    path('api/cart/remove/', api.remove_from_cart, name='remove_from_cart'),
+    path('api/cart/batch/', views.batch_cart, name='batch_cart'),
     path('api/create-order/', views.create_order, name='create_order'),
-    path('api/product-sizes/', views.get_product_sizes, name='get_product_sizes'),
+    path('api/product-sizes/', api.get_product_sizes, name='get_product_sizes'),
+    path('api/search/', views.search_products, name='search_products'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -1,16 +1,51 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse
+from django.db import transaction
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse
+from django.template.loader import render_to_string
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import condition, require_http_methods
+from django.db.models import Count, Max
+from django.utils.cache import patch_cache_control
+from django.utils.crypto import constant_time_compare
+import hashlib
 import json
-from .models import Category, Product, ProductSize, Color, Cart, CartItem, Order, OrderItem
+from urllib.parse import urlencode
+from .models import Category, Product, ProductSize, Color, Cart, CartItem, EmptyCart, Order, OrderItem, StockReservation
+from .checkout import CartEmptyError, OutOfStockError, place_order
+from .pagination import keyset_page
+from . import facets, fragments, metrics, search, writer
+
+CATEGORY_PAGE_SIZE = 12
+MAX_CART_BATCH_OPERATIONS = 100
+MAX_BULK_PRODUCT_IDS = 100
+PRODUCT_SIZES_MAX_AGE = 30
+PRODUCT_SIZE_FIELDS = ('product_id', 'size', 'price', 'stock_quantity', 'is_available')
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+
+CATEGORY_IMAGE_URLS = {
+    'Sneakers': 'https://images.pexels.com/photos/112285/pexels-photo-112285.jpeg',
+    'Sandals': 'https://images.pexels.com/photos/40737/sandals-flip-flops-footwear-beach-40737.jpeg',
+    'Boots': 'https://images.pexels.com/photos/267309/pexels-photo-267309.jpeg',
+    'Running': 'https://images.pexels.com/photos/112285/pexels-photo-112285.jpeg',
+    'Basketball': 'https://images.pexels.com/photos/112285/pexels-photo-112285.jpeg',
+    'Training': 'https://images.pexels.com/photos/112285/pexels-photo-112285.jpeg',
+    'Skateboarding': 'https://images.pexels.com/photos/112285/pexels-photo-112285.jpeg',
+    'Flip Flops': 'https://images.pexels.com/photos/40737/sandals-flip-flops-footwear-beach-40737.jpeg',
+    'Hiking': 'https://images.pexels.com/photos/267309/pexels-photo-267309.jpeg',
+    'Lifestyle': 'https://images.pexels.com/photos/112285/pexels-photo-112285.jpeg',
+    'Beachwear': 'https://images.pexels.com/photos/40737/sandals-flip-flops-footwear-beach-40737.jpeg',
+    'Winter': 'https://images.pexels.com/photos/267309/pexels-photo-267309.jpeg',
+}
+DEFAULT_CATEGORY_IMAGE_URL = 'https://images.pexels.com/photos/112285/pexels-photo-112285.jpeg'
 
 def home(request):
-    # Get categories from database
-    categories = Category.objects.filter(is_active=True)
+    # Get categories from database (evaluated once, product counts are stored on the row)
+    categories = list(Category.objects.filter(is_active=True))
     
     # If no categories exist, create some default ones
-    if not categories.exists():
+    if not categories:
         default_categories = [
             {'name': 'Sneakers', 'description': 'Casual & athletic footwear'},
             {'name': 'Sandals', 'description': 'Open & comfortable designs'},
@@ -32,34 +67,16 @@ def home(request):
                 description=cat_data['description']
             )
         
-        categories = Category.objects.filter(is_active=True)
+        categories = list(Category.objects.filter(is_active=True))
     
     # Create shoe_items for the grid layout
     shoe_items = []
     for category in categories:
-        # Get product count for this category
-        product_count = Product.objects.filter(category=category, is_active=True).count()
-        
-        # Define image URLs for each category
-        image_urls = {
-            'Sneakers': 'https://images.pexels.com/photos/112285/pexels-photo-112285.jpeg',
-            'Sandals': 'https://images.pexels.com/photos/40737/sandals-flip-flops-footwear-beach-40737.jpeg',
-            'Boots': 'https://images.pexels.com/photos/267309/pexels-photo-267309.jpeg',
-            'Running': 'https://images.pexels.com/photos/112285/pexels-photo-112285.jpeg',
-            'Basketball': 'https://images.pexels.com/photos/112285/pexels-photo-112285.jpeg',
-            'Training': 'https://images.pexels.com/photos/112285/pexels-photo-112285.jpeg',
-            'Skateboarding': 'https://images.pexels.com/photos/112285/pexels-photo-112285.jpeg',
-            'Flip Flops': 'https://images.pexels.com/photos/40737/sandals-flip-flops-footwear-beach-40737.jpeg',
-            'Hiking': 'https://images.pexels.com/photos/267309/pexels-photo-267309.jpeg',
-            'Lifestyle': 'https://images.pexels.com/photos/112285/pexels-photo-112285.jpeg',
-            'Beachwear': 'https://images.pexels.com/photos/40737/sandals-flip-flops-footwear-beach-40737.jpeg',
-            'Winter': 'https://images.pexels.com/photos/267309/pexels-photo-267309.jpeg',
-        }
-        
         shoe_items.append({
             'name': category.name,
-            'image_url': category.image.url if category.image else image_urls.get(category.name, 'https://images.pexels.com/photos/112285/pexels-photo-112285.jpeg'),
-            'count': product_count if product_count > 0 else 'New',
+            'image_url': CATEGORY_IMAGE_URLS.get(category.name, DEFAULT_CATEGORY_IMAGE_URL),
+            'image_sources': category.image_sources,
+            'count': category.product_count if category.product_count > 0 else 'New',
             'category_id': category.id
         })
     
@@ -105,7 +122,7 @@ def home(request):
         ]
     
     # Get cart for cart count
-    cart = get_or_create_cart(request)
+    cart = get_cart(request)
     
     context = {
         'categories': categories,
@@ -120,24 +137,90 @@ def home(request):
     }
     return render(request, "core/home.html", context)
 
+def category_products(category):
+    """Active products of a category; sizes and colors are loaded by core.fragments for uncached cards only"""
+    return Product.objects.filter(category=category, is_active=True)
+
+def _product_card_data(product):
+    return {
+        'id': product.id,
+        'name': product.name,
+        'description': product.description,
+        'video_url': product.video_url,
+        'min_price': str(product.min_price),
+        'max_price': str(product.max_price),
+        'sizes': [
+            {'size': size.size, 'price': str(size.price), 'is_available': size.is_available}
+            for size in product.product_sizes.all()
+        ],
+        'colors': [
+            {'id': color.id, 'name': color.name, 'hex_code': color.hex_code}
+            for color in product.colors.all()
+        ],
+    }
+
 def category_page(request, category_id):
     category = get_object_or_404(Category, id=category_id)
-    products = Product.objects.filter(category=category)
-    cart = get_or_create_cart(request)
+    selection = facets.parse_selection(request.GET)
+    products = facets.filter_products(category_products(category), category, selection)
+    try:
+        products, next_cursor = keyset_page(products, request.GET.get('after'), CATEGORY_PAGE_SIZE)
+    except ValueError:
+        products, next_cursor = keyset_page(products, None, CATEGORY_PAGE_SIZE)
+    products = fragments.render_product_cards(products, first_index=0)
+    cart = get_cart(request)
     context = {
         'category': category,
         'products': products,
+        'next_cursor': next_cursor,
+        'facets': facets.facet_counts(category, selection),
+        'selection': selection,
+        'filter_query': urlencode(selection, doseq=True),
         'cart': cart
     }
     return render(request, 'core/category_page.html', context)
 
+@require_http_methods(["GET"])
+def category_products_api(request, category_id):
+    """Next page of a category listing for infinite scroll, with the same facet filters as the page.
+
+    Pass ?facets=1 to also get the facet counts.
+    """
+    try:
+        category = get_object_or_404(Category, id=category_id)
+        selection = facets.parse_selection(request.GET)
+        products, next_cursor = keyset_page(
+            facets.filter_products(category_products(category), category, selection),
+            request.GET.get('after'),
+            CATEGORY_PAGE_SIZE
+        )
+        
+        product_data = fragments.cached_per_product(products, 'data', _product_card_data)
+        html = ''.join(
+            render_to_string('core/_product_card.html', {'product': product, 'index': None}, request=request)
+            for product in fragments.render_product_cards(products)
+        )
+        
+        response = {
+            'success': True,
+            'products': product_data,
+            'html': html,
+            'next_cursor': next_cursor
+        }
+        if request.GET.get('facets'):
+            response['facets'] = facets.facet_counts(category, selection)
+        return JsonResponse(response)
+        
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)})
+
 def cart_view(request):
-    cart = get_or_create_cart(request)
+    cart = get_cart(request)
     context = {'cart': cart, 'cart_items': cart.items.select_related('product', 'color').all()}
     return render(request, 'core/cart.html', context)
 
 def checkout_view(request):
-    cart = get_or_create_cart(request)
+    cart = get_cart(request)
     cart_items = cart.items.select_related('product', 'color').all()
     
     if not cart_items:
@@ -149,7 +232,19 @@ def checkout_view(request):
     }
     return render(request, 'core/checkout.html', context)
 
+def get_cart(request):
+    """Return the visitor's cart without creating a session or a Cart row.
+
+    Visitors who never added anything get an EmptyCart, so browsing pages
+    cause no database writes.
+    """
+    session_id = request.session.session_key
+    if not session_id:
+        return EmptyCart()
+    return Cart.objects.filter(session_id=session_id).first() or EmptyCart()
+
 def get_or_create_cart(request):
+    """Return the visitor's cart, creating the session and the Cart row if needed"""
     session_id = request.session.session_key
     if not session_id:
         request.session.create()
@@ -157,40 +252,64 @@ def get_or_create_cart(request):
     cart, created = Cart.objects.get_or_create(session_id=session_id)
     return cart
 
+def add_to_visitor_cart(request, product, size, color, quantity):
+    """Write job of an add: the visitor's session and cart are created in the
+    same transaction as the line, and go with it if the add fails.
+    """
+    new_session = not request.session.session_key
+    try:
+        with transaction.atomic():
+            cart = get_or_create_cart(request)
+            # Add to the matching cart line; the cart totals are updated in the same transaction
+            cart.add_item(product, size, color, quantity, price_per_unit=product.base_price)
+    except Exception:
+        if new_session:
+            # Its row was rolled back: don't let the response save or send the session
+            request.session.flush()
+        raise
+    return cart
+
+def _requested_quantity(data):
+    quantity = int(data.get('quantity', 1))
+    if quantity < 1:
+        raise ValueError('Quantity must be at least 1')
+    return quantity
+
+def _requested_cart_line(data):
+    """(product_id, size, color_id, quantity) of an add request, shared by the sync, async and batch endpoints"""
+    product_id = data.get('product_id')
+    size = data.get('size')
+    if not product_id or not size:
+        raise ValueError('Product ID and size are required')
+    return product_id, size, data.get('color_id'), _requested_quantity(data)
+
+def _cart_response(cart, **extra):
+    """Success response of a cart change, with the cart's stored totals"""
+    return JsonResponse({
+        'success': True,
+        **extra,
+        'cart_total': str(cart.total_amount),
+        'cart_count': cart.total_items
+    })
+
+def _missing_cart_item():
+    """Answer for an item id that is not a line of the visitor's own cart"""
+    return JsonResponse({'success': False, 'error': 'Cart item not found'}, status=404)
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def add_to_cart(request):
     try:
-        data = json.loads(request.body)
-        product_id = data.get('product_id')
-        size = data.get('size')
-        color_id = data.get('color_id')
-        quantity = int(data.get('quantity', 1))
-        
-        if not product_id or not size:
-            return JsonResponse({'success': False, 'error': 'Product ID and size are required'})
+        product_id, size, color_id, quantity = _requested_cart_line(json.loads(request.body))
         
         product = get_object_or_404(Product, id=product_id)
-        cart = get_or_create_cart(request)
-        
-        # Get or create cart item
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            size=size,
-            color_id=color_id if color_id else None,
-            defaults={'quantity': quantity, 'price_per_unit': product.base_price}
-        )
+        color = get_object_or_404(Color, id=color_id, product=product) if color_id else None
+        # Checked before anything is written, so a rejected add leaves no session or cart behind
+        StockReservation.check_available(product.id, size, quantity)
         
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
+        cart = writer.write(add_to_visitor_cart, request, product, size, color, quantity)
         
-        return JsonResponse({
-            'success': True,
-            'cart_count': cart.total_items,
-            'cart_total': str(cart.total_amount)
-        })
+        return _cart_response(cart)
         
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)})
@@ -200,44 +319,108 @@ def add_to_cart(request):
 def update_cart_item(request):
     try:
         data = json.loads(request.body)
-        item_id = data.get('item_id')
-        quantity = int(data.get('quantity', 1))
+        quantity = _requested_quantity(data)
         
-        if quantity < 1:
-            return JsonResponse({'success': False, 'error': 'Quantity must be at least 1'})
+        cart = get_cart(request)
+        cart_item = cart.items.filter(id=data.get('item_id')).first()
+        if cart_item is None:
+            return _missing_cart_item()
+        writer.write(cart.set_item_quantity, cart_item, quantity)
         
-        cart_item = get_object_or_404(CartItem, id=item_id)
-        cart_item.quantity = quantity
-        cart_item.save()
+        return _cart_response(cart, item_total=str(cart_item.total_price))
         
-        cart = cart_item.cart
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)})
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def remove_from_cart(request):
+    try:
+        data = json.loads(request.body)
         
-        return JsonResponse({
-            'success': True,
-            'item_total': str(cart_item.total_price),
-            'cart_total': str(cart.total_amount),
-            'cart_count': cart.total_items
-        })
+        cart = get_cart(request)
+        cart_item = cart.items.filter(id=data.get('item_id')).first()
+        if cart_item is None:
+            return _missing_cart_item()
+        writer.write(cart.remove_item, cart_item)
+        
+        return _cart_response(cart)
         
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)})
 
+def apply_cart_operation(request, cart, operation):
+    """Apply one add/update/remove operation of a batch; returns (cart, result)"""
+    op = operation.get('op')
+    
+    if op == 'add':
+        product_id, size, color_id, quantity = _requested_cart_line(operation)
+        try:
+            product = Product.objects.get(id=product_id)
+            color = Color.objects.get(id=color_id, product=product) if color_id else None
+        except (Product.DoesNotExist, Color.DoesNotExist):
+            raise ValueError('Product or color not found')
+        if cart.pk is None:
+            cart = get_or_create_cart(request)
+        item = cart.add_item(product, size, color, quantity, price_per_unit=product.base_price)
+        return cart, {'item_id': item.id, 'quantity': item.quantity, 'item_total': str(item.total_price)}
+    
+    if op in ('update', 'remove'):
+        try:
+            item = cart.items.get(id=operation.get('item_id'))
+        except (CartItem.DoesNotExist, ValueError, TypeError):
+            raise ValueError('Cart item not found')
+        if op == 'remove':
+            cart.remove_item(item)
+            return cart, {'item_id': item.id}
+        cart.set_item_quantity(item, _requested_quantity(operation))
+        return cart, {'item_id': item.id, 'quantity': item.quantity, 'item_total': str(item.total_price)}
+    
+    raise ValueError(f'Unknown operation: {op!r}')
+
+def apply_cart_operations(request, cart, operations):
+    """Apply a batch in one transaction, each operation in its own savepoint; returns (cart, results)"""
+    results = []
+    with transaction.atomic():
+        for operation in operations:
+            try:
+                if not isinstance(operation, dict):
+                    raise ValueError('Operation must be an object')
+                with transaction.atomic():
+                    cart, result = apply_cart_operation(request, cart, operation)
+                results.append({'success': True, **result})
+            except ValueError as e:
+                results.append({'success': False, 'error': str(e)})
+    return cart, results
+
 @csrf_exempt
 @require_http_methods(["POST"])
-def remove_from_cart(request):
+def batch_cart(request):
+    """Apply an ordered list of cart operations in a single transaction.
+
+    Each operation runs in its own savepoint, so a failing one is reported
+    in its result and the others still apply.
+    """
     try:
         data = json.loads(request.body)
-        item_id = data.get('item_id')
+        operations = data.get('operations')
         
-        cart_item = get_object_or_404(CartItem, id=item_id)
-        cart = cart_item.cart
-        cart_item.delete()
+        if not isinstance(operations, list) or not operations:
+            return JsonResponse({'success': False, 'error': 'A list of operations is required'})
+        if len(operations) > MAX_CART_BATCH_OPERATIONS:
+            return JsonResponse({
+                'success': False,
+                'error': f'At most {MAX_CART_BATCH_OPERATIONS} operations are allowed per batch'
+            })
         
-        return JsonResponse({
-            'success': True,
-            'cart_total': str(cart.total_amount),
-            'cart_count': cart.total_items
-        })
+        if not request.session.session_key and any(
+            isinstance(operation, dict) and operation.get('op') == 'add' for operation in operations
+        ):
+            # Outside the operations' savepoints, so a rolled back first add cannot take the session row with it
+            request.session.create()
+        cart, results = writer.write(apply_cart_operations, request, get_cart(request), operations)
+        
+        return _cart_response(cart, success=all(result['success'] for result in results), results=results)
         
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)})
@@ -257,35 +440,21 @@ def create_order(request):
         if not all([customer_name, customer_phone, customer_city, customer_address]):
             return JsonResponse({'success': False, 'error': 'All customer details are required'})
         
-        cart = get_or_create_cart(request)
-        cart_items = cart.items.all()
+        cart = get_cart(request)
         
-        if not cart_items:
-            return JsonResponse({'success': False, 'error': 'Cart is empty'})
-        
-        # Create order
-        order = Order.objects.create(
-            customer_name=customer_name,
-            phone_number=customer_phone,
-            city=customer_city,
-            address=customer_address,
-            total_amount=cart.total_amount
-        )
-        
-        # Create order items
-        for cart_item in cart_items:
-            OrderItem.objects.create(
-                order=order,
-                product=cart_item.product,
-                size=cart_item.size,
-                color=cart_item.color,
-                quantity=cart_item.quantity,
-                price_per_unit=cart_item.price_per_unit,
-                total_price=cart_item.total_price
+        try:
+            order = writer.write(
+                place_order,
+                cart,
+                customer_name=customer_name,
+                phone_number=customer_phone,
+                city=customer_city,
+                address=customer_address
             )
-        
-        # Clear the cart
-        cart_items.delete()
+        except CartEmptyError as e:
+            return JsonResponse({'success': False, 'error': str(e)})
+        except OutOfStockError as e:
+            return JsonResponse({'success': False, 'error': str(e), 'out_of_stock': e.lines})
         
         return JsonResponse({
             'success': True,
@@ -296,25 +465,161 @@ def create_order(request):
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)})
 
+def _requested_product_ids(request):
+    """Product ids of a sizes request, from ?product_ids=1,2,3 or ?product_id=1"""
+    if 'product_ids' in request.GET:
+        raw_ids = request.GET['product_ids'].split(',')
+    else:
+        raw_ids = [request.GET.get('product_id', '')]
+    product_ids = sorted({int(raw_id) for raw_id in raw_ids if raw_id.strip()})
+    if len(product_ids) > MAX_BULK_PRODUCT_IDS:
+        raise ValueError(f'At most {MAX_BULK_PRODUCT_IDS} product IDs are allowed')
+    return product_ids
+
+def _product_sizes_aggregates():
+    return {
+        'products': Count('pk', distinct=True),
+        'sizes': Count('product_sizes'),
+        'product_updated_at': Max('updated_at'),
+        'size_updated_at': Max('product_sizes__updated_at'),
+    }
+
+def _product_sizes_state(request):
+    """Aggregate version of the requested products and their sizes, computed once per request"""
+    if not hasattr(request, '_product_sizes_state'):
+        state = None
+        try:
+            product_ids = _requested_product_ids(request)
+        except ValueError:
+            product_ids = []
+        if product_ids:
+            state = Product.objects.filter(pk__in=product_ids).aggregate(**_product_sizes_aggregates())
+            state['product_ids'] = product_ids
+        request._product_sizes_state = state
+    return request._product_sizes_state
+
+def _product_sizes_etag(request):
+    state = _product_sizes_state(request)
+    if not state or not state['products']:
+        return None
+    fingerprint = '|'.join(str(value) for value in (
+        ','.join(map(str, state['product_ids'])),
+        state['products'],
+        state['sizes'],
+        state['product_updated_at'].isoformat(),
+        state['size_updated_at'].isoformat() if state['size_updated_at'] else '',
+    ))
+    return hashlib.md5(fingerprint.encode(), usedforsecurity=False).hexdigest()
+
+def _product_sizes_last_modified(request):
+    state = _product_sizes_state(request)
+    if not state or not state['products']:
+        return None
+    return max(filter(None, [state['product_updated_at'], state['size_updated_at']]))
+
+def _size_data(size):
+    return {
+        'size': size['size'],
+        'price': str(size['price']),
+        'stock_quantity': size['stock_quantity'],
+        'is_available': size['is_available'],
+        'in_stock': size['is_available'] and size['stock_quantity'] > 0,
+    }
+
+def _product_sizes_response(bulk, product_ids, sizes):
+    if not bulk:
+        response = JsonResponse({'success': True, 'sizes': [_size_data(size) for size in sizes]})
+    else:
+        products = {str(product_id): [] for product_id in product_ids}
+        for size in sizes:
+            products[str(size['product_id'])].append(_size_data(size))
+        response = JsonResponse({'success': True, 'products': products})
+    
+    patch_cache_control(response, public=True, max_age=PRODUCT_SIZES_MAX_AGE, must_revalidate=True)
+    return response
+
 @csrf_exempt
 @require_http_methods(["GET"])
+@condition(etag_func=_product_sizes_etag, last_modified_func=_product_sizes_last_modified)
 def get_product_sizes(request):
+    """Sizes, prices and stock of one product (?product_id=) or many (?product_ids=1,2,3).
+
+    Responses carry ETag/Last-Modified from the product and size update
+    times, so unchanged data is answered with 304 Not Modified.
+    """
     try:
-        product_id = request.GET.get('product_id')
-        if not product_id:
+        bulk = 'product_ids' in request.GET
+        product_ids = _requested_product_ids(request)
+        if not product_ids:
             return JsonResponse({'success': False, 'error': 'Product ID is required'})
         
-        product = get_object_or_404(Product, id=product_id)
-        sizes = ProductSize.objects.filter(product=product)
+        state = _product_sizes_state(request)
+        if not state['products']:
+            return JsonResponse({'success': False, 'error': 'No Product matches the given query.'})
         
-        size_data = []
-        for size in sizes:
-            size_data.append({
-                'size': size.size,
-                'price': str(size.price)
+        sizes = ProductSize.objects.filter(product_id__in=product_ids).values(*PRODUCT_SIZE_FIELDS)
+        return _product_sizes_response(bulk, product_ids, sizes)
+        
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)})
+
+
+@require_http_methods(["GET"])
+def search_products(request):
+    """Ranked, prefix-aware product search over name, description, category and colors"""
+    try:
+        limit = max(1, min(int(request.GET.get('limit', SEARCH_PAGE_SIZE)), MAX_SEARCH_PAGE_SIZE))
+        offset = max(int(request.GET.get('offset', 0)), 0)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'limit and offset must be integers'}, status=400)
+    
+    try:
+        query = request.GET.get('q', '').strip()
+        
+        if search.is_available():
+            product_ids = search.search_product_ids(query, limit=limit, offset=offset)
+        else:
+            product_ids = list(
+                Product.objects.filter(is_active=True, name__icontains=query)
+                .values_list('id', flat=True)[offset:offset + limit]
+            ) if query else []
+        products = Product.objects.select_related('category').in_bulk(product_ids)
+        
+        results = []
+        for product_id in product_ids:
+            product = products.get(product_id)
+            if product is None:
+                continue
+            results.append({
+                'id': product.id,
+                'name': product.name,
+                'category': product.category.name,
+                'category_id': product.category_id,
+                'min_price': str(product.min_price),
+                'max_price': str(product.max_price),
+                'in_stock': product.total_stock > 0,
             })
         
-        return JsonResponse({'success': True, 'sizes': size_data})
+        return JsonResponse({'success': True, 'query': query, 'results': results})
         
-    except Exception as e:
-        return JsonResponse({'success': False, 'error': str(e)})
\ No newline at end of file
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)})
+
+
+def _has_metrics_token(request):
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return bool(settings.METRICS_TOKEN) and scheme.lower() == 'bearer' and constant_time_compare(
+        token.strip(), settings.METRICS_TOKEN
+    )
+
+
+@require_http_methods(["GET"])
+def metrics_view(request):
+    """Request histograms of this process in the Prometheus text format, for staff and METRICS_TOKEN bearers.
+
+    The client address is not trusted: behind a reverse proxy every request
+    comes from the proxy's.
+    """
+    if not request.user.is_staff and not _has_metrics_token(request):
+        raise Http404
+    return HttpResponse(metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,146 @@
+import asyncio
+import contextvars
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections, transaction
+
+
+class WriteTimeout(Exception):
+    pass
+
+
+class WriteQueue:
+    """A single thread that runs queued write jobs, many per transaction.
+
+    SQLite has one writer at a time; instead of every request thread waiting
+    for the lock, jobs are handed to this thread, which drains whatever has
+    queued up (at most max_batch jobs) and runs it in one transaction with a
+    savepoint per job. A failing job only rolls back its own savepoint. The
+    futures are resolved after the commit, so a caller never sees a result
+    that could still be rolled back.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS, max_batch=50):
+        self.using = using
+        self.max_batch = max_batch
+        self._jobs = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name=f'write-queue-{using}', daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        # Run the job in the caller's context, so its queries count towards the
+        # caller's request in core.metrics
+        context = contextvars.copy_context()
+        self._jobs.put((future, context.run, (fn, *args), kwargs))
+        return future
+
+    def stop(self):
+        """Finish the queued jobs and end the thread"""
+        self._jobs.put(None)
+        self._thread.join()
+
+    def _next_batch(self):
+        batch = [self._jobs.get()]
+        while len(batch) < self.max_batch and batch[-1] is not None:
+            try:
+                batch.append(self._jobs.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            stopping = batch[-1] is None
+            jobs = [job for job in batch if job is not None and job[0].set_running_or_notify_cancel()]
+            if jobs:
+                self._run_batch(jobs)
+            if stopping:
+                connections[self.using].close()
+                return
+
+    def _run_batch(self, jobs):
+        close_old_connections()
+        outcomes = []
+        try:
+            with transaction.atomic(using=self.using):
+                for future, fn, args, kwargs in jobs:
+                    try:
+                        with transaction.atomic(using=self.using):
+                            outcomes.append((future, True, fn(*args, **kwargs)))
+                    except Exception as exc:
+                        outcomes.append((future, False, exc))
+        except Exception as exc:
+            # The commit itself failed: nothing of this batch was written
+            for future, fn, args, kwargs in jobs:
+                future.set_exception(exc)
+            return
+        for future, ok, value in outcomes:
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = WriteQueue(max_batch=settings.WRITE_QUEUE_MAX_BATCH)
+        return _queue
+
+
+def submit(fn, *args, **kwargs):
+    """Run fn(*args, **kwargs) as a write job and return a Future for its result.
+
+    With WRITE_QUEUE disabled the job runs right here, in the caller's thread.
+    """
+    if settings.WRITE_QUEUE:
+        return get_queue().submit(fn, *args, **kwargs)
+    future = Future()
+    try:
+        future.set_result(fn(*args, **kwargs))
+    except Exception as exc:
+        future.set_exception(exc)
+    return future
+
+
+def write(fn, *args, **kwargs):
+    """submit() and wait for the result; the job's exception is raised here.
+
+    After WRITE_QUEUE_TIMEOUT a job that has not started is cancelled and
+    WriteTimeout raised. One that has started may still commit, so it is
+    waited for: reporting a failure then would make the client retry a write
+    that went through.
+    """
+    future = submit(fn, *args, **kwargs)
+    try:
+        return future.result(timeout=settings.WRITE_QUEUE_TIMEOUT)
+    except FutureTimeoutError:
+        if future.cancel():
+            raise WriteTimeout('The store is busy, please try again')
+        return future.result()
+
+
+async def awrite(fn, *args, **kwargs):
+    """write() for async views; with the queue on, waiting for the job holds no thread"""
+    if not settings.WRITE_QUEUE:
+        return await sync_to_async(fn)(*args, **kwargs)
+    future = get_queue().submit(fn, *args, **kwargs)
+    waiter = asyncio.wrap_future(future)
+    try:
+        # Shielded, so the timeout leaves the decision to cancel to the code below
+        return await asyncio.wait_for(asyncio.shield(waiter), settings.WRITE_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        if future.cancel():
+            raise WriteTimeout('The store is busy, please try again')
+        return await waiter